@@ -0,0 +1,221 @@
+"""
+A local stand-in for a ComfyUI pod, so the backend can be run and load-tested
+without a GPU or RunPod. It speaks the parts of the ComfyUI API the backend
+uses: /prompt, /ws events, /history/{id}, /view, /upload/image, /queue
+(listing and deleting) and /interrupt.
+
+Each prompt waits for one of `gpus` render slots, sends execution_start and
+progress events, then "renders" batch_size noise PNGs of the configured size
+(random pixels, so they compress about as badly as real renders; a text chunk
+naming the file keeps every output's bytes distinct).
+
+    cd backend && python -m benchmarks.fake_comfy --port 8188 --latency 2 --image-size 1024x576
+    COMFYUI_ADDRESS=127.0.0.1:8188 uvicorn main:app --port 8000
+
+The same settings can be given as FAKE_COMFY_LATENCY, FAKE_COMFY_IMAGE_SIZE and
+FAKE_COMFY_GPUS when serving `benchmarks.fake_comfy:app` with uvicorn directly.
+"""
+import os
+import json
+import uuid
+import zlib
+import struct
+import random
+import asyncio
+import argparse
+from email import policy
+from email.parser import BytesParser
+from functools import lru_cache
+
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response
+
+LATENCY = float(os.getenv("FAKE_COMFY_LATENCY", "1.0"))
+IMAGE_SIZE = os.getenv("FAKE_COMFY_IMAGE_SIZE", "1024x576")
+GPUS = int(os.getenv("FAKE_COMFY_GPUS", "1"))
+PROGRESS_STEPS = 4
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+@lru_cache(maxsize=8)
+def noise_png(width, height):
+    """(head, tail) of a valid RGB PNG of random pixels (no Pillow needed); text chunks go in between"""
+    rng = random.Random(width * height)
+    raw = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    head = b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", header)
+    return head, png_chunk(b"IDAT", zlib.compress(raw, 1)) + png_chunk(b"IEND", b"")
+
+
+def output_png(width, height, name):
+    head, tail = noise_png(width, height)
+    return head + png_chunk(b"tEXt", b"Comment\x00" + name.encode()) + tail
+
+
+def form_files(content_type, body):
+    """{field: (filename, bytes)} of a multipart body (stdlib only, so no python-multipart needed)"""
+    message = BytesParser(policy=policy.default).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    return {
+        part.get_param("name", header="content-disposition"): (part.get_filename(), part.get_payload(decode=True))
+        for part in message.iter_parts()
+    }
+
+
+def parse_size(size):
+    width, height = size.lower().split("x")
+    return int(width), int(height)
+
+
+class FakeComfy:
+    def __init__(self, latency=LATENCY, image_size=IMAGE_SIZE, gpus=GPUS):
+        self.latency = latency
+        self.width, self.height = parse_size(image_size)
+        self.slots = asyncio.Semaphore(gpus)
+        self.sockets = {}
+        self.history = {}
+        self.outputs = {}
+        self.inputs = {}
+        self.pending = {}
+        self.running = set()
+
+    async def send(self, client_id, message):
+        ws = self.sockets.get(client_id)
+        if ws is None:
+            return
+        try:
+            await ws.send_text(json.dumps(message))
+        except Exception:
+            self.sockets.pop(client_id, None)
+
+    async def render(self, prompt_id, client_id, workflow):
+        try:
+            async with self.slots:
+                self.running.add(prompt_id)
+                await self.send(client_id, {"type": "execution_start", "data": {"prompt_id": prompt_id}})
+                for step in range(1, PROGRESS_STEPS + 1):
+                    await asyncio.sleep(self.latency / PROGRESS_STEPS)
+                    await self.send(client_id, {"type": "progress", "data": {"value": step, "max": PROGRESS_STEPS, "prompt_id": prompt_id, "node": "3"}})
+
+                batch_size = max([node["inputs"].get("batch_size", 1) for node in workflow.values()] or [1])
+                images = []
+                for index in range(batch_size):
+                    filename = f"ComfyUI_{prompt_id[:8]}_{index:05d}_.png"
+                    self.outputs[filename] = (self.width, self.height)
+                    images.append({"filename": filename, "subfolder": "", "type": "output"})
+                self.history[prompt_id] = {
+                    "prompt": [0, prompt_id, workflow, {}, []],
+                    "outputs": {"9": {"images": images}},
+                    "status": {"status_str": "success", "completed": True, "messages": []},
+                }
+                await self.send(client_id, {"type": "executed", "data": {"node": "9", "output": {"images": images}, "prompt_id": prompt_id}})
+                await self.send(client_id, {"type": "execution_success", "data": {"prompt_id": prompt_id}})
+                await self.send(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+        except asyncio.CancelledError:
+            self.history[prompt_id] = {"outputs": {}, "status": {"status_str": "error", "completed": False, "messages": []}}
+            await self.send(client_id, {"type": "execution_interrupted", "data": {"prompt_id": prompt_id}})
+        finally:
+            self.running.discard(prompt_id)
+            self.pending.pop(prompt_id, None)
+
+
+def create_app(fake: FakeComfy = None):
+    app = FastAPI(title="Fake ComfyUI")
+    fake = fake or FakeComfy()
+
+    @app.post("/prompt")
+    async def queue_prompt(request: Request):
+        body = json.loads(await request.body())
+        workflow = body.get("prompt")
+        if not isinstance(workflow, dict):
+            raise HTTPException(status_code=400, detail="prompt must be a workflow object")
+        prompt_id = str(uuid.uuid4())
+        fake.pending[prompt_id] = asyncio.create_task(fake.render(prompt_id, body.get("client_id"), workflow))
+        return {"prompt_id": prompt_id, "number": len(fake.pending), "node_errors": {}}
+
+    @app.websocket("/ws")
+    async def events(ws: WebSocket, clientId: str = ""):
+        await ws.accept()
+        fake.sockets[clientId] = ws
+        await ws.send_text(json.dumps({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": len(fake.pending)}}, "sid": clientId}}))
+        try:
+            while True:
+                await ws.receive_text()
+        except WebSocketDisconnect:
+            if fake.sockets.get(clientId) is ws:
+                del fake.sockets[clientId]
+
+    @app.get("/history/{prompt_id}")
+    async def history(prompt_id: str):
+        entry = fake.history.get(prompt_id)
+        return {prompt_id: entry} if entry else {}
+
+    @app.api_route("/view", methods=["GET", "HEAD"])
+    async def view(filename: str, type: str = "output", subfolder: str = ""):
+        if type == "input":
+            if filename not in fake.inputs:
+                raise HTTPException(status_code=404)
+            return Response(fake.inputs[filename], media_type="image/png")
+        if filename not in fake.outputs:
+            raise HTTPException(status_code=404)
+        return Response(output_png(*fake.outputs[filename], filename), media_type="image/png")
+
+    @app.post("/upload/image")
+    async def upload_image(request: Request):
+        files = form_files(request.headers.get("content-type", ""), await request.body())
+        if "image" not in files:
+            raise HTTPException(status_code=400, detail="image field required")
+        filename, data = files["image"]
+        fake.inputs[filename] = data
+        return {"name": filename, "subfolder": "", "type": "input"}
+
+    @app.get("/queue")
+    async def queue():
+        running = [[0, prompt_id] for prompt_id in fake.running]
+        pending = [[0, prompt_id] for prompt_id in fake.pending if prompt_id not in fake.running]
+        return {"queue_running": running, "queue_pending": pending}
+
+    @app.post("/queue")
+    async def manage_queue(request: Request):
+        body = json.loads(await request.body() or b"{}")
+        # Like ComfyUI, "delete" only removes prompts that have not started
+        prompt_ids = list(fake.pending) if body.get("clear") else body.get("delete", [])
+        for prompt_id in prompt_ids:
+            task = fake.pending.get(prompt_id)
+            if task and prompt_id not in fake.running:
+                task.cancel()
+        return {}
+
+    @app.post("/interrupt")
+    async def interrupt(request: Request):
+        body = json.loads(await request.body() or b"{}")
+        # A prompt_id interrupts only that prompt (if running); none interrupts everything running
+        targets = [body["prompt_id"]] if body.get("prompt_id") else list(fake.running)
+        for prompt_id in targets:
+            task = fake.pending.get(prompt_id)
+            if task and prompt_id in fake.running:
+                task.cancel()
+        return {}
+
+    return app
+
+
+app = create_app()
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--latency", type=float, default=LATENCY, help="seconds per prompt")
+    parser.add_argument("--image-size", default=IMAGE_SIZE, help="WIDTHxHEIGHT of output images")
+    parser.add_argument("--gpus", type=int, default=GPUS, help="prompts rendered at the same time")
+    args = parser.parse_args()
+    uvicorn.run(create_app(FakeComfy(args.latency, args.image_size, args.gpus)), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
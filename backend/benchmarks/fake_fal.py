@@ -0,0 +1,223 @@
+"""
+A local stand-in for fal's queue API, so video (and fal image) jobs can be run
+and tested without a FAL_KEY or spending money. It speaks the parts the
+backend uses: POST /{app} (with ?fal_webhook=), GET .../requests/{id}/status,
+GET .../requests/{id}, PUT .../requests/{id}/cancel, plus /files/ for the
+outputs. Webhook calls carry fal's X-Fal-Webhook-* signature headers, made
+with a key generated per run and published at /.well-known/jwks.json.
+
+Each request waits for one of `concurrency` slots (IN_QUEUE, with a position),
+runs for `latency` seconds (IN_PROGRESS), then completes and, if the submit
+named a webhook, POSTs fal's callback body to it. Video apps return an MP4:
+the --video file, else a test pattern when ffmpeg is on the PATH, else
+placeholder bytes (enough for the download path, not for preview extraction).
+Image apps return a noise PNG.
+
+    cd backend && python -m benchmarks.fake_fal --port 8189 --latency 5
+    FAL_KEY=local FAL_QUEUE_URL=http://127.0.0.1:8189 FAL_INLINE_INPUTS=true \\
+        FAL_WEBHOOK_URL=http://127.0.0.1:8000/webhooks/fal \\
+        FAL_JWKS_URL=http://127.0.0.1:8189/.well-known/jwks.json uvicorn main:app --port 8000
+"""
+import os
+import json
+import time
+import uuid
+import base64
+import shutil
+import hashlib
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from functools import lru_cache
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+from benchmarks.fake_comfy import output_png
+
+LATENCY = float(os.getenv("FAKE_FAL_LATENCY", "5.0"))
+CONCURRENCY = int(os.getenv("FAKE_FAL_CONCURRENCY", "2"))
+VIDEO_FILE = os.getenv("FAKE_FAL_VIDEO")
+
+
+@lru_cache(maxsize=1)
+def sample_video(path=None):
+    """Bytes of the MP4 every video request returns"""
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg:
+        with tempfile.TemporaryDirectory() as directory:
+            target = os.path.join(directory, "sample.mp4")
+            subprocess.run(
+                [ffmpeg, "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=size=1280x720:rate=24:duration=5",
+                 "-c:v", "libx264", "-pix_fmt", "yuv420p", "-movflags", "+faststart", target],
+                check=True,
+            )
+            with open(target, "rb") as f:
+                return f.read()
+    # An ftyp box and nothing playable after it
+    return b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom" + os.urandom(64 * 1024)
+
+
+class FakeFal:
+    def __init__(self, latency=LATENCY, concurrency=CONCURRENCY, video=VIDEO_FILE):
+        self.latency = latency
+        self.video = video
+        self.slots = asyncio.Semaphore(concurrency)
+        self.requests = {}
+        self.waiting = []
+        self.http = httpx.AsyncClient(timeout=10.0)
+        self.signing_key = Ed25519PrivateKey.generate()
+
+    def jwks(self):
+        public = self.signing_key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+        return {"keys": [{"kty": "OKP", "crv": "Ed25519", "x": base64.urlsafe_b64encode(public).rstrip(b"=").decode()}]}
+
+    def signed_headers(self, request_id, body: bytes):
+        """fal's webhook headers: request id, user id, timestamp and the body hash, one per line, signed"""
+        user_id, timestamp = "fake-fal-user", str(int(time.time()))
+        message = "\n".join([request_id, user_id, timestamp, hashlib.sha256(body).hexdigest()]).encode()
+        return {
+            "content-type": "application/json",
+            "x-fal-webhook-request-id": request_id,
+            "x-fal-webhook-user-id": user_id,
+            "x-fal-webhook-timestamp": timestamp,
+            "x-fal-webhook-signature": self.signing_key.sign(message).hex(),
+        }
+
+    def submit(self, base_url, application, arguments, webhook):
+        request_id = str(uuid.uuid4())
+        self.requests[request_id] = {
+            "application": application, "arguments": arguments, "webhook": webhook, "status": "IN_QUEUE",
+            "task": None, "result": None, "error": None,
+        }
+        self.waiting.append(request_id)
+        self.requests[request_id]["task"] = asyncio.get_running_loop().create_task(self.run(base_url, request_id))
+        return request_id
+
+    async def run(self, base_url, request_id):
+        request = self.requests[request_id]
+        try:
+            async with self.slots:
+                self.waiting.remove(request_id)
+                request["status"] = "IN_PROGRESS"
+                await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            if request_id in self.waiting:
+                self.waiting.remove(request_id)
+            request["error"] = "Request cancelled"
+        else:
+            if "video" in request["application"]:
+                request["result"] = {"video": {"url": f"{base_url}/files/{request_id}.mp4"}}
+            else:
+                request["result"] = {"images": [{"url": f"{base_url}/files/{request_id}.png"}], "seed": 1}
+        request["status"] = "COMPLETED"
+        if request["webhook"]:
+            body = {
+                "request_id": request_id, "gateway_request_id": request_id,
+                "status": "ERROR" if request["error"] else "OK",
+                "payload": request["result"], "error": request["error"],
+            }
+            content = json.dumps(body).encode()
+            try:
+                await self.http.post(request["webhook"], content=content, headers=self.signed_headers(request_id, content))
+            except httpx.HTTPError as e:
+                print(f"❌ Webhook Error ({request['webhook']}): {e}")
+
+    def get(self, request_id):
+        if request_id not in self.requests:
+            raise HTTPException(status_code=404, detail="Request not found")
+        return self.requests[request_id]
+
+
+def create_app(fake: FakeFal = None):
+    fake = fake or FakeFal()
+    app = FastAPI()
+
+    def authorize(request: Request):
+        if not request.headers.get("authorization", "").startswith("Key "):
+            raise HTTPException(status_code=401, detail="Missing Authorization: Key ...")
+
+    def base_url(request: Request):
+        return str(request.base_url).rstrip("/")
+
+    @app.get("/.well-known/jwks.json")
+    async def jwks():
+        return fake.jwks()
+
+    @app.get("/files/{name}")
+    async def files(name: str):
+        request_id, extension = os.path.splitext(name)
+        fake.get(request_id)
+        if extension == ".mp4":
+            return Response(sample_video(fake.video), media_type="video/mp4")
+        return Response(output_png(1024, 576, request_id), media_type="image/png")
+
+    @app.get("/{application:path}/requests/{request_id}/status")
+    async def status(application: str, request_id: str, request: Request):
+        authorize(request)
+        queued = fake.get(request_id)
+        body = {"status": queued["status"], "request_id": request_id, "logs": None}
+        if queued["status"] == "IN_QUEUE":
+            body["queue_position"] = fake.waiting.index(request_id)
+        if queued["error"]:
+            body["error"] = queued["error"]
+        return body
+
+    @app.put("/{application:path}/requests/{request_id}/cancel")
+    async def cancel(application: str, request_id: str, request: Request):
+        authorize(request)
+        queued = fake.get(request_id)
+        if queued["status"] == "COMPLETED":
+            return JSONResponse({"status": "ALREADY_COMPLETED"}, status_code=400)
+        queued["task"].cancel()
+        return {"status": "CANCELLATION_REQUESTED"}
+
+    @app.get("/{application:path}/requests/{request_id}")
+    async def result(application: str, request_id: str, request: Request):
+        authorize(request)
+        queued = fake.get(request_id)
+        if queued["status"] != "COMPLETED":
+            return JSONResponse({"detail": "Request is still in progress"}, status_code=400)
+        if queued["error"]:
+            return JSONResponse({"detail": queued["error"]}, status_code=422)
+        return queued["result"]
+
+    @app.post("/{application:path}")
+    async def submit(application: str, request: Request):
+        authorize(request)
+        request_id = fake.submit(base_url(request), application, await request.json(), request.query_params.get("fal_webhook"))
+        # Request URLs use the app's owner/alias only, as fal's do
+        owner, alias = application.split("/")[:2]
+        url = f"{base_url(request)}/{owner}/{alias}/requests/{request_id}"
+        return {
+            "request_id": request_id, "response_url": url, "status_url": f"{url}/status",
+            "cancel_url": f"{url}/cancel", "queue_position": fake.waiting.index(request_id),
+        }
+
+    return app
+
+
+app = create_app()
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8189)
+    parser.add_argument("--latency", type=float, default=LATENCY, help="seconds per request once it has a slot")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="requests processed at the same time")
+    parser.add_argument("--video", default=VIDEO_FILE, help="MP4 returned for every video request")
+    args = parser.parse_args()
+    uvicorn.run(create_app(FakeFal(args.latency, args.concurrency, args.video)), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
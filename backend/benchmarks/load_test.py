@@ -0,0 +1,204 @@
+"""
+Load test for a running backend: drives /generate-image, /generate-multishot,
+/history, /uploads and /upload at a fixed concurrency and reports latency
+percentiles, throughput, errors and memory per scenario.
+
+Against the fake ComfyUI (no GPU needed):
+
+    cd backend
+    python -m benchmarks.fake_comfy --port 8188 --latency 1 &
+    COMFYUI_ADDRESS=127.0.0.1:8188 uvicorn main:app --port 8000 &
+    python -m benchmarks.load_test --requests 100 --concurrency 16 --backend-pid $!
+
+--backend-pid samples the backend's resident memory (Linux /proc) during each
+scenario. --json writes the results, so runs before and after a change can be
+compared.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+
+import httpx
+
+from benchmarks.fake_comfy import output_png
+from benchmarks.stats import latency_summary, percentile
+
+SCENARIOS = ("generate-image", "multishot", "history", "uploads", "upload")
+MEMORY_SAMPLE_INTERVAL = 0.2
+
+
+def rss_bytes(pid):
+    """Resident set size of pid, or None if /proc is unavailable"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class MemorySampler:
+    def __init__(self, pid):
+        self.pid = pid
+        self.samples = []
+        self._task = None
+
+    async def __aenter__(self):
+        if self.pid:
+            self._task = asyncio.create_task(self._sample())
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._take()
+
+    def _take(self):
+        rss = rss_bytes(self.pid)
+        if rss is not None:
+            self.samples.append(rss)
+
+    async def _sample(self):
+        while True:
+            self._take()
+            await asyncio.sleep(MEMORY_SAMPLE_INTERVAL)
+
+    def report(self):
+        if not self.samples:
+            return None
+        return {"start_mb": self.samples[0] / 2 ** 20, "peak_mb": max(self.samples) / 2 ** 20, "end_mb": self.samples[-1] / 2 ** 20}
+
+
+# --- SCENARIOS ---
+def generate_body(args, i):
+    body = {"prompt": f"load test subject {i}", "camera": "Arri Alexa", "lens": "Anamorphic", "focal_length": "35mm", "aspect_ratio": args.aspect_ratio}
+    if args.seed_mode == "unique":
+        body["seed"] = random.randint(1, 10 ** 12)
+    elif args.seed_mode == "fixed":
+        body["prompt"] = "load test subject"
+        body["seed"] = 1
+    return body
+
+
+async def source_image_id(client, args):
+    """Id of a gallery image to run multishot from: --source-id, or a freshly generated one"""
+    if args.source_id:
+        return args.source_id
+    response = await client.post("/generate-image", json=dict(generate_body(args, 0), seed=random.randint(1, 10 ** 12)))
+    response.raise_for_status()
+    url = response.json()["image_url"]
+    rows = (await client.get("/history", params={"limit": 20, "type": "image", "fields": "id,url"})).json()
+    return next(row["id"] for row in rows if row["url"] == url)
+
+
+def request_factory(scenario, args, context):
+    if scenario == "generate-image":
+        return lambda client, i: client.post("/generate-image", json=generate_body(args, i))
+    if scenario == "multishot":
+        return lambda client, i: client.post("/generate-multishot", json={"source_image_id": context["source_id"]})
+    if scenario == "history":
+        return lambda client, i: client.get("/history", params={"limit": args.page_size})
+    if scenario == "uploads":
+        return lambda client, i: client.get("/uploads", params={"limit": args.page_size})
+    if scenario == "upload":
+        width, height = (int(part) for part in args.upload_size.split("x"))
+        # Distinct bytes per request, so each one is a new file rather than a dedupe hit
+        return lambda client, i: client.post(
+            "/upload", content=output_png(width, height, f"load-{time.time_ns()}-{i}"), headers={"Content-Type": "image/png"},
+        )
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+async def run_scenario(client, scenario, args, context):
+    send = request_factory(scenario, args, context)
+    requests = args.requests if scenario != "multishot" else max(1, args.requests // 4)
+    gate = asyncio.Semaphore(args.concurrency)
+    latencies, errors = [], []
+
+    async def one(i):
+        async with gate:
+            started = time.perf_counter()
+            try:
+                response = await send(client, i)
+                response.raise_for_status()
+            except Exception as e:
+                errors.append(str(e))
+                return
+            latencies.append(time.perf_counter() - started)
+
+    async with MemorySampler(args.backend_pid) as memory:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    result = {
+        "scenario": scenario,
+        "requests": requests,
+        "concurrency": args.concurrency,
+        "errors": len(errors),
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "memory": memory.report(),
+    }
+    if latencies:
+        result.update(p50=percentile(latencies, 50), p95=percentile(latencies, 95), p99=percentile(latencies, 99))
+
+    print(f"--- {scenario}: {requests} requests, concurrency {args.concurrency}")
+    if latencies:
+        print(f"latency      {latency_summary(latencies)}")
+    print(f"throughput   {result['throughput']:.1f} req/s over {elapsed:.2f}s, errors {len(errors)}")
+    if errors:
+        print(f"first error  {errors[0]}")
+    if result["memory"]:
+        memory = result["memory"]
+        print(f"backend rss  start {memory['start_mb']:.0f} MB  peak {memory['peak_mb']:.0f} MB  end {memory['end_mb']:.0f} MB")
+    return result
+
+
+async def run(args):
+    scenarios = SCENARIOS if "all" in args.scenario else args.scenario
+    timeout = httpx.Timeout(args.timeout, connect=10.0)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = []
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=timeout, limits=limits) as client:
+        context = {}
+        if "multishot" in scenarios:
+            context["source_id"] = await source_image_id(client, args)
+        for scenario in scenarios:
+            results.append(await run_scenario(client, scenario, args, context))
+
+    # ru_maxrss is KiB on Linux
+    print(f"harness peak rss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"base_url": args.base_url, "created_at": time.time(), "results": results}, f, indent=2)
+        print(f"results written to {os.path.abspath(args.json)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS + ("all",), default=["all"])
+    parser.add_argument("--requests", type=int, default=50, help="requests per scenario (multishot runs a quarter as many)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed-mode", choices=("unique", "none", "fixed"), default="unique",
+                        help="unique: distinct renders; none: seedless (micro-batched); fixed: identical (result cache)")
+    parser.add_argument("--aspect-ratio", default="16:9")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--upload-size", default="1024x1024", help="WIDTHxHEIGHT of images sent to /upload")
+    parser.add_argument("--source-id", type=int, help="gallery image for multishot (default: generate one)")
+    parser.add_argument("--backend-pid", type=int, help="sample this process's memory during each scenario")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--json", help="write results to this file")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
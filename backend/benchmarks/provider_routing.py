@@ -0,0 +1,128 @@
+"""
+Provider routing benchmark against local stub providers (no GPU, no network).
+
+A stub "comfyui" renders one image at a time per simulated GPU and is free;
+a stub "fal" is slower per image but scales out and costs money. The run shows
+how the router splits a burst between them, plus latency percentiles,
+throughput and how many transient failures were absorbed by retries.
+
+    cd backend && python -m benchmarks.provider_routing --requests 200 --concurrency 32
+"""
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from collections import Counter
+
+from services.providers import Provider, ProviderRouter
+from benchmarks.stats import latency_summary
+
+
+class StubProvider(Provider):
+    """Simulated provider: `gpus` parallel workers, `seconds` per output, `failure_rate` transient 503s"""
+
+    def __init__(self, name, seconds, gpus, failure_rate=0.0, **options):
+        super().__init__(**options)
+        self.name = name
+        self.kinds = ("image",)
+        self.seconds = seconds
+        self.failure_rate = failure_rate
+        self._gpus = asyncio.Semaphore(gpus)
+        self.gpus = gpus
+        self.queued = 0
+        self.failures = 0
+        self._jobs = {}
+        self._ids = itertools.count()
+
+    def estimate_seconds(self, kind):
+        return (self.queued // self.gpus + 1) * self.seconds
+
+    async def _submit(self, kind, request):
+        if random.random() < self.failure_rate:
+            self.failures += 1
+            raise StubError(503)
+        ticket_id = f"{self.name}-{next(self._ids)}"
+        self.queued += 1
+        self._jobs[ticket_id] = asyncio.create_task(self._render())
+        return {"ticket": ticket_id}
+
+    async def _render(self):
+        try:
+            async with self._gpus:
+                await asyncio.sleep(self.seconds * random.uniform(0.8, 1.2))
+        finally:
+            self.queued -= 1
+        return "output.png"
+
+    async def _result(self, ticket):
+        return await self._jobs.pop(ticket["ticket"])
+
+    async def download(self, ticket, output, target_path, sinks=()):
+        return None
+
+    def extension(self, ticket, output):
+        return ".png"
+
+
+class StubError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"stub HTTP {status_code}")
+        self.status_code = status_code
+
+
+async def run(args):
+    providers = [
+        StubProvider("comfyui", args.comfy_seconds, args.comfy_gpus, retries=2, backoff=0.01, cost={"image": 0.0}),
+        StubProvider(
+            "fal", args.fal_seconds, gpus=1000, failure_rate=args.fal_failure_rate,
+            concurrency=args.fal_concurrency, retries=2, backoff=0.01, cost={"image": args.fal_cost},
+        ),
+    ]
+    router = ProviderRouter(providers, seconds_per_dollar=args.seconds_per_dollar)
+    gate = asyncio.Semaphore(args.concurrency)
+    latencies, routed, failed = [], Counter(), 0
+
+    async def one():
+        nonlocal failed
+        async with gate:
+            started = time.perf_counter()
+            try:
+                ticket = await router.submit("image", {"prompt": "benchmark"})
+                await router.result(ticket)
+            except Exception:
+                failed += 1
+                return
+            latencies.append(time.perf_counter() - started)
+            routed[ticket["provider"]] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    cost = sum(routed[p.name] * p.cost.get("image", 0.0) for p in providers)
+    print(f"requests     {args.requests} (concurrency {args.concurrency}), failed {failed}")
+    print(f"routed       {dict(routed)}")
+    print(f"retried 503s {sum(p.failures for p in providers)}")
+    if latencies:
+        print(f"latency      {latency_summary(latencies)}")
+    print(f"throughput   {len(latencies) / elapsed:.1f} outputs/s over {elapsed:.2f}s")
+    print(f"cost         ${cost:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--comfy-seconds", type=float, default=0.05)
+    parser.add_argument("--comfy-gpus", type=int, default=2)
+    parser.add_argument("--fal-seconds", type=float, default=0.2)
+    parser.add_argument("--fal-concurrency", type=int, default=8)
+    parser.add_argument("--fal-cost", type=float, default=0.03)
+    parser.add_argument("--fal-failure-rate", type=float, default=0.05)
+    parser.add_argument("--seconds-per-dollar", type=float, default=5.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
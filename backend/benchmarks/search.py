@@ -0,0 +1,104 @@
+"""
+Builds a synthetic library of generated_content rows in a temporary database,
+then times the one-time search index build, trigger-maintained inserts and
+/search queries (common words, rare words, prefixes, facet filters), both the
+first time (hit and facet counts included) and repeated.
+
+    cd backend && python -m benchmarks.search --rows 300000
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+from services.repository import Database, init_schema
+from services.search import SearchIndex
+from benchmarks.stats import latency_summary
+
+SUBJECTS = [
+    "detective", "astronaut", "samurai", "dancer", "old fisherman", "street musician", "android", "queen",
+    "boxer", "pilot", "child", "wolf", "knight", "scientist", "cowboy", "ballerina", "monk", "sailor",
+]
+SETTINGS = [
+    "rain-soaked neon alley", "desert at golden hour", "foggy harbor", "abandoned cathedral", "snowy forest",
+    "1970s diner", "space station corridor", "rooftop at night", "crowded market", "misty mountain pass",
+]
+STYLES = [
+    "cinematic lighting", "film grain", "volumetric fog", "high contrast", "soft backlight", "teal and orange",
+    "shallow depth of field", "anamorphic flares", "hard shadows", "pastel palette", "moody", "epic wide shot",
+]
+CAMERAS = ["Arri Alexa 65", "RED V-Raptor", "Sony Venice", "Panavision DXL2", "Blackmagic URSA", "Canon C700"]
+LENSES = ["Anamorphic", "Spherical Prime", "Vintage Cooke", "Zeiss Master Prime", "Helios 44", "Tilt-Shift"]
+FOCALS = ["18mm", "24mm", "35mm", "50mm", "85mm", "135mm"]
+
+QUERIES = ["cinematic", "samurai", "neon alley", "cathedral fog", "anamor", "wolf snowy forest", "sam", "zeiss"]
+
+
+def synthetic_rows(count, seed=1):
+    rng = random.Random(seed)
+    now = time.time()
+    for i in range(count):
+        prompt = f"{rng.choice(SUBJECTS)} in a {rng.choice(SETTINGS)}, {', '.join(rng.sample(STYLES, 3))}"
+        yield (
+            "image", prompt, f"http://localhost:8000/generated/bench_{i}.png",
+            rng.choice(CAMERAS), rng.choice(LENSES), rng.choice(FOCALS), int(rng.random() < 0.05), now - i,
+        )
+
+
+def _fill(conn, rows):
+    with conn:
+        conn.executemany(
+            "INSERT INTO generated_content (type, prompt, url, camera, lens, focal_length, is_favorite, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, "search_bench.db"))
+        try:
+            # Rows first, index second: the same path as an existing library meeting the index
+            await db.run(init_schema)
+            started = time.perf_counter()
+            await db.run(_fill, list(synthetic_rows(args.rows)))
+            print(f"inserted {args.rows} rows without the index in {time.perf_counter() - started:.2f}s")
+
+            index = SearchIndex(db)
+            started = time.perf_counter()
+            await index.start()
+            print(f"index build (one-time) {time.perf_counter() - started:.2f}s")
+
+            extra = list(synthetic_rows(args.inserts, seed=2))
+            started = time.perf_counter()
+            await db.run(_fill, extra)
+            print(f"inserted {args.inserts} more rows through the triggers in {time.perf_counter() - started:.2f}s")
+
+            cases = [(query, {}) for query in QUERIES]
+            cases += [("cinematic", {"camera": "Sony Venice"}), ("fog", {"lens": "Anamorphic", "is_favorite": 1})]
+            for query, filters in cases:
+                latencies, total = [], 0
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    _, total, _ = await index.search(query, dict(filters, is_proxy=0), limit=args.limit, fields=("id", "prompt"))
+                    latencies.append(time.perf_counter() - started)
+                label = query + (f" {filters}" if filters else "")
+                # The first run counts hits and facets; later ones (same library version) reuse them
+                print(f"{label:<48} {total:>7} hits  first {latencies[0] * 1000:6.1f}ms  then {latency_summary(latencies[1:])}")
+        finally:
+            db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--inserts", type=int, default=10000, help="rows inserted after the index exists")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def latency_summary(latencies):
+    """'p50 ...  p95 ...  p99 ...' in seconds"""
+    return "  ".join(f"p{pct} {percentile(latencies, pct):.3f}s" for pct in (50, 95, 99))
@@ -2,32 +2,193 @@ import os
 import json
 import random
 import time
-import sqlite3
-import urllib.request
-import urllib.parse
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+import asyncio
+import hashlib
+import uuid
+import socket
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 import uvicorn
 from dotenv import load_dotenv
-import websocket # pip install websocket-client
-import requests # pip install requests
-import base64
+
+from services.bridge_pool import BridgePool, load_nodes
+from services.providers import ProviderRouter, ComfyProvider, FalProvider
+from services.batching import PromptBatcher
+from services.result_cache import ResultCache, result_key, init_schema as init_result_cache_schema
+from services.jobs import JobManager, JobHandler, PRIORITY_BULK, TERMINAL, CANCELLED
+from services.repository import Database, ContentRepository, CONTENT_COLUMNS, init_schema
+from services.search import SearchIndex
+from services.workflows import WorkflowRegistry
+from services.upload_cache import UploadCache
+from services.uploads_index import UploadsIndex
+from services.legacy_import import pending_stores as legacy_stores
+from services.thumbnails import ThumbnailService, SIZES as THUMBNAIL_SIZES
+from services.video_previews import VideoPreviewService, VARIANTS as VIDEO_PREVIEW_VARIANTS
+from services.webhooks import WebhookInbox, FalWebhookVerifier, FAL_JWKS_URL as FAL_DEFAULT_JWKS_URL
+from services.storage_gc import StorageGC, RetentionPolicy
+from services import metrics
+from services.transfers import CHUNK_SIZE, ContentTarget, discard, drain, image_extension, iter_data_url, tee_queue, write_content_stream
+from services.storage import ImmutableStaticFiles, content_filename
 
 # --- CONFIGURATION ---
 load_dotenv()
 
 # DIRECTORIES
-UPLOAD_DIR = "uploads"
-GENERATED_DIR = "generated"
-DB_NAME = "cinema_studio.db"
+# Everything below lives under STORAGE_ROOT (default: the working directory). Workers sharing
+# one library (uvicorn --workers N, replicas on one volume) point it at the same place.
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", "")
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(STORAGE_ROOT, "uploads"))
+GENERATED_DIR = os.getenv("GENERATED_DIR", os.path.join(STORAGE_ROOT, "generated"))
+DERIVATIVES_DIR = os.getenv("DERIVATIVES_DIR", os.path.join(STORAGE_ROOT, "derivatives"))
+DB_NAME = os.getenv("DB_PATH", os.path.join(STORAGE_ROOT, "cinema_studio.db"))
+# Stores from before cinema_studio.db (inline base64); moved over by `python -m services.legacy_import`
+LEGACY_HISTORY_JSON = os.path.join(STORAGE_ROOT, "history.json")
+LEGACY_DB_NAME = os.path.join(STORAGE_ROOT, "studio_history.db")
+# Where browsers fetch /generated, /uploads and /thumbnails from: this server, or a CDN / reverse proxy in front of it
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:8000").rstrip("/")
+
+# How many multishot angles may download/store at once (all angles are queued up front)
+MULTISHOT_CONCURRENCY = int(os.getenv("MULTISHOT_CONCURRENCY", "3"))
+# Background generation jobs processed at the same time (per process)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# This process in the shared jobs table and as ComfyUI client_id: WORKER_NAME (default: the host) plus the pid
+WORKER_ID = f"{os.getenv('WORKER_NAME', socket.gethostname())}-{os.getpid()}"
+# Seconds a dead worker's jobs stay claimed before another worker adopts and resumes them
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "30"))
+# Threads rendering thumbnails/previews in the background
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+# Video posters/previews are extracted with this binary; without it the gallery plays the originals
+FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
+# Local reference copies (uploads/ref_*) kept before the least recently used are evicted
+UPLOAD_CACHE_MAX_BYTES = int(os.getenv("UPLOAD_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+# STORAGE RETENTION
+# Unfavorited multishot proxies (of unfavorited shots) are deleted after this many days; 0 keeps them
+PROXY_RETENTION_DAYS = float(os.getenv("PROXY_RETENTION_DAYS", "30"))
+# Byte quotas (0: none): over one, the least recently used non-favorite files (and their rows) go first
+GENERATED_QUOTA_BYTES = int(os.getenv("GENERATED_QUOTA_BYTES", "0"))
+UPLOADS_QUOTA_BYTES = int(os.getenv("UPLOADS_QUOTA_BYTES", "0"))
+# Seconds between GC passes (0: only on POST /storage/gc); files used within GC_GRACE_SECONDS are never removed
+GC_INTERVAL = float(os.getenv("GC_INTERVAL", "3600"))
+GC_GRACE_SECONDS = float(os.getenv("GC_GRACE_SECONDS", "3600"))
+
+# COMFYUI NODES
+# Your specific RunPod Address (override with COMFYUI_ADDRESS for local pods)
+COMFYUI_ADDRESS = os.getenv("COMFYUI_ADDRESS", "https://mt7wsv4h5cnn07-8188.proxy.runpod.net/")
+# Several GPUs: comma-separated COMFYUI_ADDRESSES, or a JSON file of [{"name", "address"}]
+COMFYUI_ADDRESSES = os.getenv("COMFYUI_ADDRESSES", COMFYUI_ADDRESS)
+COMFYUI_NODES_FILE = os.getenv("COMFYUI_NODES_FILE")
+# Seconds between /queue polls (routing + health checks)
+COMFYUI_HEALTH_INTERVAL = float(os.getenv("COMFYUI_HEALTH_INTERVAL", "5"))
+# How often a blocking /generate-* request checks whether its client went away (the job is then cancelled)
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "1.0"))
+# Seedless text-to-image requests arriving within this window share one prompt (batch_size latents)
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "50"))
+MAX_BATCH = int(os.getenv("MAX_BATCH", "4"))
+
+# PROVIDERS
+# Concurrent HTTP calls (submit, status, download) and render timeouts per provider; transient
+# failures are retried with backoff (fal submits only when the request was certainly not queued)
+COMFYUI_CONCURRENCY = int(os.getenv("COMFYUI_CONCURRENCY", "32"))
+COMFYUI_TIMEOUT = float(os.getenv("COMFYUI_TIMEOUT", "900"))
+FAL_CONCURRENCY = int(os.getenv("FAL_CONCURRENCY", "4"))
+FAL_TIMEOUT = float(os.getenv("FAL_TIMEOUT", "900"))
+# fal's queue API (or `python -m benchmarks.fake_fal`); FAL_INLINE_INPUTS sends input images as data URLs
+FAL_QUEUE_URL = os.getenv("FAL_QUEUE_URL", "https://queue.fal.run")
+FAL_INLINE_INPUTS = os.getenv("FAL_INLINE_INPUTS", "false").lower() == "true"
+# Public URL of /webhooks/fal: fal calls it when a request completes, so waiting jobs wake at once.
+# Status polls back off to FAL_STATUS_INTERVAL seconds (they only matter if a callback goes missing).
+FAL_WEBHOOK_URL = os.getenv("FAL_WEBHOOK_URL")
+# Keys fal signs its callbacks with (the fal stub serves its own at /.well-known/jwks.json)
+FAL_JWKS_URL = os.getenv("FAL_JWKS_URL", FAL_DEFAULT_JWKS_URL)
+FAL_STATUS_INTERVAL = float(os.getenv("FAL_STATUS_INTERVAL", "30" if FAL_WEBHOOK_URL else "5"))
+PROVIDER_RETRIES = int(os.getenv("PROVIDER_RETRIES", "2"))
+PROVIDER_BACKOFF = float(os.getenv("PROVIDER_BACKOFF", "1.0"))
+# Cost per output in USD, and how many seconds of waiting one dollar is worth when routing
+COMFYUI_IMAGE_COST = float(os.getenv("COMFYUI_IMAGE_COST", "0"))
+FAL_IMAGE_COST = float(os.getenv("FAL_IMAGE_COST", "0.03"))
+FAL_VIDEO_COST = float(os.getenv("FAL_VIDEO_COST", "0.35"))
+ROUTING_SECONDS_PER_DOLLAR = float(os.getenv("ROUTING_SECONDS_PER_DOLLAR", "600"))
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(GENERATED_DIR, exist_ok=True)
+if os.path.dirname(DB_NAME):
+    os.makedirs(os.path.dirname(DB_NAME), exist_ok=True)
+
+# --- INITIALIZATION ---
+db = Database(DB_NAME)
+content = ContentRepository(db)
+uploads_index = UploadsIndex(db, UPLOAD_DIR)
+search_index = SearchIndex(db)
+thumbnails = ThumbnailService(DERIVATIVES_DIR, {"generated": GENERATED_DIR, "uploads": UPLOAD_DIR}, workers=THUMBNAIL_WORKERS)
+video_previews = VideoPreviewService(DERIVATIVES_DIR, GENERATED_DIR, ffmpeg=FFMPEG_PATH, workers=THUMBNAIL_WORKERS)
+webhook_inbox = WebhookInbox(db)
+fal_webhooks = FalWebhookVerifier(FAL_JWKS_URL)
+
+async def job_inputs():
+    """Upload filenames unfinished steps still name: ComfyUI inputs (re-sent on failover) and coalesced requests"""
+    steps = [step for step in await jobs.unfinished_steps() if "result" not in step and "error" not in step]
+    paths = [path for step in steps for path in step.get("inputs") or ()]
+    paths += [step["request"]["reference"] for step in steps if (step.get("request") or {}).get("reference")]
+    return {os.path.basename(path) for path in paths}
+
+upload_cache = UploadCache(UPLOAD_DIR, max_bytes=UPLOAD_CACHE_MAX_BYTES, index=uploads_index, in_use=job_inputs)
+comfy = BridgePool(
+    load_nodes(COMFYUI_ADDRESSES, COMFYUI_NODES_FILE), upload_cache,
+    health_interval=COMFYUI_HEALTH_INTERVAL, client_id=WORKER_ID,
+)
+storage_gc = StorageGC(
+    db, {"generated": GENERATED_DIR, "uploads": UPLOAD_DIR}, DERIVATIVES_DIR,
+    RetentionPolicy(
+        proxy_retention=PROXY_RETENTION_DAYS * 86400 if PROXY_RETENTION_DAYS > 0 else None,
+        quotas={"generated": GENERATED_QUOTA_BYTES, "uploads": UPLOADS_QUOTA_BYTES},
+        grace=GC_GRACE_SECONDS,
+    ),
+    interval=GC_INTERVAL, worker_id=WORKER_ID, uploads_index=uploads_index, upload_cache=upload_cache, in_use=job_inputs,
+)
+jobs = JobManager(db, comfy, workers=JOB_WORKERS, worker_id=WORKER_ID, lease=JOB_LEASE_SECONDS)
+result_cache = ResultCache(db)
 
-app = FastAPI()
+workflows = WorkflowRegistry()
+workflows.register("standard", "workflow_txt2img.json", required=("seed", "dims", "text"))
+workflows.register("instantid", "workflow_multishot.json", required=("seed", "text", "image"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    print(f"👷 Worker {WORKER_ID} (storage: {os.path.abspath(STORAGE_ROOT or '.')})")
+    workflows.load_all()
+    await db.run(init_schema)
+    await db.run(init_result_cache_schema)
+    await search_index.start()
+    await uploads_index.start()
+    await storage_gc.start()
+    for store in await legacy_stores(db, LEGACY_HISTORY_JSON, LEGACY_DB_NAME):
+        print(f"📜 Legacy store {store} has not been imported: run `python -m services.legacy_import`")
+    await webhook_inbox.start()
+    await comfy.start()
+    await jobs.start()
+    # Existing libraries get their derivatives in the background (requests also render lazily)
+    backfill = asyncio.gather(thumbnails.backfill("generated"), thumbnails.backfill("uploads"), video_previews.backfill())
+    yield
+    backfill.cancel()
+    await jobs.stop()
+    await storage_gc.stop()
+    await uploads_index.stop()
+    await thumbnails.close()
+    await video_previews.close()
+    await providers.close()
+    await fal_webhooks.close()
+    await comfy.close()
+    db.close()
+    metrics.close()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -35,129 +196,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "X-Job-Id"],
 )
 
-# --- COMFYUI BRIDGE (RunPod Optimized) ---
-class ComfyBridge:
-    def __init__(self, server_address):
-        # Cleans the address to handle both "127.0.0.1:8188" and "https://xyz.runpod.net"
-        self.original_address = server_address.rstrip('/')
-        self.client_id = str(random.randint(100000, 999999))
-        
-        # Determine protocols based on input
-        if "runpod.net" in self.original_address:
-            # RUNPOD MODE (Secure)
-            if not self.original_address.startswith("https://"):
-                self.base_url = f"https://{self.original_address}"
-                self.ws_url = f"wss://{self.original_address}"
-            else:
-                self.base_url = self.original_address
-                self.ws_url = self.original_address.replace("https://", "wss://")
-        else:
-            # LOCAL MODE (Standard)
-            clean_addr = self.original_address.replace("http://", "").replace("https://", "")
-            self.base_url = f"http://{clean_addr}"
-            self.ws_url = f"ws://{clean_addr}"
-
-        print(f"🌉 Bridge Initialized to: {self.base_url}")
-
-    def upload_image(self, file_path):
-        """Uploads the local source image to ComfyUI"""
-        url = f"{self.base_url}/upload/image"
-        try:
-            with open(file_path, "rb") as file:
-                files = {"image": file}
-                data = {"overwrite": "true"}
-                headers = {"User-Agent": "Mozilla/5.0"} 
-                response = requests.post(url, files=files, data=data, headers=headers)
-                return response.json()
-        except Exception as e:
-            print(f"❌ Upload Error: {e}")
-            raise HTTPException(status_code=500, detail="Failed to upload to RunPod")
-
-    def queue_prompt(self, workflow):
-        url = f"{self.base_url}/prompt"
-        p = {"prompt": workflow, "client_id": self.client_id}
-        data = json.dumps(p).encode('utf-8')
-        try:
-            req = urllib.request.Request(url, data=data)
-            req.add_header("User-Agent", "Mozilla/5.0") 
-            return json.loads(urllib.request.urlopen(req).read())
-        except Exception as e:
-            print(f"❌ Queue Error: {e}")
-            raise HTTPException(status_code=500, detail="Failed to queue prompt")
-
-    def get_image(self, workflow):
-        ws = websocket.WebSocket()
-        try:
-            # Connect to WebSocket
-            connect_url = f"{self.ws_url}/ws?clientId={self.client_id}"
-            print(f"🔌 Connecting to: {connect_url}")
-            ws.connect(connect_url)
-        except Exception as e:
-            print(f"❌ WebSocket Error: {e}")
-            raise HTTPException(status_code=500, detail="Could not connect to ComfyUI Stream")
-            
-        prompt_response = self.queue_prompt(workflow)
-        prompt_id = prompt_response['prompt_id']
-        print(f"⏳ Job Started: {prompt_id}")
-        
-        while True:
-            out = ws.recv()
-            if isinstance(out, str):
-                message = json.loads(out)
-                if message['type'] == 'executing':
-                    data = message['data']
-                    if data['node'] is None and data['prompt_id'] == prompt_id:
-                        break # Execution is done
-        
-        # Fetch history
-        history_url = f"{self.base_url}/history/{prompt_id}"
-        req = urllib.request.Request(history_url)
-        req.add_header("User-Agent", "Mozilla/5.0")
-        
-        with urllib.request.urlopen(req) as response:
-            history = json.loads(response.read())
-            
-        history_data = history[prompt_id]
-        outputs = history_data['outputs']
-        
-        for node_id in outputs:
-            node_output = outputs[node_id]
-            if 'images' in node_output:
-                for image in node_output['images']:
-                    return image['filename']
-        return None
-
-# --- INITIALIZATION ---
-# Your specific RunPod Address
-comfy = ComfyBridge(server_address="https://mt7wsv4h5cnn07-8188.proxy.runpod.net/")
-
-# --- DATABASE ---
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS generated_content (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type TEXT NOT NULL,
-            prompt TEXT,
-            url TEXT NOT NULL,
-            camera TEXT,
-            lens TEXT,
-            focal_length TEXT,
-            is_favorite INTEGER DEFAULT 0,
-            is_proxy INTEGER DEFAULT 0,
-            parent_id INTEGER,
-            created_at REAL
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-init_db()
-
 # --- MODELS ---
+ProviderName = Literal["comfyui", "fal"]
+
 class GenerateRequest(BaseModel):
     prompt: str
     camera: str
@@ -166,10 +210,26 @@ class GenerateRequest(BaseModel):
     aspect_ratio: str = "21:9"
     reference_images: Optional[List[str]] = []
     image_strength: Optional[float] = 0.75
+    # Fixed seed: identical requests are then served from the result cache
+    seed: Optional[int] = None
+
+    # Pin a provider instead of letting the router pick
+    provider: Optional[ProviderName] = None
+
+class FavoriteRequest(BaseModel):
+    is_favorite: bool
 
 class MultishotRequest(BaseModel):
     source_image_id: int
 
+class VideoRequest(BaseModel):
+    source_image_id: int
+    prompt: str
+    zoom: float = 0.0
+    horizontal: float = 0.0
+    vertical: float = 0.0
+    provider: Optional[ProviderName] = None
+
 # --- HELPERS ---
 def get_dimensions(ratio: str):
     if ratio == "21:9": return 1536, 640
@@ -179,257 +239,840 @@ def get_dimensions(ratio: str):
     if ratio == "9:16": return 768, 1344
     return 1344, 768 
 
-def load_workflow(filename):
-    try:
-        with open(filename, "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return None
+# --- GENERATION PIPELINE ---
+# A generation is split in two: submit_* stores inputs and hands provider-neutral
+# requests to the provider router, which returns JSON "steps" (one ticket per
+# output); finish_step waits for one ticket and stores its output. The job
+# manager persists the steps in between.
 
-def get_db_item(item_id: int):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM generated_content WHERE id = ?", (item_id,))
-    item = c.fetchone()
-    conn.close()
-    return item
+async def build_comfy_workflow(request: dict):
+    """ComfyUI side of a neutral image request: (workflow, local input paths)"""
+    reference = request.get("reference")
+    # 1. Determine Switch: Standard vs InstantID
+    template = workflows.get("instantid" if reference else "standard")
 
-# --- ENDPOINTS ---
+    # 2. Inject Values (node paths are resolved once per template by the registry)
+    workflow = template.instantiate(
+        seed=request.get("seed") or random.randint(1, 1000000000000),
+        width=request.get("width"),
+        height=request.get("height"),
+        text=request["prompt"],
+        # Inject Image for InstantID (named by content, uploaded to whichever node gets the prompt)
+        image=await upload_cache.input_name(reference) if reference else None,
+    )
+    return workflow, [reference] if reference else []
 
-@app.post("/generate-image")
-async def generate_image(req: GenerateRequest):
+async def submit_image(payload: dict):
+    req = GenerateRequest(**payload)
     print(f"🎬 Generating: {req.prompt} | Camera: {req.camera} | Ratio: {req.aspect_ratio}")
 
-    # 1. Determine Switch: Standard vs InstantID
     has_reference = req.reference_images and len(req.reference_images) > 0
     
     if has_reference:
         print(f"   ↳ 👤 Reference Image Detected! Using InstantID.")
-        workflow = load_workflow("workflow_multishot.json")
-        target_workflow = "instantid"
     else:
         print(f"   ↳ 🎨 No Reference. Using Standard Text-to-Image.")
-        workflow = load_workflow("workflow_txt2img.json")
-        target_workflow = "standard"
+    workflow_type = "instantid" if has_reference else "txt2img"
+    metrics.set_workflow(workflow_type)
 
-    if not workflow:
-        raise HTTPException(status_code=500, detail="Workflow file missing")
-
-    # 2. Upload Reference Image (If needed)
-    comfy_filename = None
+    # 1. Store Reference Image (If needed) -- providers upload it where they need it,
+    # and the upload cache skips content a ComfyUI node already has
+    reference = None
     if has_reference:
         ref_data = req.reference_images[0]
         
-        # Handle Base64 (New Uploads)
-        if "base64," in ref_data:
-            header, encoded = ref_data.split(",", 1)
-            file_data = base64.b64decode(encoded)
-            temp_filename = f"ref_{int(time.time())}.jpg"
-        else:
-            # Handle URL (Existing Gallery items)
-            temp_filename = os.path.basename(ref_data)
-            local_check_path = os.path.join(UPLOAD_DIR, temp_filename)
-            if not os.path.exists(local_check_path):
-                 local_check_path = os.path.join(GENERATED_DIR, temp_filename)
-            
-            if os.path.exists(local_check_path):
-                with open(local_check_path, "rb") as f:
-                    file_data = f.read()
-            else:
-                 try:
-                    r = requests.get(ref_data)
-                    file_data = r.content
-                 except:
-                    print("Failed to download ref URL")
-                    file_data = None
-
-        if file_data:
-            temp_path = os.path.join(UPLOAD_DIR, temp_filename)
-            with open(temp_path, "wb") as f:
-                f.write(file_data)
+        try:
+            with metrics.span("reference_decode"):
+                # Handle Base64 (New Uploads): decoded a slice at a time straight to disk
+                if "base64," in ref_data:
+                    reference = await upload_cache.store_base64(ref_data)
+                else:
+                    # Handle URL (Existing Gallery items): use the local file as-is, no copy
+                    temp_filename = os.path.basename(ref_data)
+                    local_check_path = os.path.join(UPLOAD_DIR, temp_filename)
+                    if not os.path.exists(local_check_path):
+                         local_check_path = os.path.join(GENERATED_DIR, temp_filename)
                 
-            try:
-                upload_resp = comfy.upload_image(temp_path)
-                comfy_filename = upload_resp["name"]
-            except Exception as e:
-                print(f"Failed to upload reference: {e}")
-                # We don't crash here; we might just fallback, but usually this is fatal for InstantID
-
-    # 3. Construct Prompt
+                    if os.path.exists(local_check_path):
+                        reference = local_check_path
+                    else:
+                        async with comfy.http.stream("GET", ref_data) as r:
+                            r.raise_for_status()
+                            reference = await upload_cache.store_stream(r.aiter_bytes(chunk_size=CHUNK_SIZE))
+        except Exception as e:
+            print(f"Failed to upload reference: {e}")
+            # We don't crash here; we might just fallback, but usually this is fatal for InstantID
+
+    # 2. Construct Prompt
     tech_specs = f"shot on {req.camera}, {req.lens} {req.focal_length}, cinematic lighting, 8k, detailed"
     full_prompt = f"{req.prompt}, {tech_specs}"
     
-    # 4. Inject Values (Using Common IDs: 3=Seed, 5=Dims, 6=Prompt)
     width, height = get_dimensions(req.aspect_ratio)
-    
-    if "5" in workflow:
-        workflow["5"]["inputs"]["width"] = width
-        workflow["5"]["inputs"]["height"] = height
-    
-    if "3" in workflow:
-        workflow["3"]["inputs"]["seed"] = random.randint(1, 1000000000000)
-    
-    if "6" in workflow:
-        workflow["6"]["inputs"]["text"] = full_prompt
-
-    # Inject Image for InstantID
-    if target_workflow == "instantid" and comfy_filename:
-        # Find LoadImage Node dynamically
-        for nid, node in workflow.items():
-            if node["class_type"] == "LoadImage":
-                workflow[nid]["inputs"]["image"] = comfy_filename
-                break
-
-    # 5. Execute
-    try:
-        output_filename = comfy.get_image(workflow)
-        
-        # Download Result
-        runpod_url = f"{comfy.base_url}/view?filename={output_filename}&type=output"
-        local_filename = f"cinematic_{int(time.time())}.png"
-        local_path = os.path.join(GENERATED_DIR, local_filename)
-
-        with requests.get(runpod_url, stream=True, headers={"User-Agent": "Mozilla/5.0"}) as r:
-            r.raise_for_status()
-            with open(local_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192): 
-                    f.write(chunk)
-
-        final_url = f"http://localhost:8000/generated/{local_filename}"
-        
-        conn = sqlite3.connect(DB_NAME)
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO generated_content (type, prompt, url, camera, lens, focal_length, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            ("image", full_prompt, final_url, req.camera, req.lens, req.focal_length, time.time())
-        )
-        conn.commit()
-        conn.close()
+    request = {
+        "prompt": full_prompt,
+        "aspect_ratio": req.aspect_ratio,
+        "width": width,
+        "height": height,
+        "reference": reference,
+        "image_strength": req.image_strength,
+        "seed": req.seed if req.seed is not None else random.randint(1, 1000000000000),
+        # Someone is waiting on this one: ahead of queued multishot angles on the node
+        "front": True,
+    }
+    step = {
+        "filename_prefix": "cinematic",
+        "workflow_type": workflow_type,
+        "tee": payload.get("tee"),
+        "seed": request["seed"],
+        "row": {"type": "image", "prompt": full_prompt, "camera": req.camera, "lens": req.lens, "focal_length": req.focal_length},
+    }
 
-        return {"status": "success", "image_url": final_url}
+    # Nothing to reproduce (no seed asked for, no face to keep): may share a batched prompt
+    if req.seed is None and reference is None and req.provider in (None, "comfyui"):
+        request["batchable"] = True
+        ticket = await providers.submit("image", request, provider=req.provider)
+        if ticket.get("batch_size", 1) > 1:
+            # Image n of a batch is not reproducible from a single seed, so it is neither reported nor cached
+            del step["seed"]
+        else:
+            workflow, _ = await build_comfy_workflow(request)
+            step["cache_key"] = result_key(workflow, ticket["provider"], req.image_strength)
+        print(f"⏳ Job Started on {ticket['provider']}: {ticket.get('prompt_id') or ticket.get('request_id')}")
+        return [dict(step, **ticket)]
 
+    # 3. Result Cache: the fully patched workflow (seed and reference content included), image
+    # strength and rendering provider are the key; an unpinned request takes any provider's render
+    workflow, _ = await build_comfy_workflow(request)
+    keys = {name: result_key(workflow, name, req.image_strength) for name in providers.names("image", req.provider)}
+    for key in keys.values():
+        cached = await cached_result(key)
+        if cached:
+            print(f"♻️ Result Cache Hit: {cached['url']}")
+            return [dict(step, cache_key=key, result=dict(cached, seed=request["seed"]))]
+    for key in keys.values():
+        if result_cache.in_flight(key):
+            # Same render already queued by another request: wait for it instead of rendering twice
+            print(f"🔗 Coalesced onto in-flight render {key[:12]}")
+            return [dict(step, cache_key=key, follow=True, request=request, pin=req.provider)]
+
+    # 4. Queue (cheapest/fastest provider; the ticket keeps what a resubmission needs)
+    for key in keys.values():
+        result_cache.claim(key)
+    try:
+        ticket = await providers.submit("image", request, provider=req.provider)
     except Exception as e:
-        print(f"❌ Generation Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        for key in keys.values():
+            result_cache.reject(key, e)
+        raise
+    step["cache_key"] = keys[ticket["provider"]]
+    for name, key in keys.items():
+        if name != ticket["provider"]:
+            # Identical requests waiting on another provider's key render it themselves
+            result_cache.abandon(key)
+    print(f"⏳ Job Started on {ticket['provider']}: {ticket.get('prompt_id') or ticket.get('request_id')}")
+    return [dict(step, **ticket)]
 
+async def cached_result(key):
+    """Result item of a finished render with this workflow key, if its file is still on disk"""
+    row = await result_cache.lookup(key)
+    if row is None:
+        return None
+    if not os.path.exists(os.path.join(GENERATED_DIR, os.path.basename(row["url"]))):
+        await result_cache.forget(key)
+        return None
+    return {"id": row["id"], "url": row["url"], "label": None, "cached": True}
 
-@app.post("/generate-multishot")
-async def generate_multishot(req: MultishotRequest):
-    source_item = get_db_item(req.source_image_id)
+
+MULTISHOT_ANGLES = [
+    {"label": "Close Up", "prompt": "Extreme close-up portrait, detailed eyes, intense stare"},
+    {"label": "Wide Action", "prompt": "Wide shot, full body action pose, dynamic environment"},
+    {"label": "Side Profile", "prompt": "Side profile shot, looking left, sharp jawline"},
+    {"label": "Low Angle", "prompt": "Low angle shot from below looking up, heroic stature"},
+    {"label": "Dutch Angle", "prompt": "Dutch angle, tilted camera, tense atmosphere"},
+    {"label": "Cinematic", "prompt": "Cinematic medium shot, perfect lighting"}
+]
+
+def build_angle_prompt(source_item, angle):
+    base_prompt = source_item['prompt'].split(', shot on')[0]
+    return f"{angle['prompt']}, {base_prompt}, detailed, 8k"
+
+def local_source_path(item):
+    filename = os.path.basename(item["url"])
+    local_path = os.path.join(GENERATED_DIR, filename)
+    if not os.path.exists(local_path):
+        local_path = os.path.join(UPLOAD_DIR, filename)
+    return local_path
+
+async def submit_multishot(payload: dict):
+    """
+    Submits every angle up front, each routed on its own (ComfyUI nodes or fal);
+    they work through their queues back to back while earlier angles are
+    downloaded and stored.
+    """
+    source_image_id = payload["source_image_id"]
+    source_item = await content.get_item(source_image_id)
     if not source_item:
         raise HTTPException(status_code=404, detail="Source image DB record not found")
 
-    # Upload Source to ComfyUI
-    source_filename = os.path.basename(source_item["url"])
-    local_path = os.path.join(GENERATED_DIR, source_filename)
+    local_path = local_source_path(source_item)
     if not os.path.exists(local_path):
-        local_path = os.path.join(UPLOAD_DIR, source_filename)
-        
+        raise HTTPException(status_code=500, detail="Failed to upload source to ComfyUI")
+
+    angle_prompts = [(angle, build_angle_prompt(source_item, angle)) for angle in MULTISHOT_ANGLES]
+    queued = await asyncio.gather(
+        *(providers.submit("image", {"prompt": prompt, "reference": local_path}) for _, prompt in angle_prompts),
+        return_exceptions=True,
+    )
+
+    steps = []
+    for (angle, full_angle_prompt), ticket in zip(angle_prompts, queued):
+        step = {
+            "label": angle["label"],
+            "filename_prefix": f"multishot_{angle['label'].replace(' ', '')}",
+            "row": {
+                "type": "image", "prompt": full_angle_prompt, "camera": angle["label"], "lens": "InstantID",
+                "focal_length": "N/A", "is_proxy": 1, "parent_id": source_image_id,
+            },
+        }
+        if isinstance(ticket, Exception):
+            print(f"❌ Failed to generate {angle['label']}: {ticket}")
+            step["error"] = str(getattr(ticket, "detail", ticket))
+        else:
+            print(f"🔄 Processing Angle: {angle['label']} on {ticket.get('node') or ticket['provider']}...")
+            step.update(ticket)
+        steps.append(step)
+    return steps
+
+async def submit_video(payload: dict):
+    """Image-to-video from a gallery item; the result is stored as a video row under it"""
+    req = VideoRequest(**payload)
+    source_item = await content.get_item(req.source_image_id)
+    if not source_item:
+        raise HTTPException(status_code=404, detail="Source image DB record not found")
+
+    print(f"🎥 Video: {req.prompt} | Zoom: {req.zoom}, Pan X: {req.horizontal}, Pan Y: {req.vertical}")
+    ticket = await providers.submit("video", {
+        "image": local_source_path(source_item),
+        "prompt": req.prompt,
+        "zoom": req.zoom,
+        "horizontal": req.horizontal,
+        "vertical": req.vertical,
+    }, provider=req.provider)
+    return [{
+        **ticket,
+        "filename_prefix": "video",
+        "row": {
+            "type": "video", "prompt": req.prompt, "camera": source_item["camera"], "lens": source_item["lens"],
+            "focal_length": source_item["focal_length"], "parent_id": req.source_image_id,
+        },
+    }]
+
+# Open /generate-image/stream responses, keyed by the tee id carried in the job payload
+download_tees = {}
+
+async def finish_step(step: dict, limit: asyncio.Semaphore):
+    """
+    Waits for one ticket (ComfyUI moves it to another node if its own goes down),
+    then stores the output. Steps that coalesced onto an identical render share its row.
+    """
+    if "workflow_type" in step:
+        metrics.set_workflow(step["workflow_type"])
+    key = step.get("cache_key")
+    if step.get("follow"):
+        # None if the leader was cancelled or is gone (e.g. restart)
+        result = await result_cache.follow(key) or await cached_result(key)
+        if result:
+            return dict(result, label=step.get("label"), seed=step.get("seed"), cached=True)
+        # The render we were waiting on is gone (e.g. restart): do it ourselves, keyed by where it lands
+        request = step.pop("request")
+        step.update(await providers.submit("image", request, provider=step.pop("pin", None)))
+        workflow, _ = await build_comfy_workflow(request)
+        key = step["cache_key"] = result_key(workflow, step["provider"], request.get("image_strength"))
+        del step["follow"]
+    if key:
+        result_cache.claim(key)
+
     try:
-        upload_resp = comfy.upload_image(local_path)
-        comfy_filename = upload_resp["name"]
+        result = await store_output(step, limit)
+    except asyncio.CancelledError:
+        if key:
+            result_cache.abandon(key)
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail="Failed to upload source to ComfyUI")
+        if key:
+            result_cache.reject(key, e)
+        raise
+    if key:
+        await result_cache.store(key, result["id"])
+        result_cache.resolve(key, result)
+    return result
 
-    angles = [
-        {"label": "Close Up", "prompt": "Extreme close-up portrait, detailed eyes, intense stare"},
-        {"label": "Wide Action", "prompt": "Wide shot, full body action pose, dynamic environment"},
-        {"label": "Side Profile", "prompt": "Side profile shot, looking left, sharp jawline"},
-        {"label": "Low Angle", "prompt": "Low angle shot from below looking up, heroic stature"},
-        {"label": "Dutch Angle", "prompt": "Dutch angle, tilted camera, tense atmosphere"},
-        {"label": "Cinematic", "prompt": "Cinematic medium shot, perfect lighting"}
-    ]
+async def store_output(step: dict, limit: asyncio.Semaphore):
+    output = await providers.result(step)
 
-    base_workflow = load_workflow("workflow_multishot.json")
-    generated_ids = []
+    async with limit:
+        # Download Result, named after its content hash: renders finishing together can never
+        # collide, identical bytes are stored once, and the file is immutable (cacheable forever)
+        extension = providers.extension(step, output)
+        target = ContentTarget(GENERATED_DIR, lambda digest: content_filename(step["filename_prefix"], digest, extension))
+        # A client waiting on /generate-image/stream receives the bytes as they are written
+        tee = download_tees.pop(step.get("tee"), None)
+        with metrics.span("download"):
+            local_path, _, _ = await providers.download(step, output, target, sinks=(tee,) if tee else ())
+        local_filename = os.path.basename(local_path)
+        if step["row"]["type"] == "image":
+            thumbnails.enqueue("generated", local_filename)
+        elif step["row"]["type"] == "video":
+            video_previews.enqueue(local_filename)
 
-    for angle in angles:
-        print(f"🔄 Processing Angle: {angle['label']}...")
-        workflow = json.loads(json.dumps(base_workflow))
+        final_url = f"{PUBLIC_BASE_URL}/generated/{local_filename}"
 
-        if "3" in workflow: workflow["3"]["inputs"]["seed"] = random.randint(1, 1000000000000)
-        
-        base_prompt = source_item['prompt'].split(', shot on')[0]
-        full_angle_prompt = f"{angle['prompt']}, {base_prompt}, detailed, 8k"
-        
-        if "6" in workflow: workflow["6"]["inputs"]["text"] = full_angle_prompt
+        # Angles finishing together share one insert transaction
+        with metrics.span("db_insert"):
+            content_id = await content.insert(dict(step["row"], url=final_url, created_at=time.time()))
 
-        for nid, node in workflow.items():
-            if node["class_type"] == "LoadImage":
-                workflow[nid]["inputs"]["image"] = comfy_filename
-                break
+    result = {"id": content_id, "url": final_url, "label": step.get("label")}
+    if "seed" in step:
+        result["seed"] = step["seed"]
+    return result
 
-        try:
-            output_filename = comfy.get_image(workflow)
-            
-            runpod_url = f"{comfy.base_url}/view?filename={output_filename}&type=output"
-            target_filename = f"multishot_{angle['label'].replace(' ', '')}_{int(time.time())}.png"
-            target_path = os.path.join(GENERATED_DIR, target_filename)
-            
-            with requests.get(runpod_url, stream=True, headers={"User-Agent": "Mozilla/5.0"}) as r:
-                r.raise_for_status()
-                with open(target_path, "wb") as f:
-                    f.write(r.content)
-            
-            final_url = f"http://localhost:8000/generated/{target_filename}"
-
-            conn = sqlite3.connect(DB_NAME)
-            c = conn.cursor()
-            c.execute(
-                "INSERT INTO generated_content (type, prompt, url, camera, lens, focal_length, is_proxy, parent_id, created_at) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                ("image", full_angle_prompt, final_url, angle['label'], "InstantID", "N/A", 1, req.source_image_id, time.time()),
-            )
-            generated_ids.append(c.lastrowid)
-            conn.commit()
-            conn.close()
-            
-        except Exception as e:
-            print(f"❌ Failed to generate {angle['label']}: {e}")
+providers = ProviderRouter([
+    ComfyProvider(
+        comfy, build_comfy_workflow, PromptBatcher(comfy.submit, window=BATCH_WINDOW_MS / 1000, max_batch=MAX_BATCH),
+        concurrency=COMFYUI_CONCURRENCY, timeout=COMFYUI_TIMEOUT,
+        retries=PROVIDER_RETRIES, backoff=PROVIDER_BACKOFF, cost={"image": COMFYUI_IMAGE_COST},
+    ),
+    FalProvider(
+        queue_url=FAL_QUEUE_URL, webhook_url=FAL_WEBHOOK_URL, inbox=webhook_inbox,
+        status_interval=FAL_STATUS_INTERVAL, inline_inputs=FAL_INLINE_INPUTS,
+        concurrency=FAL_CONCURRENCY, timeout=FAL_TIMEOUT,
+        retries=PROVIDER_RETRIES, backoff=PROVIDER_BACKOFF, cost={"image": FAL_IMAGE_COST, "video": FAL_VIDEO_COST},
+    ),
+], seconds_per_dollar=ROUTING_SECONDS_PER_DOLLAR)
+
+async def cancel_step(step: dict):
+    """Drops an unfinished step's work from its provider (ComfyUI queue delete / interrupt, fal cancel)"""
+    if "provider" in step or "prompt_id" in step:
+        await providers.cancel(step)
+
+jobs.register("image", JobHandler(submit_image, finish_step, cancel=cancel_step))
+jobs.register("multishot", JobHandler(
+    submit_multishot, finish_step, concurrency=MULTISHOT_CONCURRENCY, cancel=cancel_step, priority=PRIORITY_BULK,
+))
+jobs.register("video", JobHandler(submit_video, finish_step, cancel=cancel_step))
+
+def client_key(request: Request):
+    """Who a job belongs to: the X-Client-Id header (one per browser tab), else the client address"""
+    return request.headers.get("x-client-id") or (request.client.host if request.client else None)
+
+async def wait_for_client(request: Request, job_id: str):
+    """jobs.wait(job_id), cancelling the job if the client disconnects first (e.g. the tab was closed)"""
+    finished = asyncio.create_task(jobs.wait(job_id))
+    try:
+        while True:
+            done, _ = await asyncio.wait({finished}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return finished.result()
+            if await request.is_disconnected():
+                print(f"🔌 Client Left: cancelling job {job_id}")
+                await jobs.cancel(job_id)
+    finally:
+        finished.cancel()
+
+async def supersede_multishots(request: Request):
+    """A tab starting a new multishot no longer wants the angles of its previous one"""
+    client_id = request.headers.get("x-client-id")
+    if client_id:
+        for job in await jobs.active(client_id, "multishot"):
+            print(f"⏭️ Superseded multishot {job['id']}")
+            await jobs.cancel(job["id"])
+
+# --- ENDPOINTS ---
+
+@app.post("/generate-image")
+async def generate_image(req: GenerateRequest, request: Request):
+    # Runs as a job (restart-safe); a client that goes away cancels it
+    providers.check("image", req.provider)
+    job = await jobs.submit("image", jsonable_encoder(req), client_id=client_key(request))
+    job = await wait_for_client(request, job["id"])
+    if job["status"] == CANCELLED:
+        raise HTTPException(status_code=409, detail="Job cancelled")
+    if job["status"] != "succeeded":
+        print(f"❌ Generation Error: {job['error']}")
+        raise HTTPException(status_code=500, detail=job["error"])
+
+    item = job["result"]["items"][0]
+    return {"status": "success", "image_url": item["url"], "seed": item.get("seed")}
+
+
+@app.post("/generate-image/stream")
+async def generate_image_stream(req: GenerateRequest, request: Request):
+    """
+    Same as /generate-image, but responds with the PNG itself, streamed to the
+    client while it is being written to generated/. X-Job-Id names the job
+    (GET /jobs/{id}) holding the stored item.
+    """
+    providers.check("image", req.provider)
+    tee = uuid.uuid4().hex
+    queue = download_tees[tee] = tee_queue()
+    first_chunk = finished = None
+    streaming = False
+
+    def release():
+        """Whatever happens to the response: nothing is left waiting on this tee or its client"""
+        if first_chunk:
+            first_chunk.cancel()
+        if finished:
+            finished.cancel()
+        # store_output took the tee: what it still writes must be consumed, or the download blocks
+        if download_tees.pop(tee, None) is None and not streaming:
+            discard(queue)
+
+    try:
+        job = await jobs.submit("image", dict(jsonable_encoder(req), tee=tee), client_id=client_key(request))
+        first_chunk = asyncio.create_task(queue.get())
+        # Left running if we are cancelled: it cancels the job once the client is gone
+        waiting = asyncio.create_task(wait_for_client(request, job["id"]))
+        done, _ = await asyncio.wait({first_chunk, waiting}, return_when=asyncio.FIRST_COMPLETED)
+    except BaseException:
+        release()
+        raise
+    finished = waiting
+    headers = {"X-Job-Id": job["id"]}
+
+    if first_chunk not in done:
+        # Nothing was tee'd: the job failed before its download (or was resumed without us)
+        first_chunk.cancel()
+        download_tees.pop(tee, None)
+        job = finished.result()
+        if job["status"] == CANCELLED:
+            raise HTTPException(status_code=409, detail="Job cancelled")
+        if job["status"] != "succeeded":
+            raise HTTPException(status_code=500, detail=job["error"])
+        local_path = os.path.join(GENERATED_DIR, os.path.basename(job["result"]["items"][0]["url"]))
+        return FileResponse(local_path, media_type="image/png", headers=headers)
+
+    chunk = first_chunk.result()
+    if isinstance(chunk, BaseException):
+        job = await finished
+        raise HTTPException(status_code=500, detail=job["error"] or str(chunk))
 
+    async def body():
+        nonlocal streaming
+        # drain() takes over the queue from here, also if the client leaves midway
+        streaming = True
+        if chunk is not None:
+            yield chunk
+            async for rest in drain(queue):
+                yield rest
+
+    # Runs after the response, also when the client left before its body was read
+    return StreamingResponse(body(), media_type="image/png", headers=headers, background=BackgroundTask(release))
+
+@app.post("/generate-multishot")
+async def generate_multishot(req: MultishotRequest, request: Request):
+    if not await content.get_item(req.source_image_id):
+        raise HTTPException(status_code=404, detail="Source image DB record not found")
+
+    await supersede_multishots(request)
+    job = await jobs.submit("multishot", jsonable_encoder(req), client_id=client_key(request))
+    job = await wait_for_client(request, job["id"])
+    if job["status"] == CANCELLED:
+        raise HTTPException(status_code=409, detail="Job cancelled")
+    if job["status"] != "succeeded":
+        print(f"❌ Multishot Error: {job['error']}")
+        raise HTTPException(status_code=500, detail=job["error"])
+    items = (job["result"] or {}).get("items", [])
+
+    # Items follow angle order regardless of which render finished first
+    generated_ids = [item["id"] for item in items if "id" in item]
     return {"status": "success", "proxy_ids": generated_ids}
 
+@app.post("/generate-multishot/stream")
+async def generate_multishot_stream(req: MultishotRequest, request: Request):
+    """
+    Same as /generate-multishot, but streams one NDJSON line per angle as it
+    lands. A job that fails or is cancelled ends the stream with a
+    {"status": ..., "error": ...} line, as the status code has already been sent.
+    """
+    if not await content.get_item(req.source_image_id):
+        raise HTTPException(status_code=404, detail="Source image DB record not found")
+
+    await supersede_multishots(request)
+    job = await jobs.submit("multishot", jsonable_encoder(req), client_id=client_key(request))
+
+    async def events():
+        status = job["status"]
+        try:
+            async for event in jobs.events(job["id"]):
+                if event["type"] == "step":
+                    yield json.dumps(event["result"] or {"error": event["error"]}) + "\n"
+                elif event["type"] == "status":
+                    status = event["job"]["status"]
+                    if status in TERMINAL and status != "succeeded":
+                        yield json.dumps({"status": status, "error": event["job"]["error"]}) + "\n"
+        finally:
+            if status not in TERMINAL:
+                # The client stopped reading: nobody is waiting for the remaining angles
+                jobs.cancel_soon(job["id"])
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.get("/providers")
+async def get_providers():
+    """Generation providers with their load, latency estimate, cost and routing score"""
+    return providers.status()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint: per-stage timing histograms, stage errors, in-flight jobs, bridge sockets"""
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
+@app.get("/nodes")
+async def get_nodes():
+    """ComfyUI nodes in the pool with their health, queue depth and recent render time"""
+    return comfy.status()
+
+# --- JOB ENDPOINTS ---
+@app.post("/jobs/generate-image", status_code=202)
+async def submit_image_job(req: GenerateRequest, request: Request):
+    providers.check("image", req.provider)
+    return await jobs.submit("image", jsonable_encoder(req), client_id=client_key(request))
+
+@app.post("/jobs/generate-video", status_code=202)
+async def submit_video_job(req: VideoRequest, request: Request):
+    providers.check("video", req.provider)
+    if not await content.get_item(req.source_image_id):
+        raise HTTPException(status_code=404, detail="Source image DB record not found")
+    return await jobs.submit("video", jsonable_encoder(req), client_id=client_key(request))
+
+@app.post("/jobs/generate-multishot", status_code=202)
+async def submit_multishot_job(req: MultishotRequest, request: Request):
+    if not await content.get_item(req.source_image_id):
+        raise HTTPException(status_code=404, detail="Source image DB record not found")
+    await supersede_multishots(request)
+    return await jobs.submit("multishot", jsonable_encoder(req), client_id=client_key(request))
+
+@app.get("/jobs")
+async def list_jobs(client_id: Optional[str] = None, kind: Optional[str] = None):
+    """Queued and running jobs in the order workers will take them (interactive before bulk)"""
+    return await jobs.active(client_id, kind)
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancels a job: its ComfyUI prompts are removed from the queue or interrupted mid-render"""
+    job = await jobs.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-Sent Events: status changes, per-step results and ComfyUI progress"""
+    if not await jobs.get(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def sse():
+        async for event in jobs.events(job_id):
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(sse(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.get("/history")
-async def get_history():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM generated_content WHERE is_proxy = 0 ORDER BY id DESC")
-    items = c.fetchall()
-    conn.close()
-    return items
+async def get_history(
+    request: Request,
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=500),
+    type: Optional[str] = None,
+    favorite: Optional[bool] = None,
+    camera: Optional[str] = None,
+    created_after: Optional[float] = None,
+    created_before: Optional[float] = None,
+    fields: Optional[str] = None,
+    include_proxies: bool = False,
+):
+    """
+    Keyset-paginated gallery: pass the X-Next-Cursor header back as ?cursor= for
+    the next page. ?fields=id,url,... trims each row. Responses carry an ETag
+    derived from the library version, so unchanged polls get a 304.
+    ?include_proxies=true embeds proxy_ids/proxy_count per row (one extra query per page).
+    """
+    columns = CONTENT_COLUMNS
+    if fields:
+        columns = tuple(f.strip() for f in fields.split(",") if f.strip())
+        unknown = [c for c in columns if c not in CONTENT_COLUMNS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+
+    version = await content.version()
+    query_key = hashlib.sha1(str(sorted(request.query_params.multi_items())).encode()).hexdigest()[:16]
+    etag = f'"h{version}-{query_key}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    filters = {
+        "type": type,
+        "is_favorite": None if favorite is None else int(favorite),
+        "camera": camera,
+        "created_after": created_after,
+        "created_before": created_before,
+    }
+    rows, next_cursor = await content.list_history(cursor, limit, filters, columns)
+    items = [dict(row) for row in rows]
+    for item in items:
+        add_derivative_urls(item)
+    if include_proxies and items:
+        children = await content.proxies_by_parent([item["id"] for item in items], ids_only=True)
+        for item in items:
+            item["proxy_ids"] = children[item["id"]]
+            item["proxy_count"] = len(item["proxy_ids"])
+
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+    return JSONResponse(items, headers=headers)
+
+@app.get("/search")
+async def search_history(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0, le=10000),
+    type: Optional[str] = None,
+    favorite: Optional[bool] = None,
+    camera: Optional[str] = None,
+    lens: Optional[str] = None,
+    fields: Optional[str] = None,
+    include_proxies: bool = False,
+):
+    """
+    Full-text search over prompts, cameras and lenses, best matches first. Every
+    word of q must match; the last one may be a prefix ("anam" finds "anamorphic").
+    Returns {"total", "items", "facets": {"camera": [...], "lens": [...]}, "next_offset"};
+    ?fields= trims items like /history. Same ETag/304 behaviour as /history.
+    """
+    columns = CONTENT_COLUMNS
+    if fields:
+        columns = tuple(f.strip() for f in fields.split(",") if f.strip())
+        unknown = [c for c in columns if c not in CONTENT_COLUMNS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    if "id" not in columns:
+        columns = ("id", *columns)
+    if not search_index.available:
+        raise HTTPException(status_code=503, detail="Search unavailable: this SQLite has no FTS5")
+
+    version = await content.version()
+    query_key = hashlib.sha1(str(sorted(request.query_params.multi_items())).encode()).hexdigest()[:16]
+    etag = f'"s{version}-{query_key}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    filters = {
+        "type": type,
+        "is_favorite": None if favorite is None else int(favorite),
+        "camera": camera,
+        "lens": lens,
+        "is_proxy": None if include_proxies else 0,
+    }
+    rows, total, facets = await search_index.search(q, filters, limit, offset, columns)
+    items = [dict(row) for row in rows]
+    for item in items:
+        add_derivative_urls(item)
+
+    next_offset = offset + len(items) if offset + len(items) < total else None
+    return JSONResponse({"total": total, "items": items, "facets": facets, "next_offset": next_offset}, headers=headers)
+
+@app.put("/history/{item_id}/favorite")
+async def set_favorite(item_id: int, req: FavoriteRequest):
+    """Favorites are never removed by storage GC (nor, for a shot, its proxies)"""
+    if not await content.set_favorite(item_id, req.is_favorite):
+        raise HTTPException(status_code=404, detail="Item not found")
+    return {"id": item_id, "is_favorite": req.is_favorite}
+
+@app.delete("/history/{item_id}")
+async def delete_item(item_id: int):
+    """Deletes a shot and its unfavorited proxies; their files are reclaimed by the next GC pass"""
+    if not await content.delete_item(item_id):
+        raise HTTPException(status_code=404, detail="Item not found")
+    return {"id": item_id, "deleted": True}
+
+@app.get("/proxies")
+async def get_proxies_batch(parent_ids: str = Query(..., description="Comma-separated parent ids")):
+    """Proxies for many parents in one request and one query: {parent_id: [rows]}"""
+    try:
+        ids = [int(part) for part in parent_ids.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="parent_ids must be comma-separated integers")
+    if len(ids) > 5000:
+        raise HTTPException(status_code=400, detail="Too many parent_ids (max 5000)")
+
+    return await content.proxies_by_parent(ids)
 
 @app.get("/proxies/{parent_id}")
 async def get_proxies(parent_id: int):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM generated_content WHERE parent_id = ? ORDER BY id ASC", (parent_id,))
-    items = c.fetchall()
-    conn.close()
-    return items
+    return await content.list_proxies(parent_id)
+
+# --- THUMBNAILS ---
+def thumbnail_url(url: str, size: str = "medium"):
+    kind = "uploads" if "/uploads/" in url else "generated"
+    return f"{PUBLIC_BASE_URL}/thumbnails/{kind}/{os.path.basename(url)}?size={size}"
+
+def add_derivative_urls(item: dict):
+    """Gallery rows: thumb_url for images, poster_url/preview_url for videos (when ffmpeg can make them)"""
+    if not item.get("url"):
+        return
+    kind = item.get("type", "image")
+    if kind == "image":
+        item["thumb_url"] = thumbnail_url(item["url"])
+    elif kind == "video" and video_previews.enabled:
+        name = os.path.basename(item["url"])
+        item["poster_url"] = f"{PUBLIC_BASE_URL}/videos/{name}/poster"
+        item["preview_url"] = f"{PUBLIC_BASE_URL}/videos/{name}/preview"
+
+@app.get("/thumbnails/{kind}/{filename}")
+async def get_thumbnail(request: Request, kind: str, filename: str, size: str = "thumb", format: Optional[str] = None):
+    """WebP/AVIF derivative of a generated or uploaded image; ?format= or the Accept header picks the codec"""
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of: {', '.join(THUMBNAIL_SIZES)}")
+    if format is None:
+        format = "avif" if "avif" in thumbnails.formats and "image/avif" in request.headers.get("accept", "") else "webp"
+
+    path = await thumbnails.get(kind, filename, size, format)
+    if path is None:
+        source = thumbnails.source_path(kind, filename)
+        if source is None or not os.path.exists(source):
+            raise HTTPException(status_code=404, detail="Image not found")
+        # No encoder available (e.g. Pillow missing): serve the original rather than break the gallery
+        return FileResponse(source)
+    return FileResponse(path, media_type=f"image/{format}", headers={"Cache-Control": "public, max-age=86400", "Vary": "Accept"})
+
+# --- STORAGE ---
+@app.get("/storage/gc")
+async def storage_gc_report():
+    """Dry run: what a GC pass would remove right now, next to the report of the latest real pass"""
+    _, last_report = await storage_gc.last_run()
+    return {"pending": await storage_gc.collect(dry_run=True), "last_run": last_report}
+
+@app.post("/storage/gc")
+async def run_storage_gc(dry_run: bool = False):
+    report = await storage_gc.collect(dry_run=dry_run)
+    if report is None:
+        raise HTTPException(status_code=409, detail="A GC pass is already running on another worker")
+    return report
+
+# --- VIDEO PREVIEWS ---
+# Derivatives get the same ETag, immutable caching and Range support as the originals
+derivative_files = ImmutableStaticFiles(directory=DERIVATIVES_DIR, check_dir=False)
+
+@app.get("/videos/{filename}/{variant}")
+async def get_video_preview(request: Request, filename: str, variant: str):
+    """Poster frame (JPEG) or low-bitrate preview (MP4) of a generated video"""
+    if variant not in VIDEO_PREVIEW_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"variant must be one of: {', '.join(VIDEO_PREVIEW_VARIANTS)}")
+    path = await video_previews.get(filename, variant)
+    if path is None:
+        source = video_previews.source_path(filename)
+        if source is None or not os.path.exists(source):
+            raise HTTPException(status_code=404, detail="Video not found")
+        if variant == "poster":
+            raise HTTPException(status_code=404, detail="No poster frame for this video")
+        # No ffmpeg (or extraction failed): the original stands in for its preview
+        path = source
+    return derivative_files.file_response(path, os.stat(path), request.scope)
+
+# --- WEBHOOKS ---
+@app.post("/webhooks/fal")
+async def fal_webhook(request: Request):
+    """
+    fal's completion callback (FAL_WEBHOOK_URL). Calls must carry a valid fal
+    signature and name a request of an unfinished job. A callback only wakes
+    the job waiting on it, which then reads status and result from fal itself.
+    """
+    raw = await request.body()
+    if not await fal_webhooks.verify(request.headers, raw):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    try:
+        body = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    request_id = body.get("request_id") if isinstance(body, dict) else None
+    if not request_id:
+        raise HTTPException(status_code=400, detail="request_id required")
+    # Late callbacks (the job already finished through a status poll) are acknowledged and dropped;
+    # one racing the job's first save is too, and the waiting step finds the result by polling
+    if str(request_id) not in {step.get("request_id") for step in await jobs.unfinished_steps()}:
+        return {"status": "ignored"}
+    await webhook_inbox.deliver(str(request_id), body.get("status"))
+    return {"status": "ok"}
+
+# --- UPLOADS ---
+@app.post("/upload")
+async def upload_reference(request: Request):
+    """
+    Saves a reference image to uploads/. The body (JSON {"base64_data": <data URL>},
+    a bare data URL, or raw image/* bytes) is decoded and written as it streams in.
+    """
+    if request.headers.get("content-type", "").startswith("image/"):
+        chunks = request.stream()
+    else:
+        chunks = iter_data_url(request.stream())
+
+    sniffed = {}
+    async def tagged():
+        async for chunk in chunks:
+            if chunk and "ext" not in sniffed:
+                sniffed["ext"] = image_extension(chunk)
+            yield chunk
+
+    try:
+        path, size, digest = await write_content_stream(
+            tagged(), UPLOAD_DIR, lambda digest: content_filename("upload", digest, sniffed.get("ext", ".png"))
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if size == 0:
+        os.remove(path)
+        raise HTTPException(status_code=400, detail="Empty image")
+
+    filename = os.path.basename(path)
+    await uploads_index.record(path)
+    thumbnails.enqueue("uploads", filename)
+    print(f"📥 Upload Saved: {filename} ({size} bytes)")
+    return {"status": "success", "url": f"{PUBLIC_BASE_URL}/uploads/{filename}"}
 
 # --- GALLERY ENDPOINT (Fixes 404 on Uploads) ---
 @app.get("/uploads")
-async def get_uploads_list():
-    if not os.path.exists(UPLOAD_DIR):
-        return []
-    
+async def get_uploads_list(cursor: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
+    """Newest uploads first, served from the uploads index (no directory scan)"""
+    try:
+        rows, next_cursor = await uploads_index.list(cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     files = []
-    # Sort by time so newest are first
-    for filename in sorted(os.listdir(UPLOAD_DIR), key=lambda f: os.path.getmtime(os.path.join(UPLOAD_DIR, f)), reverse=True):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
-            files.append({
-                "id": int(os.path.getmtime(os.path.join(UPLOAD_DIR, filename))),
-                "url": f"http://localhost:8000/uploads/{filename}",
-                "type": "image",
-                "base64_data": f"http://localhost:8000/uploads/{filename}" 
-            })
-    return files
-
-app.mount("/generated", StaticFiles(directory=GENERATED_DIR), name="generated")
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+    for row in rows:
+        files.append({
+            "id": row["id"],
+            "url": f"{PUBLIC_BASE_URL}/uploads/{row['filename']}",
+            "type": "image",
+            "base64_data": f"{PUBLIC_BASE_URL}/uploads/{row['filename']}" 
+        })
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return JSONResponse(files, headers=headers)
+
+# Content-addressed files are served as immutable with strong ETags; Range requests get 206
+app.mount("/generated", ImmutableStaticFiles(directory=GENERATED_DIR), name="generated")
+app.mount("/uploads", ImmutableStaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
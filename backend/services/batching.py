@@ -0,0 +1,94 @@
+import json
+import asyncio
+import hashlib
+
+from services.workflows import with_batch_size
+
+# Inputs that may differ between requests sharing one batched prompt
+SEED_INPUTS = ("seed", "noise_seed")
+
+
+def batch_key(workflow):
+    """
+    Hash of a workflow with its seeds blanked: equal keys can share one batched latent.
+    Everything else counts, prompt text included, since one prompt has one conditioning.
+    """
+    normalized = {
+        node_id: {**node, "inputs": {k: v for k, v in node["inputs"].items() if k not in SEED_INPUTS}}
+        for node_id, node in workflow.items()
+    }
+    canonical = json.dumps(normalized, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _Batch:
+    def __init__(self, workflow, inputs, front):
+        self.workflow = workflow
+        self.inputs = inputs
+        self.front = front
+        self.members = []
+        self.timer = None
+
+
+# --- MICRO-BATCHING ---
+class PromptBatcher:
+    """
+    Collects compatible prompts (same workflow apart from the seed) for up to
+    `window` seconds and queues them as one prompt with batch_size = n, so the
+    GPU renders n latents in one pass. Each caller gets the shared submission
+    plus its index into the output images. The first request's seed drives the
+    whole batch.
+
+    Compatible means the same prompt text as well as the same size and model:
+    requests for different prompts are not batched, as that would need a
+    conditioning per latent. Members of a batch share one ComfyUI prompt, so
+    cancelling one of them cannot stop the render while others still wait for
+    it (ComfyProvider.cancel drops the prompt once all of them are cancelled).
+    """
+
+    def __init__(self, submit, window=0.05, max_batch=4):
+        self._submit = submit
+        self.window = window
+        self.max_batch = max_batch
+        self._open = {}
+        self._flushing = set()
+
+    async def submit(self, workflow, inputs=(), front=False):
+        """Returns (submission, submitted workflow, batch_index, batch_size)"""
+        if self.max_batch <= 1 or self.window <= 0 or with_batch_size(workflow, 1) is None:
+            return await self._submit(workflow, inputs, front=front), workflow, 0, 1
+
+        key = (batch_key(workflow), front)
+        batch = self._open.get(key)
+        if batch is None:
+            batch = self._open[key] = _Batch(workflow, list(inputs), front)
+            batch.timer = asyncio.get_running_loop().call_later(self.window, self._close, key, batch)
+        future = asyncio.get_running_loop().create_future()
+        batch.members.append(future)
+        if len(batch.members) >= self.max_batch:
+            batch.timer.cancel()
+            self._close(key, batch)
+        return await future
+
+    def _close(self, key, batch):
+        if self._open.get(key) is batch:
+            del self._open[key]
+            task = asyncio.create_task(self._flush(batch))
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+
+    async def _flush(self, batch):
+        size = len(batch.members)
+        workflow = with_batch_size(batch.workflow, size) if size > 1 else batch.workflow
+        try:
+            submission = await self._submit(workflow, batch.inputs, front=batch.front)
+        except Exception as e:
+            for future in batch.members:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        if size > 1:
+            print(f"📦 Batched {size} prompts into {submission['prompt_id']}")
+        for index, future in enumerate(batch.members):
+            if not future.done():
+                future.set_result((submission, workflow, index, size))
@@ -0,0 +1,258 @@
+import json
+import time
+import asyncio
+
+import httpx
+from fastapi import HTTPException
+
+from services import metrics
+from services.comfy_bridge import ComfyBridge, NodeDownError, HEADERS
+
+HEALTH_TIMEOUT = 5.0
+# Consecutive failed health checks before a node leaves the rotation
+FAIL_THRESHOLD = 2
+# Render-time estimate for nodes that have not finished anything yet, and its smoothing
+DEFAULT_RENDER_SECONDS = 10.0
+RENDER_EWMA = 0.3
+# How long a resubmission waits for any node to come back before giving up
+RESUBMIT_WAIT = 60.0
+
+
+def load_nodes(addresses="", config_file=None):
+    """
+    [(name, address)] from a JSON config file (a list of {"name", "address"} or of
+    plain addresses) or a comma-separated address list. Names default to the address.
+    """
+    if config_file:
+        with open(config_file) as f:
+            entries = json.load(f)
+    else:
+        entries = [address.strip() for address in addresses.split(",") if address.strip()]
+
+    nodes = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"address": entry}
+        nodes.append((entry.get("name") or entry["address"].rstrip("/"), entry["address"]))
+    if not nodes:
+        raise ValueError("No ComfyUI nodes configured")
+    return nodes
+
+
+class Node:
+    """One ComfyUI endpoint plus what the router knows about it"""
+
+    def __init__(self, name, bridge: ComfyBridge):
+        self.name = name
+        self.bridge = bridge
+        self.healthy = True
+        self.failures = 0
+        self.depth = 0        # running + pending on the node at the last health check
+        self.assigned = 0     # prompts we queued since that check
+        self.rtt = 0.0
+        self.render_seconds = None
+        self.last_done = 0.0
+
+    def score(self):
+        """Estimated seconds until a new prompt would finish here"""
+        render = self.render_seconds or DEFAULT_RENDER_SECONDS
+        return (self.depth + self.assigned + 1) * render + self.rtt
+
+    def observe_render(self, submitted_at):
+        now = time.monotonic()
+        # FIFO queue: service time starts when the previous prompt finished, or at submit
+        seconds = now - max(submitted_at, self.last_done)
+        self.last_done = now
+        if self.render_seconds is None:
+            self.render_seconds = seconds
+        else:
+            self.render_seconds += RENDER_EWMA * (seconds - self.render_seconds)
+
+    def info(self):
+        return {
+            "name": self.name,
+            "url": self.bridge.base_url,
+            "healthy": self.healthy,
+            "queue_depth": self.depth + self.assigned,
+            "rtt_ms": round(self.rtt * 1000, 1),
+            "render_seconds": self.render_seconds,
+        }
+
+
+# --- BRIDGE POOL ---
+class BridgePool:
+    """
+    Spreads prompts over several ComfyUI nodes. Each prompt goes to the node with
+    the lowest estimated finish time ((queue depth + 1) x recent render time),
+    a background loop polls every node's /queue as its health check, and a node
+    that stops answering is taken out of rotation: prompts waiting on it are
+    resubmitted elsewhere (inputs re-uploaded through the upload cache).
+
+    Steps hold "node", "prompt_id", "workflow", "inputs" (local paths) and
+    "front", which is everything needed to resubmit them, even after a restart.
+    """
+
+    def __init__(self, nodes, upload_cache, health_interval=5.0, client_id=None):
+        self.nodes = {name: Node(name, ComfyBridge(address, client_id=client_id)) for name, address in nodes}
+        self.upload_cache = upload_cache
+        self.health_interval = health_interval
+        self._owners = {}
+        self._submitted = {}
+        self._health = None
+        # For fetching arbitrary URLs (remote reference images), not tied to a node
+        self.http = httpx.AsyncClient(headers=HEADERS, timeout=httpx.Timeout(60.0, connect=10.0), follow_redirects=True)
+
+    async def start(self):
+        await self._check_all()
+        self._health = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health:
+            self._health.cancel()
+            await asyncio.gather(self._health, return_exceptions=True)
+            self._health = None
+        await asyncio.gather(*(node.bridge.close() for node in self.nodes.values()))
+        await self.http.aclose()
+
+    def status(self):
+        return [node.info() for node in self.nodes.values()]
+
+    # --- ROUTING ---
+    def _node(self, name):
+        # Steps saved before the pool existed carry no node: they ran on the first one
+        return self.nodes.get(name) if name else next(iter(self.nodes.values()))
+
+    def estimate_seconds(self):
+        """Estimated seconds until a prompt submitted now would finish on the best node"""
+        node = self._pick()
+        return node.score() if node else float("inf")
+
+    def _pick(self, exclude=()):
+        candidates = [node for node in self.nodes.values() if node.healthy and node.name not in exclude]
+        return min(candidates, key=Node.score) if candidates else None
+
+    async def submit(self, workflow, inputs=(), exclude=(), front=False):
+        """
+        Uploads `inputs` to the best node and queues the workflow there: {"prompt_id", "node"}.
+        `front` puts it ahead of prompts already waiting on that node.
+        """
+        tried = set(exclude)
+        while True:
+            node = self._pick(tried)
+            if node is None:
+                raise HTTPException(status_code=503, detail="No healthy ComfyUI nodes")
+            node.assigned += 1
+            try:
+                # txt2img has nothing to upload: no near-zero samples in the upload histogram
+                if inputs:
+                    with metrics.span("reference_upload"):
+                        for path in inputs:
+                            await self.upload_cache.ensure(node.bridge, path)
+                with metrics.span("queue_prompt"):
+                    prompt_response = await node.bridge.queue_prompt(workflow, front)
+            except Exception as e:
+                node.assigned -= 1
+                print(f"❌ Submit Error ({node.name}): {getattr(e, 'detail', e)}")
+                tried.add(node.name)
+                continue
+            prompt_id = prompt_response["prompt_id"]
+            self._owners[prompt_id] = node
+            self._submitted[prompt_id] = time.monotonic()
+            return {"prompt_id": prompt_id, "node": node.name}
+
+    async def _resubmit(self, step):
+        dead = step.get("node")
+        if "workflow" not in step:
+            raise NodeDownError(f"{dead} is unavailable and the prompt cannot be resubmitted")
+        deadline = time.monotonic() + RESUBMIT_WAIT
+        while self._pick() is None and time.monotonic() < deadline:
+            await asyncio.sleep(self.health_interval)
+        self._owners.pop(step["prompt_id"], None)
+        submission = await self.submit(step["workflow"], step.get("inputs", ()), front=step.get("front", False))
+        print(f"🔁 Resubmitted {step['prompt_id']} from {dead} to {submission['node']} as {submission['prompt_id']}")
+        step.update(submission)
+
+    # --- PROMPTS ---
+    async def track(self, prompt_id, node_name=None):
+        """Re-attaches to a prompt queued before a restart (no-op if its node is gone; wait() resubmits)"""
+        node = self._node(node_name)
+        if node is None or not node.healthy:
+            return
+        self._owners[prompt_id] = node
+        await node.bridge.track(prompt_id)
+
+    async def wait(self, step):
+        """
+        Waits for step's prompt and returns its output filename, moving it to another
+        node if its own goes down. step["node"]/["prompt_id"] are updated in place.
+        """
+        while True:
+            node = self._node(step.get("node"))
+            if node is None or not node.healthy:
+                await self._resubmit(step)
+                continue
+            self._owners[step["prompt_id"]] = node
+            try:
+                with metrics.span("gpu_wait"):
+                    filename = await node.bridge.get_output_filename(step["prompt_id"], step.get("batch_index", 0))
+            except (NodeDownError, httpx.HTTPError):
+                if node.healthy:
+                    raise
+                continue
+            finally:
+                self._owners.pop(step["prompt_id"], None)
+            submitted_at = self._submitted.pop(step["prompt_id"], None)
+            if submitted_at is not None:
+                node.observe_render(submitted_at)
+            return filename
+
+    async def cancel(self, step):
+        """Removes step's prompt from its node's queue (interrupting it if it is rendering)"""
+        node = self._node(step.get("node"))
+        self._submitted.pop(step["prompt_id"], None)
+        if node is None or not node.healthy:
+            return False
+        return await node.bridge.cancel(step["prompt_id"])
+
+    async def download(self, step, filename, target, sinks=()):
+        return await self._node(step.get("node")).bridge.download(filename, target, sinks)
+
+    def subscribe(self, prompt_id):
+        node = self._owners.get(prompt_id)
+        return node.bridge.subscribe(prompt_id) if node else asyncio.Queue()
+
+    def unsubscribe(self, prompt_id, queue):
+        node = self._owners.get(prompt_id)
+        if node:
+            node.bridge.unsubscribe(prompt_id, queue)
+
+    # --- HEALTH CHECKS ---
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self._check_all()
+
+    async def _check_all(self):
+        await asyncio.gather(*(self._check(node) for node in self.nodes.values()))
+
+    async def _check(self, node):
+        started = time.monotonic()
+        try:
+            response = await node.bridge.http.get("/queue", timeout=HEALTH_TIMEOUT)
+            response.raise_for_status()
+            queue = response.json()
+        except Exception as e:
+            node.failures += 1
+            if node.healthy and node.failures >= FAIL_THRESHOLD:
+                node.healthy = False
+                print(f"🚫 Node Down: {node.name} ({e})")
+                node.bridge.fail_pending(NodeDownError(node.name))
+            return
+
+        node.rtt = time.monotonic() - started
+        node.depth = len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+        node.assigned = 0
+        node.failures = 0
+        if not node.healthy:
+            node.healthy = True
+            print(f"✅ Node Back: {node.name}")
@@ -0,0 +1,371 @@
+import os
+import json
+import time
+import random
+import uuid
+import asyncio
+from collections import OrderedDict
+
+import httpx
+from fastapi import HTTPException
+from websockets.asyncio.client import connect as ws_connect
+
+from services import metrics
+from services.transfers import CHUNK_SIZE, write_stream
+
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+# Events that arrive before queue_prompt() has registered their prompt_id are
+# parked here (per prompt) so a fast render can't finish "between" the two.
+BACKLOG_PROMPTS = 256
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+CONNECT_TIMEOUT = 10.0
+HISTORY_POLL_INTERVAL = 2.0
+
+
+class ComfyExecutionError(Exception):
+    pass
+
+
+class NodeDownError(Exception):
+    """The ComfyUI node a prompt was queued on stopped answering health checks"""
+
+
+class PromptCancelled(Exception):
+    """The prompt was removed from the queue or interrupted on request"""
+
+
+class PromptTracker:
+    """Collects the websocket events of a single prompt_id"""
+
+    def __init__(self, prompt_id):
+        self.prompt_id = prompt_id
+        self.done = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting any more when a prompt fails (its job was cancelled); that is fine
+        self.done.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.outputs = {}
+        self.listeners = []
+        # Queued -> execution_start -> done, for the GPU queue/execution split
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.observed = False
+
+    def feed(self, message):
+        for queue in self.listeners:
+            queue.put_nowait(message)
+
+        if self.done.done():
+            return
+
+        msg_type = message["type"]
+        data = message["data"]
+        if msg_type == "execution_start":
+            self.started_at = time.monotonic()
+        elif msg_type == "executed" and data.get("output"):
+            self.outputs[data["node"]] = data["output"]
+        elif msg_type == "executing" and data.get("node") is None:
+            self.done.set_result(self.outputs)
+        elif msg_type == "execution_success":
+            self.done.set_result(self.outputs)
+        elif msg_type == "execution_error":
+            self.done.set_exception(ComfyExecutionError(data.get("exception_message", "ComfyUI execution error")))
+        elif msg_type == "execution_interrupted":
+            self.done.set_exception(ComfyExecutionError("ComfyUI execution interrupted"))
+        if self.done.done():
+            self.finished_at = time.monotonic()
+
+
+# --- COMFYUI BRIDGE (RunPod Optimized, asyncio-native) ---
+class ComfyBridge:
+    def __init__(self, server_address, max_connections: int = 32, client_id=None):
+        # Cleans the address to handle both "127.0.0.1:8188" and "https://xyz.runpod.net"
+        self.original_address = server_address.rstrip('/')
+        # ComfyUI routes a prompt's events to the socket of the client_id that queued it, and a
+        # second socket with the same id takes over the first: every process needs its own
+        self.client_id = client_id or uuid.uuid4().hex
+
+        # Determine protocols based on input
+        if "runpod.net" in self.original_address:
+            # RUNPOD MODE (Secure)
+            if not self.original_address.startswith("https://"):
+                self.base_url = f"https://{self.original_address}"
+                self.ws_url = f"wss://{self.original_address}"
+            else:
+                self.base_url = self.original_address
+                self.ws_url = self.original_address.replace("https://", "wss://")
+        else:
+            # LOCAL MODE (Standard)
+            clean_addr = self.original_address.replace("http://", "").replace("https://", "")
+            self.base_url = f"http://{clean_addr}"
+            self.ws_url = f"ws://{clean_addr}"
+
+        # One pooled client shared by every request that goes through this bridge.
+        # Keep-alive connections avoid a TLS handshake per call over the RunPod proxy.
+        self.http = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=HEADERS,
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+        # Shared websocket state: one connection per bridge, demultiplexed by prompt_id
+        self._trackers = {}
+        self._backlog = OrderedDict()
+        self._listener = None
+        self._connected = None
+        self.epoch = 0
+
+        print(f"🌉 Bridge Initialized to: {self.base_url}")
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        for tracker in self._trackers.values():
+            if not tracker.done.done():
+                tracker.done.cancel()
+        await self.http.aclose()
+
+    # --- SHARED WEBSOCKET ---
+    async def _ensure_listener(self):
+        if self._listener is None or self._listener.done():
+            self._connected = asyncio.Event()
+            self._listener = asyncio.create_task(self._listen())
+        try:
+            await asyncio.wait_for(self._connected.wait(), CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=500, detail="Could not connect to ComfyUI Stream")
+
+    async def _listen(self):
+        connect_url = f"{self.ws_url}/ws?clientId={self.client_id}"
+        delay = RECONNECT_MIN_DELAY
+        reconnecting = False
+        while True:
+            try:
+                print(f"🔌 Connecting to: {connect_url}")
+                async with ws_connect(connect_url, max_size=None) as ws:
+                    # A new connection may mean a restarted pod, which forgets its inputs
+                    self.epoch += 1
+                    self._connected.set()
+                    metrics.BRIDGE_SOCKETS.labels(self.base_url).inc()
+                    delay = RECONNECT_MIN_DELAY
+                    try:
+                        if reconnecting:
+                            # Anything that finished while we were offline only shows up in /history
+                            await self._resync()
+                        async for out in ws:
+                            if isinstance(out, str):
+                                self._dispatch(json.loads(out))
+                    finally:
+                        metrics.BRIDGE_SOCKETS.labels(self.base_url).dec()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ WebSocket Error: {e}")
+
+            self._connected.clear()
+            reconnecting = True
+            await asyncio.sleep(delay * (1 + random.random() / 2))
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def _dispatch(self, message):
+        data = message.get("data")
+        prompt_id = data.get("prompt_id") if isinstance(data, dict) else None
+        if prompt_id is None:
+            return
+
+        tracker = self._trackers.get(prompt_id)
+        if tracker:
+            tracker.feed(message)
+            return
+
+        self._backlog.setdefault(prompt_id, []).append(message)
+        self._backlog.move_to_end(prompt_id)
+        while len(self._backlog) > BACKLOG_PROMPTS:
+            self._backlog.popitem(last=False)
+
+    async def _resync(self):
+        for prompt_id, tracker in list(self._trackers.items()):
+            if tracker.done.done():
+                continue
+            try:
+                history = await self.get_history(prompt_id)
+            except Exception as e:
+                print(f"❌ Resync Error ({prompt_id}): {e}")
+                continue
+            self._complete_from_history(tracker, history)
+
+    def _complete_from_history(self, tracker, history):
+        entry = history.get(tracker.prompt_id)
+        if not entry or tracker.done.done():
+            return
+        status = entry.get("status", {})
+        if status.get("status_str") == "error":
+            tracker.done.set_exception(ComfyExecutionError("ComfyUI execution error"))
+        elif status.get("completed", True):
+            tracker.done.set_result(entry.get("outputs", {}))
+
+    def fail_pending(self, exc):
+        """Fails every prompt still waiting on this bridge (its node was taken out of rotation)"""
+        for tracker in list(self._trackers.values()):
+            if not tracker.done.done():
+                tracker.done.set_exception(exc)
+
+    def _register(self, prompt_id):
+        tracker = self._trackers.get(prompt_id)
+        if tracker is None:
+            tracker = PromptTracker(prompt_id)
+            self._trackers[prompt_id] = tracker
+            for message in self._backlog.pop(prompt_id, []):
+                tracker.feed(message)
+        return tracker
+
+    async def track(self, prompt_id):
+        """Re-attaches to a prompt that was queued earlier (e.g. before a restart)"""
+        await self._ensure_listener()
+        tracker = self._register(prompt_id)
+        self._complete_from_history(tracker, await self.get_history(prompt_id))
+        if not tracker.done.done():
+            # Queued under another client_id, so its events never reach our socket
+            asyncio.create_task(self._poll_history(tracker))
+        return tracker
+
+    async def _poll_history(self, tracker):
+        while not tracker.done.done():
+            await asyncio.sleep(HISTORY_POLL_INTERVAL)
+            try:
+                self._complete_from_history(tracker, await self.get_history(tracker.prompt_id))
+            except Exception as e:
+                print(f"❌ History Poll Error ({tracker.prompt_id}): {e}")
+
+    def subscribe(self, prompt_id):
+        """Returns a queue receiving every raw event for prompt_id (progress, executed, ...)"""
+        queue = asyncio.Queue()
+        self._register(prompt_id).listeners.append(queue)
+        return queue
+
+    def unsubscribe(self, prompt_id, queue):
+        tracker = self._trackers.get(prompt_id)
+        if tracker and queue in tracker.listeners:
+            tracker.listeners.remove(queue)
+            if tracker.done.done() and not tracker.listeners:
+                self._trackers.pop(prompt_id, None)
+
+    async def wait_for_prompt(self, prompt_id, timeout=None):
+        """Waits for prompt_id to finish and returns the outputs seen on the socket"""
+        tracker = self._trackers.get(prompt_id)
+        if tracker is None:
+            # Not queued by this process, or already collected by another waiter
+            # (batched prompts have one per image): history knows if it is done
+            tracker = await self.track(prompt_id)
+        try:
+            outputs = await asyncio.wait_for(asyncio.shield(tracker.done), timeout)
+        finally:
+            if tracker.done.done() or not tracker.listeners:
+                self._trackers.pop(prompt_id, None)
+        self._observe(tracker)
+        return outputs
+
+    def _observe(self, tracker):
+        # Only prompts whose execution_start we saw can be split (not ones completed from /history);
+        # a batched prompt has several waiters but is counted once
+        if tracker.observed or tracker.started_at is None or tracker.finished_at is None:
+            return
+        tracker.observed = True
+        metrics.observe("gpu_queue", tracker.started_at - tracker.queued_at)
+        metrics.observe("gpu_execution", tracker.finished_at - tracker.started_at)
+
+    async def upload_image(self, file_path, name=None):
+        """Uploads the local source image to ComfyUI (optionally under a fixed remote name)"""
+        try:
+            # httpx streams the open file as the multipart body instead of reading it into memory
+            with open(file_path, "rb") as file:
+                files = {"image": (name or os.path.basename(file_path), file)}
+                response = await self.http.post("/upload/image", files=files, data={"overwrite": "true"})
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            print(f"❌ Upload Error: {e}")
+            raise HTTPException(status_code=500, detail="Failed to upload to RunPod")
+
+    async def has_input(self, name):
+        """True if ComfyUI still has an uploaded input image with this name"""
+        try:
+            response = await self.http.head("/view", params={"filename": name, "type": "input"})
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    async def queue_prompt(self, workflow, front=False):
+        # The socket must be up before queueing, otherwise early events have nowhere to go
+        await self._ensure_listener()
+        p = {"prompt": workflow, "client_id": self.client_id}
+        if front:
+            # Interactive renders jump ahead of queued bulk work (ComfyUI's "front" flag)
+            p["front"] = True
+        try:
+            response = await self.http.post("/prompt", content=json.dumps(p).encode('utf-8'))
+            response.raise_for_status()
+            prompt_response = response.json()
+        except Exception as e:
+            print(f"❌ Queue Error: {e}")
+            raise HTTPException(status_code=500, detail="Failed to queue prompt")
+        self._register(prompt_response['prompt_id'])
+        return prompt_response
+
+    async def cancel(self, prompt_id):
+        """
+        Drops prompt_id from the ComfyUI queue, or interrupts it if it is already
+        rendering. Anyone waiting on it gets PromptCancelled. Returns True if it was running.
+        """
+        response = await self.http.post("/queue", json={"delete": [prompt_id]})
+        response.raise_for_status()
+        response = await self.http.get("/queue")
+        response.raise_for_status()
+        running = any(item[1] == prompt_id for item in response.json().get("queue_running", []))
+        if running:
+            # Newer ComfyUI only interrupts the given prompt; older builds interrupt whatever runs, which is this one
+            response = await self.http.post("/interrupt", json={"prompt_id": prompt_id})
+            response.raise_for_status()
+        tracker = self._trackers.get(prompt_id)
+        if tracker and not tracker.done.done():
+            tracker.done.set_exception(PromptCancelled(prompt_id))
+        return running
+
+    async def get_history(self, prompt_id):
+        response = await self.http.get(f"/history/{prompt_id}")
+        response.raise_for_status()
+        return response.json()
+
+    async def get_image(self, workflow):
+        prompt_response = await self.queue_prompt(workflow)
+        prompt_id = prompt_response['prompt_id']
+        print(f"⏳ Job Started: {prompt_id}")
+        return await self.get_output_filename(prompt_id)
+
+    async def get_output_filename(self, prompt_id, index=0):
+        """Waits for prompt_id and returns its index-th output image filename (batched prompts have several)"""
+        await self.wait_for_prompt(prompt_id)
+
+        # Fetch history
+        history = await self.get_history(prompt_id)
+        outputs = history[prompt_id]['outputs']
+
+        images = [image for node_output in outputs.values() for image in node_output.get('images', [])]
+        return images[index]['filename'] if index < len(images) else None
+
+    async def download(self, filename, target, sinks=()):
+        """
+        Streams an output image from ComfyUI's /view endpoint to a local file
+        (temp file + atomic rename), optionally teeing chunks to `sinks`
+        """
+        params = {"filename": filename, "type": "output"}
+        async with self.http.stream("GET", "/view", params=params) as r:
+            r.raise_for_status()
+            return await write_stream(r.aiter_bytes(chunk_size=CHUNK_SIZE), target, sinks)
@@ -0,0 +1,554 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import itertools
+
+from services import metrics
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TERMINAL = (SUCCEEDED, FAILED, CANCELLED)
+
+# Lower runs first: interactive single shots ahead of bulk work like multishot angles
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+# A worker owns the jobs it submitted or adopted for this long unless it renews the lease;
+# after that any worker sharing the database may adopt them (the owner died)
+LEASE_SECONDS = 30.0
+# How often a listener re-reads a job that another worker is running
+EVENT_POLL_INTERVAL = 1.0
+# Job columns added after the table first shipped
+_MIGRATIONS = {
+    "client_id": "TEXT",
+    "priority": "INTEGER DEFAULT 0",
+    "owner": "TEXT",
+    "lease_until": "REAL",
+    "cancel_requested": "INTEGER DEFAULT 0",
+}
+
+
+def default_worker_id():
+    """hostname-pid: unique per process, even for uvicorn --workers N on one host"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class JobHandler:
+    """
+    How to run one kind of job.
+    - submit(payload) queues the work on a provider and returns a list of JSON-serialisable steps,
+      each carrying the ticket it waits on (a ComfyUI prompt_id, a fal request_id, ...) or an
+      "error" if it could not be queued.
+    - finish(step, limit) waits for that ticket and stores its output, returning the result item.
+    - cancel(step), optional, stops the work behind an unfinished step when its job is cancelled.
+    Steps are persisted in between, which is what lets a restarted backend pick the job back up.
+    Jobs of a lower `priority` are picked up first.
+    """
+
+    def __init__(self, submit, finish, concurrency=1, cancel=None, priority=PRIORITY_INTERACTIVE):
+        self.submit = submit
+        self.finish = finish
+        self.concurrency = concurrency
+        self.cancel = cancel
+        self.priority = priority
+
+
+def init_schema(conn):
+    with conn:
+        # Workers starting together: one migrates, the others wait and then find it done
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                steps TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL,
+                updated_at REAL,
+                client_id TEXT,
+                priority INTEGER DEFAULT 0,
+                owner TEXT,
+                lease_until REAL,
+                cancel_requested INTEGER DEFAULT 0
+            )
+        """)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, definition in _MIGRATIONS.items():
+            if column not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)")
+
+
+def _orphaned_jobs(conn, owner, now):
+    """Unfinished jobs nobody holds a live lease on (or that this worker id held before)"""
+    return conn.execute(
+        "SELECT id, priority FROM jobs WHERE status IN (?, ?) "
+        "AND (owner IS NULL OR owner = ? OR lease_until IS NULL OR lease_until < ?) "
+        "ORDER BY priority ASC, created_at ASC",
+        (QUEUED, RUNNING, owner, now),
+    ).fetchall()
+
+
+def _claim(conn, job_id, owner, now, lease):
+    """Takes the job unless another worker holds a live lease on it; True if this worker owns it now"""
+    with conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET owner = ?, lease_until = ? WHERE id = ? AND status IN (?, ?) "
+            "AND (owner IS NULL OR owner = ? OR lease_until IS NULL OR lease_until < ?)",
+            (owner, now + lease, job_id, QUEUED, RUNNING, owner, now),
+        )
+    return cursor.rowcount == 1
+
+
+def _renew(conn, owner, until):
+    """Extends this worker's leases; returns its jobs another worker asked to cancel"""
+    with conn:
+        conn.execute("UPDATE jobs SET lease_until = ? WHERE owner = ? AND status IN (?, ?)", (until, owner, QUEUED, RUNNING))
+    rows = conn.execute(
+        "SELECT id FROM jobs WHERE owner = ? AND cancel_requested = 1 AND status IN (?, ?)", (owner, QUEUED, RUNNING)
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def _release(conn, owner):
+    with conn:
+        conn.execute("UPDATE jobs SET lease_until = 0 WHERE owner = ? AND status IN (?, ?)", (owner, QUEUED, RUNNING))
+
+
+def _request_cancel(conn, job_id):
+    with conn:
+        conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+
+
+def _active_jobs(conn, client_id, kind):
+    clauses, params = ["status IN (?, ?)"], [QUEUED, RUNNING]
+    if client_id is not None:
+        clauses.append("client_id = ?")
+        params.append(client_id)
+    if kind is not None:
+        clauses.append("kind = ?")
+        params.append(kind)
+    return conn.execute(
+        f"SELECT * FROM jobs WHERE {' AND '.join(clauses)} ORDER BY priority ASC, created_at ASC", params
+    ).fetchall()
+
+
+def _insert_job(conn, job_id, kind, payload, now, client_id, priority, owner, lease_until):
+    with conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, status, payload, created_at, updated_at, client_id, priority, owner, lease_until) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, QUEUED, payload, now, now, client_id, priority, owner, lease_until),
+        )
+
+
+def _load_job(conn, job_id):
+    row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _decode(row) if row else None
+
+
+def _decode(row):
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["steps"] = json.loads(job["steps"]) if job["steps"] else []
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def _update_job(conn, job_id, fields):
+    assignments = ", ".join(f"{key} = ?" for key in fields)
+    with conn:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+
+# --- JOB MANAGER ---
+class JobManager:
+    """
+    Runs jobs from a shared SQLite jobs table. Several processes (uvicorn
+    --workers, replicas on one volume) can share it: each job is owned by the
+    worker that submitted or adopted it, under a lease that worker keeps
+    renewing. Jobs whose lease runs out (their worker died) are adopted by
+    another worker and resumed from their persisted steps. Any worker can
+    report on, wait for or cancel any job.
+    """
+
+    def __init__(self, db, bridge, workers=4, worker_id=None, lease=LEASE_SECONDS):
+        self.db = db
+        self.bridge = bridge
+        self.workers = workers
+        self.worker_id = worker_id or default_worker_id()
+        self.lease = lease
+        self.handlers = {}
+        self._queue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        self._tasks = []
+        self._listeners = {}
+        self._running = {}
+        self._cancelling = set()
+        self._background = set()
+        # Jobs queued or running in this process
+        self._owned = set()
+        self._leases = None
+
+    def register(self, kind, handler: JobHandler):
+        self.handlers[kind] = handler
+
+    async def start(self):
+        await self.db.run(init_schema)
+        # Unfinished jobs of a previous process (or of a worker that died) are picked back up
+        await self._adopt()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._leases = asyncio.create_task(self._keep_leases())
+
+    async def stop(self):
+        running = list(self._running.values())
+        tasks = self._tasks + ([self._leases] if self._leases else [])
+        for task in tasks + running:
+            task.cancel()
+        await asyncio.gather(*tasks, *running, return_exceptions=True)
+        self._tasks, self._leases = [], None
+        # Unfinished jobs go straight to the other workers (or the next start) instead of waiting out the lease
+        await self.db.run(_release, self.worker_id)
+        self._owned.clear()
+
+    # --- PUBLIC API ---
+    async def submit(self, kind, payload, client_id=None, priority=None):
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if priority is None:
+            priority = self.handlers[kind].priority
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        await self.db.run(
+            _insert_job, job_id, kind, json.dumps(payload), now, client_id, priority, self.worker_id, now + self.lease,
+        )
+        self._enqueue(job_id, priority)
+        return await self.get(job_id)
+
+    async def active(self, client_id=None, kind=None):
+        """Queued and running jobs in the order they will be worked on"""
+        return [snapshot(_decode(row)) for row in await self.db.run(_active_jobs, client_id, kind)]
+
+    async def unfinished_steps(self):
+        """Steps of queued and running jobs, across all workers"""
+        return [step for row in await self.db.run(_active_jobs, None, None) for step in _decode(row)["steps"]]
+
+    def cancel_soon(self, job_id):
+        """cancel() from places that cannot wait for it (a response generator being torn down)"""
+        task = asyncio.create_task(self.cancel(job_id))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def cancel(self, job_id):
+        """
+        Cancels a queued or running job: its unfinished steps are removed from the
+        provider queues (ComfyUI prompts deleted or interrupted) and it ends as cancelled.
+        Returns the job snapshot, or None if there is no such job.
+        """
+        job = await self._load(job_id)
+        if job is None or job["status"] in TERMINAL:
+            return snapshot(job) if job else None
+        if job_id not in self._owned:
+            if not await self._cancel_remote(job_id):
+                return await self.get(job_id)
+            # Taken over from a dead worker just to cancel it: nothing of it runs here
+            try:
+                await self._cancel_steps(job_id, await self._load(job_id))
+            finally:
+                self._owned.discard(job_id)
+            return await self.get(job_id)
+
+        task = self._running.get(job_id)
+        if task:
+            self._cancelling.add(job_id)
+            task.cancel()
+            await asyncio.wait([task])
+            job = await self._load(job_id)
+        if job["status"] not in TERMINAL:
+            # Still queued (the worker skips it once it is terminal), or cancelled before it got going
+            await self._cancel_steps(job_id, job)
+        return await self.get(job_id)
+
+    async def _cancel_remote(self, job_id):
+        """
+        Cancels a job owned by another worker: that worker is asked through the
+        database (it notices on its next lease renewal). True if the job turned
+        out to be orphaned and this worker has taken it over to cancel it itself.
+        """
+        if await self.db.run(_claim, job_id, self.worker_id, time.time(), self.lease):
+            self._owned.add(job_id)
+            return True
+        print(f"📨 Cancel Requested: {job_id} (run by another worker)")
+        await self.db.run(_request_cancel, job_id)
+        deadline = time.monotonic() + self.lease * 2
+        while time.monotonic() < deadline:
+            await asyncio.sleep(EVENT_POLL_INTERVAL)
+            job = await self._load(job_id)
+            if job is None or job["status"] in TERMINAL:
+                return False
+            if await self.db.run(_claim, job_id, self.worker_id, time.time(), self.lease):
+                # Its owner died before getting to it
+                self._owned.add(job_id)
+                return True
+        return False
+
+    async def get(self, job_id):
+        job = await self._load(job_id)
+        return snapshot(job) if job else None
+
+    async def events(self, job_id):
+        """
+        Yields the current job status, then live progress/step/status events until
+        it ends. Jobs run by another worker are followed through the database
+        (status and step events only: ComfyUI progress reaches the owner alone).
+        """
+        queue = asyncio.Queue()
+        self._listeners.setdefault(job_id, []).append(queue)
+        try:
+            job = await self._load(job_id)
+            if job is None:
+                return
+            status = job["status"]
+            done = {index for index, step in enumerate(job["steps"]) if "result" in step or "error" in step}
+            yield {"type": "status", "job": snapshot(job)}
+            while status not in TERMINAL:
+                try:
+                    events = [await asyncio.wait_for(queue.get(), EVENT_POLL_INTERVAL)]
+                except asyncio.TimeoutError:
+                    if job_id in self._owned:
+                        continue
+                    events = await self._changes(job_id, done, status)
+                for event in events:
+                    if event["type"] == "step":
+                        if event["index"] in done:
+                            continue
+                        done.add(event["index"])
+                    elif event["type"] == "status":
+                        if event["job"]["status"] == status:
+                            continue
+                        status = event["job"]["status"]
+                    yield event
+        finally:
+            self._listeners[job_id].remove(queue)
+            if not self._listeners[job_id]:
+                del self._listeners[job_id]
+
+    async def _changes(self, job_id, done, status):
+        """Step/status events for what the database shows changed since `done`/`status`"""
+        job = await self._load(job_id)
+        if job is None:
+            return []
+        events = [
+            {"type": "step", "index": index, "result": step.get("result"), "error": step.get("error")}
+            for index, step in enumerate(job["steps"])
+            if index not in done and ("result" in step or "error" in step)
+        ]
+        if job["status"] != status:
+            events.append({"type": "status", "job": snapshot(job)})
+        return events
+
+    async def wait(self, job_id):
+        async for _ in self.events(job_id):
+            pass
+        return await self.get(job_id)
+
+    # --- WORKERS ---
+    def _enqueue(self, job_id, priority):
+        self._owned.add(job_id)
+        self._queue.put_nowait((priority, next(self._order), job_id))
+
+    async def _adopt(self):
+        for row in await self.db.run(_orphaned_jobs, self.worker_id, time.time()):
+            if row["id"] in self._owned:
+                continue
+            if await self.db.run(_claim, row["id"], self.worker_id, time.time(), self.lease):
+                print(f"♻️ Resuming Job: {row['id']}")
+                self._enqueue(row["id"], row["priority"] or 0)
+
+    async def _keep_leases(self):
+        """Renews this worker's leases, acts on cancel requests from other workers and adopts orphans"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                for job_id in await self.db.run(_renew, self.worker_id, time.time() + self.lease):
+                    if job_id in self._owned and job_id not in self._cancelling:
+                        self.cancel_soon(job_id)
+                await self._adopt()
+            except Exception as e:
+                print(f"❌ Job Lease Error: {e}")
+
+    async def _worker(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            # Its own task, so cancelling the job leaves this worker running
+            task = asyncio.create_task(self._run(job_id))
+            self._running[job_id] = task
+            try:
+                await asyncio.wait([task])
+            finally:
+                self._running.pop(job_id, None)
+                self._cancelling.discard(job_id)
+                self._owned.discard(job_id)
+            if not task.cancelled() and task.exception():
+                print(f"❌ Job Error ({job_id}): {task.exception()}")
+                await self._save(job_id, status=FAILED, error=str(task.exception()))
+
+    async def _run(self, job_id):
+        job = await self._load(job_id)
+        if job is None or job["status"] in TERMINAL:
+            return
+        if not await self.db.run(_claim, job_id, self.worker_id, time.time(), self.lease):
+            # Our lease lapsed while it waited in the queue and another worker adopted it
+            return
+        timings = metrics.begin(job["kind"])
+        in_flight = metrics.JOBS_IN_FLIGHT.labels(job["kind"])
+        in_flight.inc()
+        try:
+            await self._run_steps(job_id, job)
+        except asyncio.CancelledError:
+            if job_id not in self._cancelling:
+                # Shutdown: the job stays running and is resumed by the next process
+                raise
+            await self._cancel_steps(job_id, job)
+        finally:
+            in_flight.dec()
+            if timings:
+                print(f"⏱️ Job {job_id} ({job['kind']}): {metrics.summary(timings)}")
+
+    async def _cancel_steps(self, job_id, job):
+        handler = self.handlers[job["kind"]]
+        steps = job["steps"]
+        for index, step in enumerate(steps):
+            if "result" in step or "error" in step:
+                continue
+            if handler.cancel:
+                try:
+                    await handler.cancel(step)
+                except Exception as e:
+                    print(f"❌ Cancel Error ({job_id}#{index}): {e}")
+            step["error"] = "cancelled"
+            step["cancelled"] = True
+        print(f"🛑 Job Cancelled: {job_id}")
+        await self._save(job_id, status=CANCELLED, steps=steps, error="cancelled")
+
+    async def _run_steps(self, job_id, job):
+        handler = self.handlers[job["kind"]]
+        steps = job["steps"]
+        resumed = bool(steps)
+
+        if not steps:
+            await self._save(job_id, status=RUNNING)
+            steps = job["steps"] = await self._submit(job_id, job, handler)
+
+        limit = asyncio.Semaphore(handler.concurrency)
+
+        async def finish(index, step):
+            if "result" in step or "error" in step:
+                return
+            # Only ComfyUI steps have a prompt_id (and websocket progress); other providers are polled
+            comfy_step = "prompt_id" in step
+            relay = asyncio.create_task(self._relay_progress(job_id, index, step["prompt_id"])) if comfy_step else None
+            try:
+                if resumed and comfy_step:
+                    await self.bridge.track(step["prompt_id"], step.get("node"))
+                step["result"] = await handler.finish(step, limit)
+            except Exception as e:
+                print(f"❌ Step Error ({job_id}#{index}): {e}")
+                step["error"] = str(e)
+            finally:
+                if relay:
+                    relay.cancel()
+            await self._save(job_id, steps=steps)
+            self._publish(job_id, {"type": "step", "index": index, "result": step.get("result"), "error": step.get("error")})
+
+        await asyncio.gather(*(finish(index, step) for index, step in enumerate(steps)))
+
+        items = [step.get("result") or {"error": step.get("error")} for step in steps]
+        if steps and all("error" in step for step in steps):
+            await self._save(job_id, status=FAILED, result={"items": items}, error=steps[0]["error"])
+        else:
+            await self._save(job_id, status=SUCCEEDED, result={"items": items})
+
+    async def _submit(self, job_id, job, handler):
+        """
+        handler.submit, with its steps saved even if the job is cancelled (or the
+        worker stops) meanwhile: the work it queued is then cancelled (or resumed)
+        instead of being left to run unseen on the providers.
+        """
+        submitting = asyncio.create_task(handler.submit(job["payload"]))
+        try:
+            steps = await asyncio.shield(submitting)
+        except asyncio.CancelledError:
+            await asyncio.wait([submitting])
+            if not submitting.cancelled() and submitting.exception() is None:
+                job["steps"] = submitting.result()
+                await self._save(job_id, steps=job["steps"])
+            raise
+        await self._save(job_id, steps=steps)
+        return steps
+
+    async def _relay_progress(self, job_id, index, prompt_id):
+        queue = self.bridge.subscribe(prompt_id)
+        try:
+            while True:
+                message = await queue.get()
+                if message["type"] == "progress":
+                    data = message["data"]
+                    self._publish(job_id, {
+                        "type": "progress",
+                        "index": index,
+                        "prompt_id": prompt_id,
+                        "value": data.get("value"),
+                        "max": data.get("max"),
+                    })
+        finally:
+            self.bridge.unsubscribe(prompt_id, queue)
+
+    # --- PERSISTENCE ---
+    async def _load(self, job_id):
+        return await self.db.run(_load_job, job_id)
+
+    async def _save(self, job_id, **fields):
+        for key in ("steps", "result"):
+            if key in fields:
+                fields[key] = json.dumps(fields[key])
+        fields["updated_at"] = time.time()
+        await self.db.run(_update_job, job_id, fields)
+        if "status" in fields:
+            self._publish(job_id, {"type": "status", "job": await self.get(job_id)})
+
+    def _publish(self, job_id, event):
+        for queue in self._listeners.get(job_id, []):
+            queue.put_nowait(event)
+
+
+def _finished(step):
+    """Rendered or failed; steps dropped by a cancel never finished"""
+    return ("result" in step or "error" in step) and not step.get("cancelled")
+
+
+def snapshot(job):
+    """Public view of a job row (the payload can hold whole base64 images, so it stays private)"""
+    steps = job["steps"]
+    return {
+        "id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "priority": job.get("priority") or 0,
+        "worker": job.get("owner"),
+        "steps_total": len(steps),
+        "steps_done": sum(1 for step in steps if _finished(step)),
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
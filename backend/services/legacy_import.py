@@ -0,0 +1,313 @@
+"""
+Moves the legacy stores into file-backed storage:
+- history.json: a JSON array of items whose url is an inline data:image/...;base64 URL
+- studio_history.db (the old database.py): a `history` table like history.json, and an
+  `uploads` table holding raw base64 blobs
+- generated_content rows that still carry an inline data: URL
+
+Base64 payloads are decoded a slice at a time into content-addressed files
+(generated/legacy_<sha256>.<ext>, uploads/upload_<sha256>.<ext>, the same
+names /upload uses), so identical images are stored once. Rows are inserted
+in batches, one transaction per batch, and each imported source row is recorded
+in legacy_imports so running it again only picks up what is new.
+
+    cd backend && python -m services.legacy_import --dry-run
+    cd backend && python -m services.legacy_import
+"""
+import os
+import json
+import sqlite3
+import asyncio
+import argparse
+import datetime
+import mimetypes
+
+from services.repository import Database, init_schema
+from services.uploads_index import UploadsIndex, init_schema as init_uploads_schema
+from services.storage import content_filename
+from services.transfers import iter_base64, write_content_stream
+
+# history.json is read this much at a time; the buffer grows only while one item is bigger
+READ_CHUNK = 64 * 1024
+# Rows inserted (or rewritten) per transaction
+INSERT_BATCH = 200
+
+HISTORY_JSON = "history.json"
+LEGACY_HISTORY = "studio_history.db:history"
+LEGACY_UPLOADS = "studio_history.db:uploads"
+
+
+def init_ledger(conn):
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS legacy_imports (
+                source TEXT NOT NULL,
+                source_id TEXT NOT NULL,
+                content_id INTEGER,
+                PRIMARY KEY (source, source_id)
+            )
+        """)
+
+
+def _imported_ids(conn, source):
+    return {row[0] for row in conn.execute("SELECT source_id FROM legacy_imports WHERE source = ?", (source,))}
+
+
+def _imported_sources(conn):
+    return {row[0] for row in conn.execute("SELECT DISTINCT source FROM legacy_imports")}
+
+
+def _import_rows(conn, source, entries):
+    """Inserts [(source_id, row or None)] and their ledger entries in one transaction"""
+    with conn:
+        for source_id, row in entries:
+            content_id = None
+            if row is not None:
+                content_id = conn.execute(
+                    f"INSERT INTO generated_content ({', '.join(row)}) VALUES ({', '.join('?' for _ in row)})",
+                    tuple(row.values()),
+                ).lastrowid
+            conn.execute(
+                "INSERT OR IGNORE INTO legacy_imports (source, source_id, content_id) VALUES (?, ?, ?)",
+                (source, str(source_id), content_id),
+            )
+
+
+def _inline_ids(conn):
+    # Ids only: the payloads are fetched one row at a time
+    return [row[0] for row in conn.execute("SELECT id FROM generated_content WHERE url LIKE 'data:%' ORDER BY id")]
+
+
+def _inline_url(conn, content_id):
+    row = conn.execute("SELECT url FROM generated_content WHERE id = ?", (content_id,)).fetchone()
+    return row[0] if row else None
+
+
+def _rewrite_urls(conn, updates):
+    with conn:
+        conn.executemany("UPDATE generated_content SET url = ? WHERE id = ?", updates)
+
+
+# --- STREAMING READERS ---
+def iter_json_array(path, chunk_size=READ_CHUNK):
+    """Yields the items of a file holding one JSON array, never holding more than the current item"""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer, eof, started = "", False, False
+        while True:
+            buffer = buffer.lstrip()
+            if not started and buffer:
+                if buffer[0] != "[":
+                    raise ValueError(f"{path} does not hold a JSON array")
+                buffer, started = buffer[1:], True
+                continue
+            if started and buffer[:1] == "]":
+                return
+            if started and buffer[:1] == ",":
+                buffer = buffer[1:]
+                continue
+            if started and buffer:
+                try:
+                    item, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    yield item
+                    buffer = buffer[end:]
+                    continue
+            if eof:
+                if not started:
+                    return
+                raise ValueError(f"{path} ends inside its JSON array")
+            # Read at least as much as is buffered, so an item n bytes long costs O(n) to assemble
+            more = f.read(max(chunk_size, len(buffer)))
+            eof = not more
+            buffer += more
+
+
+def iter_legacy_rows(path, table):
+    """Rows of a studio_history.db table, fetched through a cursor rather than all at once"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+            return
+        for row in conn.execute(f"SELECT * FROM {table} ORDER BY id"):
+            yield dict(row)
+    finally:
+        conn.close()
+
+
+def parse_timestamp(value):
+    """Epoch seconds from an ISO timestamp (SQLite CURRENT_TIMESTAMP values are UTC)"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None and " " in str(value):
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def data_url_extension(url):
+    mime = url[5:url.find(";")] if url.startswith("data:") and ";" in url else ""
+    extension = mimetypes.guess_extension(mime) or ".png"
+    return ".jpg" if extension in (".jpe", ".jpeg") else extension
+
+
+# --- IMPORTER ---
+class LegacyImporter:
+    def __init__(self, db: Database, generated_dir, upload_dir, base_url="http://localhost:8000", dry_run=False):
+        self.db = db
+        self.generated_dir = generated_dir
+        self.upload_dir = upload_dir
+        self.base_url = base_url
+        self.dry_run = dry_run
+        self.uploads_index = UploadsIndex(db, upload_dir)
+        self.stats = {"rows": 0, "files": 0, "bytes": 0, "skipped": 0}
+
+    async def store(self, data_url, directory, prefix):
+        """Decodes a base64 data URL into directory/<prefix>_<sha256><ext>; returns the file name"""
+        if self.dry_run:
+            self.stats["bytes"] += len(data_url) * 3 // 4
+            return None
+        extension = data_url_extension(data_url)
+        path, size, _ = await write_content_stream(
+            iter_base64(data_url), directory, lambda digest: content_filename(prefix, digest, extension)
+        )
+        self.stats["files"] += 1
+        self.stats["bytes"] += size
+        return os.path.basename(path)
+
+    async def content_url(self, url):
+        if url and url.startswith("data:"):
+            name = await self.store(url, self.generated_dir, "legacy")
+            return f"{self.base_url}/generated/{name}" if name else None
+        return url
+
+    async def import_items(self, source, items):
+        """history.json / studio_history.db history items -> generated_content rows"""
+        done = await self.db.run(_imported_ids, source)
+        batch = []
+        for item in items:
+            source_id = str(item.get("id"))
+            if source_id in done or not item.get("url"):
+                self.stats["skipped"] += 1
+                continue
+            row = {
+                "type": item.get("type") or "image",
+                "prompt": item.get("prompt"),
+                "url": await self.content_url(item["url"]),
+                "camera": item.get("camera"),
+                "lens": item.get("lens"),
+                "focal_length": item.get("focal_length") or "N/A",
+                "created_at": parse_timestamp(item.get("timestamp") or item.get("created_at")),
+            }
+            batch.append((source_id, row))
+            if len(batch) >= INSERT_BATCH:
+                await self._flush(source, batch)
+                batch = []
+        await self._flush(source, batch)
+
+    async def import_uploads(self, path):
+        """studio_history.db uploads (base64 blobs) -> files in uploads/, listed by the uploads index"""
+        done = await self.db.run(_imported_ids, LEGACY_UPLOADS)
+        batch, paths = [], []
+        for row in iter_legacy_rows(path, "uploads"):
+            if str(row["id"]) in done or not row.get("base64_data"):
+                self.stats["skipped"] += 1
+                continue
+            name = await self.store(row["base64_data"], self.upload_dir, "upload")
+            if name:
+                paths.append(os.path.join(self.upload_dir, name))
+            batch.append((row["id"], None))
+            if len(batch) >= INSERT_BATCH:
+                await self.uploads_index.record(*paths)
+                await self._flush(LEGACY_UPLOADS, batch)
+                batch, paths = [], []
+        await self.uploads_index.record(*paths)
+        await self._flush(LEGACY_UPLOADS, batch)
+
+    async def rewrite_inline_urls(self):
+        """generated_content rows holding a data: URL get a file and a plain URL instead"""
+        updates = []
+        for content_id in await self.db.run(_inline_ids):
+            url = await self.db.run(_inline_url, content_id)
+            new_url = await self.content_url(url)
+            self.stats["rows"] += 1
+            if new_url and not self.dry_run:
+                updates.append((new_url, content_id))
+            if len(updates) >= INSERT_BATCH:
+                await self.db.run(_rewrite_urls, updates)
+                updates = []
+        if updates:
+            await self.db.run(_rewrite_urls, updates)
+
+    async def _flush(self, source, batch):
+        if not batch:
+            return
+        self.stats["rows"] += len(batch)
+        if not self.dry_run:
+            await self.db.run(_import_rows, source, batch)
+
+    async def run(self, history_json=None, legacy_db=None):
+        await self.db.run(init_schema)
+        await self.db.run(init_uploads_schema)
+        await self.db.run(init_ledger)
+        if history_json and os.path.exists(history_json):
+            print(f"📜 Importing {history_json}")
+            await self.import_items(HISTORY_JSON, iter_json_array(history_json))
+        if legacy_db and os.path.exists(legacy_db):
+            print(f"📜 Importing {legacy_db}")
+            await self.import_items(LEGACY_HISTORY, iter_legacy_rows(legacy_db, "history"))
+            await self.import_uploads(legacy_db)
+        print("📜 Moving inline data: URLs out of generated_content")
+        await self.rewrite_inline_urls()
+        return self.stats
+
+
+async def pending_stores(db, history_json, legacy_db):
+    """Legacy stores on disk that have never been imported"""
+    await db.run(init_ledger)
+    imported = await db.run(_imported_sources)
+    pending = []
+    if os.path.exists(history_json) and HISTORY_JSON not in imported:
+        pending.append(history_json)
+    if os.path.exists(legacy_db) and not {LEGACY_HISTORY, LEGACY_UPLOADS} & imported:
+        pending.append(legacy_db)
+    return pending
+
+
+async def main_async(args):
+    for directory in (args.generated_dir, args.upload_dir):
+        os.makedirs(directory, exist_ok=True)
+    db = Database(args.db)
+    try:
+        importer = LegacyImporter(db, args.generated_dir, args.upload_dir, args.base_url, dry_run=args.dry_run)
+        stats = await importer.run(args.history_json, args.legacy_db)
+    finally:
+        db.close()
+    verb = "Would import" if args.dry_run else "Imported"
+    print(
+        f"✅ {verb} {stats['rows']} rows, {stats['files']} images decoded, "
+        f"{stats['bytes'] / 2 ** 20:.1f} MB of image data, {stats['skipped']} already imported"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="cinema_studio.db")
+    parser.add_argument("--history-json", default="history.json")
+    parser.add_argument("--legacy-db", default="studio_history.db")
+    parser.add_argument("--generated-dir", default="generated")
+    parser.add_argument("--upload-dir", default="uploads")
+    parser.add_argument("--base-url", default=os.getenv("PUBLIC_BASE_URL", "http://localhost:8000").rstrip("/"))
+    parser.add_argument("--dry-run", action="store_true", help="count what would be imported without writing files or rows")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+
+# Generation stages run from a few ms (DB insert) to many minutes (video renders)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1200)
+
+STAGE_SECONDS = Histogram(
+    "studio_stage_seconds", "Time spent per generation stage", ["stage", "workflow"], buckets=STAGE_BUCKETS,
+)
+STAGE_ERRORS = Counter("studio_stage_errors_total", "Failures per generation stage", ["stage", "workflow"])
+# Summed over live worker processes when running several (PROMETHEUS_MULTIPROC_DIR)
+JOBS_IN_FLIGHT = Gauge("studio_jobs_in_flight", "Generation jobs currently running", ["kind"], multiprocess_mode="livesum")
+BRIDGE_SOCKETS = Gauge("studio_bridge_sockets", "Open ComfyUI websocket connections", ["node"], multiprocess_mode="livesum")
+# Storage GC (services/storage_gc.py): what each run removed, and directory sizes as of the latest run
+GC_RECLAIMED_BYTES = Counter("studio_gc_reclaimed_bytes_total", "Bytes freed by storage GC", ["directory", "reason"])
+GC_REMOVED_FILES = Counter("studio_gc_removed_files_total", "Files deleted by storage GC", ["directory", "reason"])
+GC_REMOVED_ROWS = Counter("studio_gc_removed_rows_total", "generated_content rows deleted by storage GC", ["reason"])
+STORAGE_BYTES = Gauge("studio_storage_bytes", "Bytes on disk per directory after the latest GC run", ["directory"], multiprocess_mode="mostrecent")
+
+# The workflow type ("txt2img", "instantid", "multishot", "video") and the stage timings
+# of the job being worked on, so spans deep in the bridge or pool need no extra arguments
+_workflow = contextvars.ContextVar("workflow", default="none")
+_timings = contextvars.ContextVar("timings", default=None)
+
+
+def begin(workflow):
+    """Labels everything this task (and tasks it starts) times from now on; returns its timings dict"""
+    timings = {}
+    _workflow.set(workflow)
+    _timings.set(timings)
+    return timings
+
+
+def set_workflow(workflow):
+    _workflow.set(workflow)
+
+
+def observe(stage, seconds):
+    STAGE_SECONDS.labels(stage, _workflow.get()).observe(seconds)
+    timings = _timings.get()
+    if timings is not None:
+        # Steps of a multishot job run side by side, so their stages add up
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def fail(stage):
+    STAGE_ERRORS.labels(stage, _workflow.get()).inc()
+
+
+@contextmanager
+def span(stage):
+    """Times the block as `stage`; an exception escaping it counts as an error of that stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        fail(stage)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+def summary(timings):
+    return ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items())
+
+
+def multiprocess_mode():
+    """uvicorn --workers N: each worker writes its metrics to PROMETHEUS_MULTIPROC_DIR and any of them can serve all"""
+    return bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def render():
+    """(body, content type) of the Prometheus text exposition"""
+    if multiprocess_mode():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def close():
+    """Drops this worker from the live gauges"""
+    if multiprocess_mode():
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,478 @@
+import os
+import time
+import base64
+import random
+import asyncio
+import mimetypes
+import contextlib
+from urllib.parse import urlparse
+
+import httpx
+import fal_client
+from fastapi import HTTPException
+
+from services import metrics
+from services.comfy_bridge import HEADERS
+from services.image_generator import image_arguments
+from services.video_generator import video_arguments
+from services.transfers import CHUNK_SIZE, iter_base64, write_stream
+
+# Latency assumed for a provider/kind until it has finished something
+DEFAULT_SECONDS = {"image": 20.0, "video": 180.0}
+LATENCY_EWMA = 0.3
+
+
+class ProviderError(Exception):
+    pass
+
+
+def is_retryable(e):
+    """Transient failures worth another attempt: timeouts, connection errors, 429 and 5xx"""
+    if isinstance(e, (asyncio.TimeoutError, httpx.TransportError, ConnectionError)):
+        return True
+    if isinstance(e, httpx.HTTPStatusError):
+        status = e.response.status_code
+    else:
+        status = getattr(e, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def is_unsent(e):
+    """Failures that prove a request was never accepted (safe to retry even if sending it twice would cost twice)"""
+    if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    return isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429
+
+
+# --- PROVIDER INTERFACE ---
+class Provider:
+    """
+    One generation backend. Like JobHandler, work is split in two so a job can
+    be persisted in between:
+    - submit(kind, request) queues the work and returns a JSON-serialisable ticket
+    - result(ticket) waits for it and returns an output reference for download()
+
+    Requests are provider-neutral dicts: "prompt" (the finished prompt text),
+    "aspect_ratio", "width"/"height", "reference" (a local image path or None),
+    "image_strength", "seed", "front" (interactive: ahead of queued bulk work); video requests
+    carry "image", "zoom", "horizontal", "vertical".
+    Subclasses implement _submit, _result, download and extension, and cancel where the backend can.
+    `concurrency` bounds the provider's HTTP calls (submits, status checks, downloads), which take
+    a slot each; waiting for a render does not hold one. A submit that fails is retried only when
+    `submit_retryable` says queueing it again cannot render (and bill) the same request twice.
+    """
+
+    name = "provider"
+    kinds = ()
+    submit_retryable = staticmethod(is_retryable)
+    retry_submit_timeouts = True
+
+    def __init__(self, concurrency=4, timeout=900.0, submit_timeout=60.0, retries=2, backoff=1.0, cost=None):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.submit_timeout = submit_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cost = cost or {}
+        self.inflight = 0
+        self.latency = {}
+        self._slots = asyncio.Semaphore(concurrency)
+
+    def available(self):
+        return True
+
+    def estimate_seconds(self, kind):
+        """Expected seconds from submit to result for a new request"""
+        latency = self.latency.get(kind, DEFAULT_SECONDS.get(kind, 60.0))
+        # Past `concurrency` renders in flight, assume they queue behind each other
+        return latency * (1 + self.inflight // self.concurrency)
+
+    def info(self):
+        return {
+            "name": self.name,
+            "kinds": list(self.kinds),
+            "available": self.available(),
+            "inflight": self.inflight,
+            "concurrency": self.concurrency,
+            "estimate_seconds": {kind: round(self.estimate_seconds(kind), 2) for kind in self.kinds},
+            "cost": self.cost,
+        }
+
+    async def submit(self, kind, request):
+        with metrics.span("provider_submit"):
+            ticket = await self._call(
+                self._submit, self.submit_timeout, self.retry_submit_timeouts, kind, request,
+                retryable=self.submit_retryable, slot=True,
+            )
+        ticket.update(provider=self.name, kind=kind, submitted_at=time.time())
+        return ticket
+
+    async def result(self, ticket):
+        self.inflight += 1
+        try:
+            with metrics.span("provider_wait"):
+                output = await self._call(self._result, self.timeout, False, ticket)
+        finally:
+            self.inflight -= 1
+        self._observe(ticket.get("kind"), time.time() - ticket.get("submitted_at", time.time()))
+        return output
+
+    async def close(self):
+        pass
+
+    async def cancel(self, ticket):
+        """Stops the work behind ticket if the backend allows it"""
+
+    async def _call(self, fn, timeout, retry_timeouts, *args, retryable=is_retryable, slot=False):
+        """fn(*args) under this provider's timeout (and a concurrency slot if `slot`), retried with backoff"""
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._slots if slot else contextlib.nullcontext():
+                    return await asyncio.wait_for(fn(*args), timeout)
+            except asyncio.TimeoutError:
+                if not retry_timeouts or attempt >= self.retries:
+                    raise ProviderError(f"{self.name} timed out after {timeout:.0f}s")
+                error = "timeout"
+            except Exception as e:
+                if attempt >= self.retries or not retryable(e):
+                    raise
+                error = getattr(e, "detail", e)
+            delay = self.backoff * 2 ** attempt * (1 + random.random() / 2)
+            print(f"🔁 {self.name} retry {attempt + 1}/{self.retries} in {delay:.1f}s ({error})")
+            await asyncio.sleep(delay)
+
+    def _observe(self, kind, seconds):
+        if kind is None or seconds <= 0:
+            return
+        if kind not in self.latency:
+            self.latency[kind] = seconds
+        else:
+            self.latency[kind] += LATENCY_EWMA * (seconds - self.latency[kind])
+
+    async def _submit(self, kind, request):
+        raise NotImplementedError
+
+    async def _result(self, ticket):
+        raise NotImplementedError
+
+    async def download(self, ticket, output, target, sinks=()):
+        raise NotImplementedError
+
+    def extension(self, ticket, output):
+        raise NotImplementedError
+
+
+# --- COMFYUI ---
+class ComfyProvider(Provider):
+    """
+    The ComfyUI node pool. `build(request)` turns a neutral request into
+    (workflow, inputs); tickets are the pool's steps (node, prompt_id, workflow,
+    inputs), so node failover and restart resubmission keep working. Requests
+    marked "batchable" go through the batcher and may share a prompt, in which
+    case the ticket carries batch_index/batch_size; a shared prompt is only
+    cancelled once every member still waiting for it has been.
+    """
+
+    name = "comfyui"
+    kinds = ("image",)
+
+    def __init__(self, pool, build, batcher=None, **options):
+        super().__init__(**options)
+        self.pool = pool
+        self.build = build
+        self.batcher = batcher
+        # Shared prompt_id -> batch indexes of the members still waiting for it
+        self._batches = {}
+
+    def available(self):
+        return any(node.healthy for node in self.pool.nodes.values())
+
+    def estimate_seconds(self, kind):
+        # The node router already knows queue depths and render times
+        return self.pool.estimate_seconds()
+
+    async def _submit(self, kind, request):
+        workflow, inputs = await self.build(request)
+        front = bool(request.get("front"))
+        if self.batcher and request.get("batchable"):
+            submission, workflow, index, size = await self.batcher.submit(workflow, inputs, front=front)
+            if size > 1:
+                self._batches.setdefault(submission["prompt_id"], set()).add(index)
+                return {**submission, "workflow": workflow, "inputs": inputs, "front": front, "batch_index": index, "batch_size": size}
+        else:
+            submission = await self.pool.submit(workflow, inputs, front=front)
+        return {**submission, "workflow": workflow, "inputs": inputs, "front": front}
+
+    async def _result(self, ticket):
+        prompt_id = ticket["prompt_id"]
+        try:
+            output = await self.pool.wait(ticket)
+        except asyncio.CancelledError:
+            # Its job is being cancelled: cancel() accounts for this member
+            raise
+        except Exception:
+            self._batches.pop(prompt_id, None)
+            raise
+        # The prompt has rendered: nothing left to cancel for the rest of its batch
+        self._batches.pop(prompt_id, None)
+        return output
+
+    async def cancel(self, ticket):
+        if ticket.get("batch_size", 1) > 1:
+            waiting = self._batches.get(ticket["prompt_id"])
+            if waiting is None:
+                # Already rendered, or shared before a restart/failover: the members left may still need it
+                return
+            waiting.discard(ticket["batch_index"])
+            if waiting:
+                # Other members still wait for the shared prompt: just stop waiting for it
+                return
+            del self._batches[ticket["prompt_id"]]
+        await self.pool.cancel(ticket)
+
+    async def download(self, ticket, output, target, sinks=()):
+        async with self._slots:
+            return await self.pool.download(ticket, output, target, sinks)
+
+    def extension(self, ticket, output):
+        return os.path.splitext(output)[1] or ".png"
+
+
+# --- FAL ---
+FAL_QUEUE_URL = "https://queue.fal.run"
+# Status polls start this fast (a Flux image takes seconds) and back off towards status_interval
+FIRST_STATUS_INTERVAL = 0.5
+STATUS_BACKOFF = 1.5
+
+
+class FalProvider(Provider):
+    """
+    fal.ai through its queue REST API: Flux dev / PuLID for images, Kling for
+    video (needs FAL_KEY). Tickets keep fal's status/response/cancel URLs, so a
+    job resumed after a restart (or on another worker) goes on waiting for the
+    same request. With a webhook_url, fal calls back when a request completes
+    and the inbox wakes its waiter at once; the status is polled with backoff up
+    to status_interval either way, in case a callback never arrives.
+    queue_url points the provider at another implementation of the queue API
+    (benchmarks/fake_fal.py); inline_inputs sends input images as data URLs
+    instead of uploading them to fal storage.
+    """
+
+    name = "fal"
+    kinds = ("image", "video")
+    # A 5xx or timeout on the queue POST may still have queued the (paid) request
+    submit_retryable = staticmethod(is_unsent)
+    retry_submit_timeouts = False
+
+    def __init__(self, queue_url=FAL_QUEUE_URL, webhook_url=None, inbox=None, status_interval=5.0, inline_inputs=False, **options):
+        super().__init__(**options)
+        self.queue_url = queue_url.rstrip("/")
+        self.webhook_url = webhook_url
+        self.inbox = inbox
+        self.status_interval = status_interval
+        self.inline_inputs = inline_inputs
+        self._client = None
+        self._uploads = {}
+        self.http = httpx.AsyncClient(headers=HEADERS, timeout=httpx.Timeout(120.0, connect=10.0), follow_redirects=True)
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = fal_client.AsyncClient()
+        return self._client
+
+    def available(self):
+        return bool(os.getenv("FAL_KEY"))
+
+    async def close(self):
+        await self.http.aclose()
+
+    def _auth(self):
+        return {"Authorization": f"Key {os.getenv('FAL_KEY', '')}"}
+
+    def _request_url(self, ticket, suffix=""):
+        """fal's URLs for a request; tickets from before they were kept are rebuilt from the app id"""
+        key = {"": "response_url", "/status": "status_url", "/cancel": "cancel_url"}[suffix]
+        if ticket.get(key):
+            return ticket[key]
+        owner, alias = ticket["application"].split("/")[:2]
+        return f"{self.queue_url}/{owner}/{alias}/requests/{ticket['request_id']}{suffix}"
+
+    async def _file_url(self, path):
+        """fal needs a URL for input images: local files are uploaded to fal storage once"""
+        if path.startswith(("http://", "https://", "data:")):
+            return path
+        if self.inline_inputs:
+            return await asyncio.to_thread(data_url, path)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime, stat.st_size)
+        if key not in self._uploads:
+            self._uploads[key] = await self.client.upload_file(path)
+        return self._uploads[key]
+
+    async def _submit(self, kind, request):
+        if kind == "video":
+            model, arguments = video_arguments(
+                await self._file_url(request["image"]), request["prompt"],
+                request.get("zoom", 0.0), request.get("horizontal", 0.0), request.get("vertical", 0.0),
+            )
+        else:
+            reference = request.get("reference")
+            model, arguments = image_arguments(
+                request["prompt"], request.get("aspect_ratio", "16:9"),
+                await self._file_url(reference) if reference else None, request.get("image_strength", 0.75),
+                request.get("seed"),
+            )
+        params = {"fal_webhook": self.webhook_url} if self.webhook_url else None
+        r = await self.http.post(f"{self.queue_url}/{model}", json=arguments, params=params, headers=self._auth())
+        r.raise_for_status()
+        queued = r.json()
+        return {
+            "application": model, "request_id": queued["request_id"],
+            "status_url": queued.get("status_url"), "response_url": queued.get("response_url"),
+            "cancel_url": queued.get("cancel_url"),
+        }
+
+    async def cancel(self, ticket):
+        r = await self.http.put(self._request_url(ticket, "/cancel"), headers=self._auth())
+        # 400: the request already completed, so there is nothing left to stop
+        if r.status_code != 400:
+            r.raise_for_status()
+
+    async def _status(self, ticket):
+        async with self._slots:
+            r = await self.http.get(self._request_url(ticket, "/status"), headers=self._auth())
+        r.raise_for_status()
+        return r.json()
+
+    async def _result(self, ticket):
+        request_id = ticket["request_id"]
+        interval, state = FIRST_STATUS_INTERVAL, None
+        while True:
+            status = await self._status(ticket)
+            if status["status"] == "COMPLETED":
+                break
+            if status["status"] != state:
+                state = status["status"]
+                where = f" (position {status['queue_position']})" if status.get("queue_position") is not None else ""
+                print(f"⏳ fal {request_id}: {state.lower().replace('_', ' ')}{where}")
+            if self.inbox:
+                # A callback only means "look again": the status above stays the authority
+                if await self.inbox.wait(request_id, interval):
+                    await self.inbox.discard(request_id)
+            else:
+                await asyncio.sleep(interval)
+            interval = min(interval * STATUS_BACKOFF, self.status_interval)
+        if status.get("error"):
+            raise ProviderError(f"fal request failed: {status['error']}")
+
+        async with self._slots:
+            r = await self.http.get(self._request_url(ticket), headers=self._auth())
+        r.raise_for_status()
+        result = r.json()
+        if self.inbox:
+            await self.inbox.discard(request_id)
+        if ticket["kind"] == "video":
+            if result and "video" in result:
+                return result["video"]["url"]
+            raise ProviderError("Model returned no video.")
+        if result and result.get("images"):
+            return result["images"][0]["url"]
+        raise ProviderError("Fal returned no images.")
+
+    async def download(self, ticket, output, target, sinks=()):
+        # sync_mode results come back inline as data URLs
+        if output.startswith("data:"):
+            return await write_stream(iter_base64(output), target, sinks)
+        async with self._slots, self.http.stream("GET", output) as r:
+            r.raise_for_status()
+            return await write_stream(r.aiter_bytes(chunk_size=CHUNK_SIZE), target, sinks)
+
+    def extension(self, ticket, output):
+        if output.startswith("data:"):
+            mime = output[5:output.index(";")] if ";" in output else ""
+            return mimetypes.guess_extension(mime) or ".png"
+        default = ".mp4" if ticket["kind"] == "video" else ".png"
+        return os.path.splitext(urlparse(output).path)[1] or default
+
+
+def data_url(path):
+    mime = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    with open(path, "rb") as f:
+        return f"data:{mime};base64,{base64.b64encode(f.read()).decode()}"
+
+
+# --- ROUTER ---
+class ProviderRouter:
+    """
+    Sends each request to the available provider with the best score:
+    expected seconds + cost x seconds_per_dollar. ComfyUI's estimate grows with
+    its queues, so a deep queue tips work over to fal once the wait outweighs
+    the price. If a provider's submit fails (after its own retries) the next
+    one is tried.
+    """
+
+    def __init__(self, providers, seconds_per_dollar=600.0):
+        self.providers = {provider.name: provider for provider in providers}
+        self.seconds_per_dollar = seconds_per_dollar
+
+    def get(self, name):
+        # Tickets saved before providers existed are ComfyUI steps
+        return self.providers[name or "comfyui"]
+
+    def names(self, kind, provider=None):
+        """Providers a `kind` request may end up on (just `provider` when pinned), available or not"""
+        if provider:
+            return [provider]
+        return [name for name, p in self.providers.items() if kind in p.kinds]
+
+    def score(self, provider, kind):
+        return provider.estimate_seconds(kind) + self.seconds_per_dollar * provider.cost.get(kind, 0.0)
+
+    def rank(self, kind):
+        candidates = [p for p in self.providers.values() if kind in p.kinds and p.available()]
+        return sorted(candidates, key=lambda p: self.score(p, kind))
+
+    def check(self, kind, provider=None):
+        """400 unless a pinned `provider` exists and generates `kind` (so it can be refused before queueing a job)"""
+        if provider and (provider not in self.providers or kind not in self.providers[provider].kinds):
+            raise HTTPException(status_code=400, detail=f"Provider {provider} cannot generate {kind}")
+
+    async def submit(self, kind, request, provider=None):
+        self.check(kind, provider)
+        if provider:
+            candidates = [self.providers[provider]]
+        else:
+            candidates = self.rank(kind)
+        if not candidates:
+            raise HTTPException(status_code=503, detail=f"No provider available for {kind}")
+
+        error = None
+        for candidate in candidates:
+            try:
+                return await candidate.submit(kind, request)
+            except Exception as e:
+                print(f"❌ Provider Error ({candidate.name}): {getattr(e, 'detail', e)}")
+                error = e
+        raise error
+
+    async def result(self, ticket):
+        return await self.get(ticket.get("provider")).result(ticket)
+
+    async def cancel(self, ticket):
+        await self.get(ticket.get("provider")).cancel(ticket)
+
+    async def download(self, ticket, output, target, sinks=()):
+        return await self.get(ticket.get("provider")).download(ticket, output, target, sinks)
+
+    def extension(self, ticket, output):
+        return self.get(ticket.get("provider")).extension(ticket, output)
+
+    def status(self):
+        return [
+            dict(provider.info(), score={kind: round(self.score(provider, kind), 2) for kind in provider.kinds})
+            for provider in self.providers.values()
+        ]
+
+    async def close(self):
+        await asyncio.gather(*(provider.close() for provider in self.providers.values()))
@@ -0,0 +1,240 @@
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Rows that land within this window are written in one transaction (group commit)
+INSERT_BATCH_WINDOW = 0.005
+# Bound parameters per IN (...) query, well under SQLite's variable limit
+IN_CHUNK = 500
+
+CONTENT_COLUMNS = (
+    "id", "type", "prompt", "url", "camera", "lens", "focal_length",
+    "is_favorite", "is_proxy", "parent_id", "created_at",
+)
+
+
+# --- DATABASE ---
+class Database:
+    """
+    SQLite access that never runs on the event loop. Each worker thread keeps
+    one long-lived WAL-mode connection, so its statement cache (prepared
+    statements) survives between queries instead of being rebuilt per request.
+    """
+
+    def __init__(self, path, workers=4):
+        self.path = path
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sqlite")
+
+    def connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    async def run(self, fn, *args):
+        """Runs fn(conn, *args) on a database thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn, args)
+
+    def _call(self, fn, args):
+        return fn(self.connect(), *args)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+# --- GENERATED CONTENT ---
+def init_schema(conn):
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS generated_content (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                type TEXT NOT NULL,
+                prompt TEXT,
+                url TEXT NOT NULL,
+                camera TEXT,
+                lens TEXT,
+                focal_length TEXT,
+                is_favorite INTEGER DEFAULT 0,
+                is_proxy INTEGER DEFAULT 0,
+                parent_id INTEGER,
+                created_at REAL
+            )
+        """)
+        # /history walks (is_proxy = 0, id DESC); /proxies looks up children by parent
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_content_proxy_id ON generated_content (is_proxy, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_content_parent ON generated_content (parent_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_content_favorite ON generated_content (is_favorite)")
+
+        # A single counter bumped on every change: cheap ETags without touching the big table
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS content_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        """)
+        conn.execute("INSERT OR IGNORE INTO content_version (id, version) VALUES (1, 0)")
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_content_version_{event.lower()}
+                AFTER {event} ON generated_content
+                BEGIN
+                    UPDATE content_version SET version = version + 1 WHERE id = 1;
+                END
+            """)
+
+
+def _get_item(conn, item_id):
+    return conn.execute("SELECT * FROM generated_content WHERE id = ?", (item_id,)).fetchone()
+
+
+def _content_version(conn):
+    return conn.execute("SELECT version FROM content_version WHERE id = 1").fetchone()[0]
+
+
+def _list_history(conn, cursor, limit, filters, fields):
+    clauses = ["is_proxy = 0"]
+    params = []
+    if cursor is not None:
+        clauses.append("id < ?")
+        params.append(cursor)
+    for column in ("type", "camera", "is_favorite"):
+        if filters.get(column) is not None:
+            clauses.append(f"{column} = ?")
+            params.append(filters[column])
+    if filters.get("created_after") is not None:
+        clauses.append("created_at >= ?")
+        params.append(filters["created_after"])
+    if filters.get("created_before") is not None:
+        clauses.append("created_at < ?")
+        params.append(filters["created_before"])
+
+    columns = ", ".join(fields)
+    sql = f"SELECT {columns} FROM generated_content WHERE {' AND '.join(clauses)} ORDER BY id DESC LIMIT ?"
+    return conn.execute(sql, (*params, limit)).fetchall()
+
+
+def _list_proxies(conn, parent_id):
+    return conn.execute("SELECT * FROM generated_content WHERE parent_id = ? ORDER BY id ASC", (parent_id,)).fetchall()
+
+
+def _proxies_by_parent(conn, parent_ids, ids_only):
+    columns = "parent_id, id" if ids_only else "*"
+    grouped = {parent_id: [] for parent_id in parent_ids}
+    for start in range(0, len(parent_ids), IN_CHUNK):
+        chunk = parent_ids[start:start + IN_CHUNK]
+        rows = conn.execute(
+            f"SELECT {columns} FROM generated_content WHERE parent_id IN ({', '.join('?' for _ in chunk)}) "
+            "ORDER BY parent_id, id ASC",
+            chunk,
+        ).fetchall()
+        for row in rows:
+            grouped[row["parent_id"]].append(row["id"] if ids_only else row)
+    return grouped
+
+
+def _insert_many(conn, rows):
+    ids = []
+    with conn:
+        for row in rows:
+            cursor = conn.execute(
+                f"INSERT INTO generated_content ({', '.join(row)}) VALUES ({', '.join('?' for _ in row)})",
+                tuple(row.values()),
+            )
+            ids.append(cursor.lastrowid)
+    return ids
+
+
+def _set_favorite(conn, item_id, value):
+    with conn:
+        return conn.execute("UPDATE generated_content SET is_favorite = ? WHERE id = ?", (int(value), item_id)).rowcount
+
+
+def _delete_item(conn, item_id):
+    with conn:
+        conn.execute("DELETE FROM generated_content WHERE parent_id = ? AND is_proxy = 1 AND is_favorite = 0", (item_id,))
+        return conn.execute("DELETE FROM generated_content WHERE id = ?", (item_id,)).rowcount
+
+
+class ContentRepository:
+    def __init__(self, db: Database):
+        self.db = db
+        self._pending = []
+        self._flusher = None
+
+    async def get_item(self, item_id: int):
+        return await self.db.run(_get_item, item_id)
+
+    async def version(self):
+        """Changes whenever any generated_content row is inserted, updated or deleted"""
+        return await self.db.run(_content_version)
+
+    async def list_history(self, cursor=None, limit=50, filters=None, fields=CONTENT_COLUMNS):
+        """
+        One keyset page of non-proxy items, newest first. Returns (rows, next_cursor);
+        next_cursor is None on the last page. `fields` must come from CONTENT_COLUMNS.
+        """
+        if "id" not in fields:
+            fields = ("id", *fields)
+        rows = await self.db.run(_list_history, cursor, limit + 1, filters or {}, fields)
+        if len(rows) > limit:
+            return rows[:limit], rows[limit - 1]["id"]
+        return rows, None
+
+    async def list_proxies(self, parent_id: int):
+        return await self.db.run(_list_proxies, parent_id)
+
+    async def proxies_by_parent(self, parent_ids, ids_only=False):
+        """
+        Children of many parents in one indexed pass: {parent_id: [rows]}
+        (or [ids] with ids_only, which the parent_id index fully covers).
+        """
+        return await self.db.run(_proxies_by_parent, list(dict.fromkeys(parent_ids)), ids_only)
+
+    async def set_favorite(self, item_id: int, value: bool):
+        """False if there is no such row"""
+        return await self.db.run(_set_favorite, item_id, value) == 1
+
+    async def delete_item(self, item_id: int):
+        """
+        Deletes a row and its unfavorited proxies; False if there is no such row.
+        Files stay until storage GC finds them unreferenced.
+        """
+        return await self.db.run(_delete_item, item_id) == 1
+
+    async def insert_many(self, rows):
+        """Inserts rows in one transaction and returns their ids in order"""
+        return await self.db.run(_insert_many, rows)
+
+    async def insert(self, row):
+        """
+        Inserts one row. Concurrent callers (e.g. multishot angles finishing
+        together) are coalesced into a single multi-row transaction.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((row, future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self):
+        await asyncio.sleep(INSERT_BATCH_WINDOW)
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                ids = await self.insert_many([row for row, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), row_id in zip(batch, ids):
+                    if not future.done():
+                        future.set_result(row_id)
@@ -0,0 +1,109 @@
+import json
+import time
+import asyncio
+import hashlib
+
+
+def workflow_key(workflow):
+    """SHA-256 of the canonical JSON form of a fully patched workflow"""
+    canonical = json.dumps(workflow, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def result_key(workflow, provider, image_strength=None):
+    """
+    Key of a finished render: the patched workflow plus what it does not carry,
+    the provider that rendered it (fal and ComfyUI give different images for
+    the same seed) and the reference strength fal applies
+    """
+    return workflow_key({"workflow": workflow, "provider": provider, "image_strength": image_strength})
+
+
+def init_schema(conn):
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS result_cache (
+                key TEXT PRIMARY KEY,
+                content_id INTEGER NOT NULL,
+                created_at REAL
+            )
+        """)
+
+
+def _lookup(conn, key):
+    return conn.execute(
+        "SELECT c.* FROM result_cache r JOIN generated_content c ON c.id = r.content_id WHERE r.key = ?", (key,)
+    ).fetchone()
+
+
+def _store(conn, key, content_id, now):
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO result_cache (key, content_id, created_at) VALUES (?, ?, ?)",
+            (key, content_id, now),
+        )
+
+
+def _forget(conn, key):
+    with conn:
+        conn.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+
+
+# --- RESULT CACHE ---
+class ResultCache:
+    """
+    Finished renders by workflow hash, so an identical request (same prompt,
+    settings, reference content and seed) is answered from generated_content
+    without GPU work. Renders still in flight are tracked per key in memory:
+    a duplicate arriving meanwhile waits for the first one (single-flight)
+    instead of queueing its own.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._inflight = {}
+
+    async def lookup(self, key):
+        return await self.db.run(_lookup, key)
+
+    async def store(self, key, content_id):
+        await self.db.run(_store, key, content_id, time.time())
+
+    async def forget(self, key):
+        await self.db.run(_forget, key)
+
+    def in_flight(self, key):
+        future = self._inflight.get(key)
+        return future is not None and not future.done()
+
+    def claim(self, key):
+        """Marks key as rendering; followers wait on it until resolve()/reject()"""
+        if not self.in_flight(key):
+            future = asyncio.get_running_loop().create_future()
+            # Followers may all be gone by the time a render fails; that is fine
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._inflight[key] = future
+        return self._inflight[key]
+
+    async def follow(self, key):
+        """The leader's result item, or None if nothing is rendering this key (e.g. after a restart)"""
+        future = self._inflight.get(key)
+        if future is None:
+            return None
+        return await asyncio.shield(future)
+
+    def resolve(self, key, result):
+        future = self._inflight.pop(key, None)
+        if future and not future.done():
+            future.set_result(result)
+
+    def abandon(self, key):
+        """The leader stopped (e.g. its job was cancelled): followers get None and render it themselves"""
+        future = self._inflight.pop(key, None)
+        if future and not future.done():
+            future.set_result(None)
+
+    def reject(self, key, exc):
+        future = self._inflight.pop(key, None)
+        if future and not future.done():
+            future.set_exception(exc)
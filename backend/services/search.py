@@ -0,0 +1,202 @@
+import re
+import sqlite3
+from collections import OrderedDict
+
+from services.repository import _content_version
+
+# Facet values returned per column (most frequent first)
+FACET_LIMIT = 20
+FACET_COLUMNS = ("camera", "lens")
+# Matches are ranked in blocks of this many, newest block first. bm25 costs a little per
+# hit, and a word in a quarter of all prompts would otherwise be scored 100k times per page.
+RANK_WINDOW = 5000
+# (total, facets) of recent queries, reused until the library changes (pagination, facet clicks)
+COUNT_CACHE_SIZE = 256
+
+# Indexed columns of generated_content, with their bm25 weights: a prompt hit outranks a camera/lens hit
+SEARCH_COLUMNS = ("prompt", "camera", "lens", "focal_length")
+RANK = "bm25(10.0, 2.0, 2.0, 1.0)"
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def init_schema(conn):
+    """
+    content_search: an external-content FTS5 index over generated_content (it
+    stores only the index, the text stays in generated_content), kept in sync by
+    triggers. Returns True if it was just created, i.e. existing rows still need
+    indexing (SearchIndex.rebuild).
+    """
+    with conn:
+        # Workers starting together: only the first one creates (and then builds) the index
+        conn.execute("BEGIN IMMEDIATE")
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'content_search'").fetchone()
+        # prefix='2 3': search-as-you-type prefixes ("anam*") are index lookups, not scans
+        conn.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS content_search USING fts5(
+                {', '.join(SEARCH_COLUMNS)},
+                content='generated_content', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        """)
+        conn.execute("INSERT INTO content_search (content_search, rank) VALUES ('rank', ?)", (RANK,))
+
+        columns = ", ".join(SEARCH_COLUMNS)
+        new_values = ", ".join(f"new.{column}" for column in SEARCH_COLUMNS)
+        old_values = ", ".join(f"old.{column}" for column in SEARCH_COLUMNS)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_content_search_insert AFTER INSERT ON generated_content
+            BEGIN
+                INSERT INTO content_search (rowid, {columns}) VALUES (new.id, {new_values});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_content_search_delete AFTER DELETE ON generated_content
+            BEGIN
+                INSERT INTO content_search (content_search, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            END
+        """)
+        # Only edits to indexed columns touch the index (favorite toggles do not)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_content_search_update AFTER UPDATE OF {columns} ON generated_content
+            BEGIN
+                INSERT INTO content_search (content_search, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO content_search (rowid, {columns}) VALUES (new.id, {new_values});
+            END
+        """)
+    return not exists
+
+
+def match_query(text):
+    """
+    FTS5 query for free text typed by a user: every word must match (in any
+    indexed column), the last one as a prefix. Words are quoted, so FTS5 syntax
+    (AND/OR/NEAR, column filters, stray quotes) is taken literally.
+    Returns None when the text has no searchable words.
+    """
+    tokens = _TOKEN.findall(text)
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"' for token in tokens) + "*"
+
+
+def _rebuild(conn):
+    with conn:
+        conn.execute("INSERT INTO content_search (content_search) VALUES ('rebuild')")
+        conn.execute("INSERT INTO content_search (content_search) VALUES ('optimize')")
+    return conn.execute("SELECT COUNT(*) FROM generated_content").fetchone()[0]
+
+
+# CROSS JOIN pins the join order: one MATCH, then a rowid lookup per hit. Left to itself the
+# planner may walk generated_content by an index and re-run the MATCH for every row.
+_SOURCE = "content_search s CROSS JOIN generated_content g ON g.id = s.rowid"
+
+
+def _where(match, filters, skip=()):
+    clauses, params = ["content_search MATCH ?"], [match]
+    for column, value in filters.items():
+        if value is not None and column not in skip:
+            clauses.append(f"g.{column} = ?")
+            params.append(value)
+    return " AND ".join(clauses), params
+
+
+def _page(conn, match, filters, limit, offset, fields):
+    where, params = _where(match, filters)
+    # Newest hits straight off the index (no sort), only as many blocks as this page reaches
+    hits = RANK_WINDOW * ((offset + limit - 1) // RANK_WINDOW + 1)
+    columns = ", ".join(f"g.{field}" for field in fields)
+    return conn.execute(
+        f"""
+        SELECT {', '.join(fields)}, score FROM (
+            SELECT *, (ROW_NUMBER() OVER (ORDER BY hit_id DESC) - 1) / ? AS block FROM (
+                SELECT {columns}, s.rowid AS hit_id, s.rank AS score FROM {_SOURCE}
+                WHERE {where} ORDER BY s.rowid DESC LIMIT ?
+            )
+        )
+        ORDER BY block, score, hit_id DESC LIMIT ? OFFSET ?
+        """,
+        (RANK_WINDOW, *params, hits, limit, offset),
+    ).fetchall()
+
+
+def _counts(conn, match, filters):
+    """
+    (total, facets) from a single pass over the hits, grouped by (camera, lens).
+    A facet ignores its own filter, so with a camera picked the other cameras
+    still show how many hits they would give.
+    """
+    where, params = _where(match, filters, skip=FACET_COLUMNS)
+    groups = conn.execute(
+        f"SELECT g.camera, g.lens, COUNT(*) FROM {_SOURCE} WHERE {where} GROUP BY g.camera, g.lens", params
+    ).fetchall()
+
+    def allowed(row, skip=None):
+        return all(filters.get(column) is None or row[i] == filters[column] for i, column in enumerate(FACET_COLUMNS) if column != skip)
+
+    total = sum(row[2] for row in groups if allowed(row))
+    facets = {}
+    for i, column in enumerate(FACET_COLUMNS):
+        counts = {}
+        for row in groups:
+            if row[i] is not None and allowed(row, skip=column):
+                counts[row[i]] = counts.get(row[i], 0) + row[2]
+        ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:FACET_LIMIT]
+        facets[column] = [{"value": value, "count": count} for value, count in ranked]
+    return total, facets
+
+
+# --- SEARCH INDEX ---
+class SearchIndex:
+    """
+    Full-text search over generated_content prompts, cameras and lenses. Needs a
+    SQLite built with FTS5 (standard in Python's bundled SQLite); without it the
+    index stays unavailable and search() raises RuntimeError.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.available = False
+        self._counts = OrderedDict()
+
+    async def start(self):
+        try:
+            created = await self.db.run(init_schema)
+        except sqlite3.OperationalError as e:
+            print(f"⚠️ Search Disabled (no FTS5 in this SQLite): {e}")
+            return
+        self.available = True
+        if created:
+            # One-time build for libraries that predate the index; triggers keep it current after that
+            print("🔎 Building search index...")
+            rows = await self.rebuild()
+            print(f"🔎 Search index built: {rows} rows")
+
+    async def rebuild(self):
+        """Re-indexes every generated_content row in one pass; returns the row count"""
+        return await self.db.run(_rebuild)
+
+    async def search(self, text, filters=None, limit=50, offset=0, fields=("id",)):
+        """
+        Ranked matches for free text: (rows, total, facets). Rows carry `fields`
+        plus a bm25 `score` (lower is better) and come best first within each
+        block of RANK_WINDOW matches, newest block first; facets are
+        {column: [{"value", "count"}]} over all matches.
+        """
+        if not self.available:
+            raise RuntimeError("Search index unavailable (SQLite without FTS5)")
+        match = match_query(text)
+        if match is None:
+            return [], 0, {column: [] for column in FACET_COLUMNS}
+        filters = filters or {}
+        rows = await self.db.run(_page, match, filters, limit, offset, fields)
+
+        key = (await self.db.run(_content_version), match, tuple(sorted(filters.items())))
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = await self.db.run(_counts, match, filters)
+            while len(self._counts) > COUNT_CACHE_SIZE:
+                self._counts.popitem(last=False)
+        else:
+            self._counts.move_to_end(key)
+        return (rows, *counts)
@@ -0,0 +1,119 @@
+import os
+import re
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+# Files written under their content hash: <prefix>_<first 32 hex chars of the sha256><ext>
+CONTENT_NAME = re.compile(r"_([0-9a-f]{32})\.[A-Za-z0-9]+$")
+# A content-addressed file never changes, so caches (browser, CDN, proxy) may keep it for good
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Older timestamp-named files: cacheable, but revalidated (a 304 when unchanged)
+REVALIDATE = "public, no-cache"
+RANGE_CHUNK = 256 * 1024
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def content_filename(prefix, digest, extension):
+    return f"{prefix}_{digest[:32]}{extension}"
+
+
+def content_hash(filename):
+    """The hash a content-addressed file name carries, or None for other names"""
+    match = CONTENT_NAME.search(filename)
+    return match.group(1) if match else None
+
+
+def byte_range(header, size):
+    """
+    (start, end) inclusive for a single-range Range header, "unsatisfiable", or
+    None to send the whole file (no header, multiple ranges, or one we cannot parse)
+    """
+    match = _RANGE.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return "unsatisfiable"
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return "unsatisfiable"
+    return start, end
+
+
+class FileRangeResponse(Response):
+    """206 Partial Content: bytes start..end of a file, read a chunk at a time"""
+
+    def __init__(self, path, start, end, headers):
+        super().__init__(status_code=206, headers=headers)
+        self.path = path
+        self.start = start
+        self.end = end
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, "rb") as f:
+            await f.seek(self.start)
+            while remaining > 0:
+                chunk = await f.read(min(RANGE_CHUNK, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # The file shrank under us: end the body rather than leave the client hanging
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """
+    StaticFiles for generated/ and uploads/: content-addressed files get a strong
+    ETag (their hash) and Cache-Control: immutable, and every file answers
+    single Range requests (206) so video scrubbing and resumed downloads do not
+    re-send the whole file.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        digest = content_hash(os.path.basename(full_path))
+        if digest:
+            response.headers["etag"] = f'"{digest}"'
+            response.headers["cache-control"] = IMMUTABLE
+        else:
+            response.headers["cache-control"] = REVALIDATE
+        response.headers["accept-ranges"] = "bytes"
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if not range_header or status_code != 200 or (if_range and if_range != response.headers["etag"]):
+            return response
+
+        size = stat_result.st_size
+        span = byte_range(range_header, size)
+        if span is None:
+            return response
+        if span == "unsatisfiable":
+            return Response(status_code=416, headers={"content-range": f"bytes */{size}"})
+        start, end = span
+        headers = {
+            key: value for key, value in response.headers.items()
+            if key in ("etag", "last-modified", "cache-control", "accept-ranges", "content-type")
+        }
+        headers["content-range"] = f"bytes {start}-{end}/{size}"
+        headers["content-length"] = str(end - start + 1)
+        return FileRangeResponse(full_path, start, end, headers)
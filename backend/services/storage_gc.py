@@ -0,0 +1,475 @@
+"""
+Storage GC for generated/, uploads/ and the derivatives rendered from them.
+Each pass works from one snapshot of generated_content and the directories:
+
+- expired proxies: unfavorited multishot proxies (whose parent is not a
+  favorite either) older than the retention period lose their rows
+- orphans: files in generated/ that no row points to (deleted rows, expired
+  proxies, renders that never got a row) and stale .part files anywhere
+- quotas: a directory over its byte quota loses its least recently used
+  files, and the rows pointing to them, until it fits; favorites never go
+  (a favorite's proxies can: the quota is a hard limit, retention is not)
+- derivatives: thumbnails, posters and previews whose source is gone
+
+Nothing used within the grace period is ever removed, so a file being
+written (its row not inserted yet) or just served again is safe, and neither
+is an input of an unfinished job (a reference image, a video's source), however
+long it waits. A dry run reports the same plan without touching anything.
+
+    cd backend && python -m services.storage_gc --dry-run
+    cd backend && python -m services.storage_gc
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+from urllib.parse import urlparse
+
+from services import metrics
+from services.repository import Database, IN_CHUNK, init_schema as init_content_schema
+from services.result_cache import init_schema as init_result_cache_schema
+
+# Why a file (and any rows pointing at it) is removed: report keys and metric labels
+ORPHAN = "orphan"
+EXPIRED_PROXY = "expired_proxy"
+QUOTA = "quota"
+DERIVATIVE = "derivative"
+REASONS = (ORPHAN, EXPIRED_PROXY, QUOTA, DERIVATIVE)
+
+# Directories whose files only exist for generated_content rows (uploads/ is a library of its own)
+ROW_BACKED = ("generated",)
+# Derivative roots under the derivatives directory, and the directory their sources live in
+DERIVATIVE_SOURCES = {"generated": "generated", "uploads": "uploads", "videos": "generated"}
+# With more than this share of generated/ unreferenced, the database is more likely the wrong one
+# (a new DB_PATH) than the files garbage: such orphans are reported but left alone
+MAX_ORPHAN_SHARE = 0.5
+MIN_ORPHANS_HELD = 20
+# One pass at a time across workers; a pass taking longer than this may overlap the next
+LOCK_LEASE = 600
+# How often the background loop checks whether a pass is due
+CHECK_INTERVAL = 300
+# Row ids listed for rows whose file is missing
+REPORT_SAMPLE = 20
+
+
+def init_schema(conn):
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS storage_gc (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                owner TEXT,
+                lease_until REAL,
+                last_run REAL,
+                last_report TEXT
+            )
+        """)
+        conn.execute("INSERT OR IGNORE INTO storage_gc (id, lease_until, last_run) VALUES (1, 0, 0)")
+
+
+def _claim(conn, owner, now, lease):
+    with conn:
+        cursor = conn.execute(
+            "UPDATE storage_gc SET owner = ?, lease_until = ? WHERE id = 1 AND (owner IS NULL OR owner = ? OR lease_until < ?)",
+            (owner, now + lease, owner, now),
+        )
+    return cursor.rowcount == 1
+
+
+def _finish(conn, owner, now, report):
+    with conn:
+        conn.execute(
+            "UPDATE storage_gc SET owner = NULL, lease_until = 0, last_run = ?, last_report = ? WHERE id = 1 AND owner = ?",
+            (now, None if report is None else json.dumps(report), owner),
+        )
+
+
+def _last_run(conn):
+    row = conn.execute("SELECT last_run, last_report FROM storage_gc WHERE id = 1").fetchone()
+    return row[0], json.loads(row[1]) if row[1] else None
+
+
+def _content_refs(conn):
+    # Leftover inline data: URLs (see legacy_import) name no file and can be huge: not fetched
+    return conn.execute(
+        "SELECT id, CASE WHEN url LIKE 'data:%' THEN NULL ELSE url END AS url, "
+        "is_favorite, is_proxy, parent_id, created_at FROM generated_content"
+    ).fetchall()
+
+
+def _delete_rows(conn, ids):
+    """Deletes the rows among ids that are still not favorites (a favorite set meanwhile wins); returns those ids"""
+    deleted = []
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for start in range(0, len(ids), IN_CHUNK):
+            chunk = ids[start:start + IN_CHUNK]
+            marks = ", ".join("?" for _ in chunk)
+            doomed = [row[0] for row in conn.execute(
+                f"SELECT id FROM generated_content WHERE id IN ({marks}) AND is_favorite = 0", chunk
+            )]
+            if doomed:
+                marks = ", ".join("?" for _ in doomed)
+                conn.execute(f"DELETE FROM generated_content WHERE id IN ({marks})", doomed)
+            deleted.extend(doomed)
+        # Cached results pointing at rows that are gone (GC'd here or deleted by hand)
+        conn.execute("DELETE FROM result_cache WHERE content_id NOT IN (SELECT id FROM generated_content)")
+    return deleted
+
+
+def _scan_files(directory):
+    """{name: (size, last_used)} of the files directly in directory; last_used is max(atime, mtime)"""
+    files = {}
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return files
+    with entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                files[entry.name] = (stat.st_size, max(stat.st_atime, stat.st_mtime))
+    return files
+
+
+def _scan_derivatives(root):
+    """{"<source root>/<variant>/<name>": (size, last_used)} under the derivatives directory"""
+    files = {}
+    for source_root in DERIVATIVE_SOURCES:
+        base = os.path.join(root, source_root)
+        if not os.path.isdir(base):
+            continue
+        for variant in os.scandir(base):
+            if variant.is_dir(follow_symlinks=False):
+                for name, info in _scan_files(variant.path).items():
+                    files[f"{source_root}/{variant.name}/{name}"] = info
+    return files
+
+
+def locate(url):
+    """("generated" | "uploads", file name) for a URL served from one of them, else None"""
+    if not url:
+        return None
+    path = urlparse(url).path
+    for directory in ("generated", "uploads"):
+        if f"/{directory}/" in path:
+            return directory, os.path.basename(path)
+    return None
+
+
+def is_partial(name):
+    """A write_stream temp file: left behind only if its writer died"""
+    return name.startswith(".") and name.endswith(".part")
+
+
+# --- PLANNING ---
+class RetentionPolicy:
+    """
+    proxy_retention: seconds an unfavorited proxy is kept (None: forever).
+    quotas: {"generated" | "uploads": max bytes}. grace: seconds since a file
+    was last written or read during which it is never removed.
+    """
+
+    def __init__(self, proxy_retention=None, quotas=None, grace=3600.0):
+        self.proxy_retention = proxy_retention
+        self.quotas = {directory: quota for directory, quota in (quotas or {}).items() if quota}
+        self.grace = grace
+
+    def describe(self):
+        return {"proxy_retention_seconds": self.proxy_retention, "quotas": self.quotas, "grace_seconds": self.grace}
+
+
+def plan(rows, files, derivatives, policy, now, in_use=()):
+    """
+    One pass worked out from a snapshot, touching nothing. rows: the
+    generated_content snapshot; files: {directory: {name: (size, last_used)}};
+    derivatives: as _scan_derivatives; in_use: file names unfinished jobs still
+    need, kept in any directory. Returns (rows, removals, notes):
+    {row id: (reason, location)}, {(directory, name): (size, reason)} with
+    directory "derivatives" for derivatives, and what was left alone and why.
+    """
+    idle_before = now - policy.grace
+    refs = {directory: {} for directory in files}
+    favorites = set()
+    for row in rows:
+        if row["is_favorite"]:
+            favorites.add(row["id"])
+        where = locate(row["url"])
+        if where and where[0] in refs:
+            refs[where[0]].setdefault(where[1], []).append(row)
+
+    def needed(url):
+        where = locate(url)
+        return where is not None and where[1] in in_use
+
+    doomed = {}
+    if policy.proxy_retention is not None:
+        cutoff = now - policy.proxy_retention
+        for row in rows:
+            if (row["is_proxy"] and not row["is_favorite"] and row["parent_id"] not in favorites
+                    and row["created_at"] is not None and row["created_at"] < cutoff and not needed(row["url"])):
+                doomed[row["id"]] = (EXPIRED_PROXY, locate(row["url"]))
+
+    def idle(directory, name):
+        return files[directory][name][1] < idle_before and name not in in_use
+
+    def live_rows(directory, name):
+        return [row for row in refs[directory].get(name, ()) if row["id"] not in doomed]
+
+    # Files whose every row is expiring go with them; files no row ever pointed at are orphans
+    removals, orphans = {}, {}
+    for directory, names in files.items():
+        for name, (size, _) in names.items():
+            if not idle(directory, name):
+                continue
+            if is_partial(name):
+                removals[(directory, name)] = (size, ORPHAN)
+            elif directory in ROW_BACKED and not live_rows(directory, name):
+                if refs[directory].get(name):
+                    removals[(directory, name)] = (size, EXPIRED_PROXY)
+                else:
+                    orphans[(directory, name)] = (size, ORPHAN)
+    held = 0
+    for directory in ROW_BACKED:
+        count = sum(1 for (where, _) in orphans if where == directory)
+        if count > MIN_ORPHANS_HELD and count > MAX_ORPHAN_SHARE * len(files.get(directory, ())):
+            held += count
+            orphans = {key: value for key, value in orphans.items() if key[0] != directory}
+    removals.update(orphans)
+
+    # Least recently used first until the directory fits; anything a favorite points to stays
+    over_quota = []
+    for directory, quota in policy.quotas.items():
+        names = files.get(directory, {})
+        used = sum(size for name, (size, _) in names.items() if (directory, name) not in removals)
+        candidates = sorted(
+            (last_used, name) for name, (_, last_used) in names.items()
+            if (directory, name) not in removals and idle(directory, name)
+        )
+        for _, name in candidates:
+            if used <= quota:
+                break
+            rows_here = live_rows(directory, name)
+            if any(row["is_favorite"] for row in rows_here):
+                continue
+            for row in rows_here:
+                doomed[row["id"]] = (QUOTA, (directory, name))
+            removals[(directory, name)] = (names[name][0], QUOTA)
+            used -= names[name][0]
+        if used > quota:
+            over_quota.append(directory)
+
+    # Derivatives of sources that are going (or gone); stale temp renders once idle
+    going = {(directory, os.path.splitext(name)[0]) for (directory, name) in removals}
+    present = {(directory, os.path.splitext(name)[0]) for directory, names in files.items() for name in names}
+    for path, (size, last_used) in derivatives.items():
+        source_root, _, name = path.split("/", 2)
+        source = (DERIVATIVE_SOURCES[source_root], os.path.splitext(name)[0])
+        if source in going or (source not in present and last_used < idle_before):
+            removals[("derivatives", path)] = (size, DERIVATIVE)
+
+    missing = [
+        row["id"] for row in rows
+        if row["id"] not in doomed and (where := locate(row["url"])) and where[0] in files and where[1] not in files[where[0]]
+    ]
+    notes = {"orphans_held": held, "over_quota": over_quota, "missing_files": {"rows": len(missing), "ids": missing[:REPORT_SAMPLE]}}
+    return doomed, removals, notes
+
+
+def summarize(files, derivatives, rows, removals, notes, policy):
+    """The report of a pass: per-reason totals, directory sizes before and after, and the notes"""
+    removed = {reason: {"rows": 0, "files": 0, "bytes": 0} for reason in REASONS}
+    for reason, _ in rows.values():
+        removed[reason]["rows"] += 1
+    freed = {}
+    for (directory, _), (size, reason) in removals.items():
+        removed[reason]["files"] += 1
+        removed[reason]["bytes"] += size
+        freed[directory] = freed.get(directory, 0) + size
+    sizes = {directory: (len(names), sum(size for size, _ in names.values())) for directory, names in files.items()}
+    sizes["derivatives"] = (len(derivatives), sum(size for size, _ in derivatives.values()))
+    directories = {
+        directory: {
+            "files": count, "bytes": size, "bytes_after": size - freed.get(directory, 0),
+            "quota": policy.quotas.get(directory),
+        }
+        for directory, (count, size) in sizes.items()
+    }
+    return {
+        "policy": policy.describe(),
+        "directories": directories,
+        "removed": removed,
+        "reclaimed_bytes": sum(freed.values()),
+        **notes,
+    }
+
+
+# --- STORAGE GC ---
+class StorageGC:
+    """
+    Runs a GC pass every `interval` seconds (0: only when asked) on whichever
+    worker claims it first; collect(dry_run=True) reports what a pass would do.
+    Removals are re-checked against the file just before they happen, so a file
+    that was used since the snapshot is skipped. `in_use` is an async callable
+    returning the file names unfinished jobs still need (as for UploadCache).
+    """
+
+    def __init__(
+        self, db, directories, derivatives_dir, policy, interval=3600.0, worker_id="gc",
+        uploads_index=None, upload_cache=None, in_use=None,
+    ):
+        self.db = db
+        self.directories = directories
+        self.derivatives_dir = derivatives_dir
+        self.policy = policy
+        self.interval = interval
+        self.worker_id = worker_id
+        self.uploads_index = uploads_index
+        self.upload_cache = upload_cache
+        self.in_use = in_use
+        self._task = None
+
+    async def start(self):
+        await self.db.run(init_content_schema)
+        await self.db.run(init_result_cache_schema)
+        await self.db.run(init_schema)
+        if self.interval:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def last_run(self):
+        """(timestamp, report) of the latest completed pass on any worker"""
+        return await self.db.run(_last_run)
+
+    async def collect(self, dry_run=False):
+        """One pass; returns its report, or None if another worker is running one right now"""
+        if dry_run:
+            return await self._pass(dry_run=True)
+        if not await self.db.run(_claim, self.worker_id, time.time(), LOCK_LEASE):
+            return None
+        report = None
+        try:
+            report = await self._pass(dry_run=False)
+        finally:
+            await self.db.run(_finish, self.worker_id, time.time(), report)
+        return report
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(min(self.interval, CHECK_INTERVAL))
+            try:
+                last_run, _ = await self.last_run()
+                if time.time() - last_run >= self.interval:
+                    await self.collect()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Storage GC Error: {e}")
+
+    async def _pass(self, dry_run):
+        started = time.time()
+        rows = await self.db.run(_content_refs)
+        files = {directory: await asyncio.to_thread(_scan_files, path) for directory, path in self.directories.items()}
+        derivatives = await asyncio.to_thread(_scan_derivatives, self.derivatives_dir)
+        in_use = set(await self.in_use()) if self.in_use else set()
+        doomed, removals, notes = await asyncio.to_thread(plan, rows, files, derivatives, self.policy, started, in_use)
+
+        if not dry_run:
+            doomed, removals = await self._apply(doomed, removals)
+        report = summarize(files, derivatives, doomed, removals, notes, self.policy)
+        report.update(dry_run=dry_run, started_at=started, seconds=round(time.time() - started, 3))
+        for directory, usage in report["directories"].items():
+            metrics.STORAGE_BYTES.labels(directory).set(usage["bytes_after"])
+
+        verb = "would remove" if dry_run else "removed"
+        print(
+            f"🧹 Storage GC: {verb} {sum(r['files'] for r in report['removed'].values())} files "
+            f"({report['reclaimed_bytes'] / 2 ** 20:.1f} MB), {len(doomed)} rows in {report['seconds']:.1f}s"
+        )
+        if notes["orphans_held"]:
+            print(f"⚠️ Storage GC: {notes['orphans_held']} unreferenced files left alone (most of generated/; wrong database?)")
+        return report
+
+    async def _apply(self, doomed, removals):
+        """Deletes rows, then files; returns what was actually removed"""
+        deleted = set(await self.db.run(_delete_rows, list(doomed)))
+        # A row favorited since the snapshot survived: so does its file
+        for row_id, (_, where) in doomed.items():
+            if row_id not in deleted and where:
+                removals.pop(where, None)
+        doomed = {row_id: value for row_id, value in doomed.items() if row_id in deleted}
+        for reason, _ in doomed.values():
+            metrics.GC_REMOVED_ROWS.labels(reason).inc()
+
+        removed = await asyncio.to_thread(self._remove_files, removals)
+        uploads = [os.path.join(self.directories["uploads"], name) for (directory, name) in removed if directory == "uploads"]
+        if uploads:
+            if self.uploads_index:
+                await self.uploads_index.forget(*uploads)
+            if self.upload_cache:
+                self.upload_cache.discard(*uploads)
+        return doomed, removed
+
+    def _remove_files(self, removals):
+        idle_before = time.time() - self.policy.grace
+        removed = {}
+        for (directory, name), (_, reason) in removals.items():
+            root = self.derivatives_dir if directory == "derivatives" else self.directories[directory]
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+                # Used since the snapshot (e.g. an identical render just landed on this name)
+                if reason != DERIVATIVE and max(stat.st_atime, stat.st_mtime) >= idle_before:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed[(directory, name)] = (stat.st_size, reason)
+            metrics.GC_REMOVED_FILES.labels(directory, reason).inc()
+            metrics.GC_RECLAIMED_BYTES.labels(directory, reason).inc(stat.st_size)
+        return removed
+
+
+async def main_async(args):
+    db = Database(args.db)
+    policy = RetentionPolicy(
+        proxy_retention=args.proxy_retention_days * 86400 if args.proxy_retention_days > 0 else None,
+        quotas={"generated": args.generated_quota, "uploads": args.uploads_quota},
+        grace=args.grace,
+    )
+    gc = StorageGC(
+        db, {"generated": args.generated_dir, "uploads": args.upload_dir}, args.derivatives_dir, policy,
+        interval=0, worker_id=f"cli-{os.getpid()}",
+    )
+    try:
+        await gc.start()
+        report = await gc.collect(dry_run=args.dry_run)
+    finally:
+        db.close()
+    if report is None:
+        print("⏳ A GC pass is already running on a backend worker")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "cinema_studio.db"))
+    parser.add_argument("--generated-dir", default=os.getenv("GENERATED_DIR", "generated"))
+    parser.add_argument("--upload-dir", default=os.getenv("UPLOAD_DIR", "uploads"))
+    parser.add_argument("--derivatives-dir", default=os.getenv("DERIVATIVES_DIR", "derivatives"))
+    parser.add_argument("--proxy-retention-days", type=float, default=float(os.getenv("PROXY_RETENTION_DAYS", "30")), help="0 keeps proxies forever")
+    parser.add_argument("--generated-quota", type=int, default=int(os.getenv("GENERATED_QUOTA_BYTES", "0")), help="bytes, 0 for none")
+    parser.add_argument("--uploads-quota", type=int, default=int(os.getenv("UPLOADS_QUOTA_BYTES", "0")), help="bytes, 0 for none")
+    parser.add_argument("--grace", type=float, default=float(os.getenv("GC_GRACE_SECONDS", "3600")), help="seconds a used file is safe")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be removed without removing anything")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
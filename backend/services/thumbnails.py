@@ -0,0 +1,142 @@
+import os
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, features
+except ImportError:  # derivatives are skipped and callers fall back to the original file
+    Image = None
+
+# Longest edge in pixels per named size
+SIZES = {"thumb": 320, "medium": 960}
+QUALITY = {"webp": 80, "avif": 55}
+SOURCE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def available_formats():
+    if Image is None:
+        return ()
+    return tuple(fmt for fmt in ("webp", "avif") if features.check(fmt))
+
+
+def _render(source_path, targets):
+    """Decodes the source once and writes every (size, fmt, path) derivative atomically"""
+    with Image.open(source_path) as img:
+        img.load()
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+        for size, fmt, path in targets:
+            edge = SIZES[size]
+            derivative = img.copy()
+            derivative.thumbnail((edge, edge), Image.LANCZOS)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Unique per writer: another worker may be rendering the same derivative right now
+            tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            derivative.save(tmp_path, format=fmt.upper(), quality=QUALITY[fmt])
+            os.replace(tmp_path, path)
+
+
+# --- THUMBNAILS ---
+class ThumbnailService:
+    """
+    WebP/AVIF thumbnails and medium previews for generated/ and uploads/.
+    New outputs are rendered in the background right after download; anything
+    older is backfilled lazily the first time it is requested (or by backfill()).
+    """
+
+    def __init__(self, cache_dir, sources, workers=2):
+        self.cache_dir = cache_dir
+        self.sources = sources
+        self.formats = available_formats()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbs")
+        self._inflight = {}
+        # enqueue()d renders: referenced until done, so the event loop cannot drop them midway
+        self._background = set()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return bool(self.formats)
+
+    def source_path(self, kind, filename):
+        if kind not in self.sources or filename != os.path.basename(filename) or filename.startswith("."):
+            return None
+        if not filename.lower().endswith(SOURCE_EXTENSIONS):
+            return None
+        return os.path.join(self.sources[kind], filename)
+
+    def derivative_path(self, kind, filename, size, fmt):
+        return os.path.join(self.cache_dir, kind, size, f"{os.path.splitext(filename)[0]}.{fmt}")
+
+    def enqueue(self, kind, filename):
+        """Fire-and-forget: render every size/format for a freshly written file"""
+        if self.enabled:
+            task = asyncio.get_running_loop().create_task(self._ensure_all(kind, filename))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    async def get(self, kind, filename, size, fmt):
+        """Path of the requested derivative, rendering it now if it is missing or stale"""
+        source = self.source_path(kind, filename)
+        if not self.enabled or fmt not in self.formats or size not in SIZES or source is None:
+            return None
+        if not os.path.exists(source):
+            return None
+        path = self.derivative_path(kind, filename, size, fmt)
+        if not is_fresh(path, source):
+            await self._ensure_all(kind, filename)
+        return path if os.path.exists(path) else None
+
+    async def backfill(self, kind, batch=200):
+        """Renders missing derivatives for files that predate the pipeline, a batch at a time"""
+        if not self.enabled:
+            return 0
+        directory = self.sources[kind]
+        names = await asyncio.to_thread(os.listdir, directory)
+        done = 0
+        for start in range(0, len(names), batch):
+            pending = [
+                name for name in names[start:start + batch]
+                if self.source_path(kind, name) and not is_fresh(
+                    self.derivative_path(kind, name, "thumb", self.formats[0]), os.path.join(directory, name)
+                )
+            ]
+            await asyncio.gather(*(self._ensure_all(kind, name) for name in pending))
+            done += len(pending)
+        if done:
+            print(f"🖼️ Thumbnail Backfill ({kind}): {done} files")
+        return done
+
+    async def _ensure_all(self, kind, filename):
+        key = (kind, filename)
+        if key in self._inflight:
+            await asyncio.wait([self._inflight[key]])
+            return
+        source = self.source_path(kind, filename)
+        targets = [
+            (size, fmt, self.derivative_path(kind, filename, size, fmt))
+            for size in SIZES for fmt in self.formats
+        ]
+        future = asyncio.get_running_loop().run_in_executor(self._executor, _render, source, targets)
+        self._inflight[key] = future
+        try:
+            await future
+        except Exception as e:
+            print(f"❌ Thumbnail Error ({kind}/{filename}): {e}")
+        finally:
+            self._inflight.pop(key, None)
+
+    async def close(self):
+        """Drops renders still waiting for the executor (a file missing a derivative is rendered on request)"""
+        for task in self._background:
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def is_fresh(path, source):
+    try:
+        return os.path.getmtime(path) >= os.path.getmtime(source)
+    except OSError:
+        return False
@@ -0,0 +1,244 @@
+import os
+import time
+import uuid
+import base64
+import asyncio
+import binascii
+import hashlib
+
+from services import metrics
+
+# Large writes keep syscalls (and thread hops) per image low; one chunk is all we hold per transfer
+CHUNK_SIZE = 1024 * 1024
+# base64 text decoded per step (a multiple of 4, so slices decode independently)
+B64_CHUNK = 4 * 256 * 1024
+# Chunks a tee'd HTTP client may fall behind before the download waits for it
+TEE_DEPTH = 8
+
+DATA_URL_MARKER = b"base64,"
+# Whitespace and JSON escapes ("\/") that may sit inside a base64 payload
+B64_NOISE = b"\r\n\t \\"
+
+
+def _write_chunk(f, digest, chunk):
+    f.write(chunk)
+    digest.update(chunk)
+
+
+def _discard(f, tmp_path):
+    f.close()
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+def _commit(f, tmp_path, path, keep_existing):
+    # On disk before the rename: a content-addressed name that exists is trusted from then on
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    if not keep_existing:
+        os.replace(tmp_path, path)
+        return
+    try:
+        # Marks the copy as just used (atime only, derivatives stay fresh), so storage GC leaves it be
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except FileNotFoundError:
+        os.replace(tmp_path, path)
+    else:
+        os.remove(tmp_path)
+
+
+async def _stream(chunks, directory, sinks, target):
+    tmp_path = os.path.join(directory, f".{uuid.uuid4().hex}.part")
+    f = await asyncio.to_thread(open, tmp_path, "wb")
+    digest = hashlib.sha256()
+    size = 0
+    # Time spent writing (as opposed to waiting on the network for the next chunk)
+    writing = 0.0
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            started = time.perf_counter()
+            await asyncio.to_thread(_write_chunk, f, digest, chunk)
+            writing += time.perf_counter() - started
+            size += len(chunk)
+            for sink in sinks:
+                await sink.put(chunk)
+        hexdigest = digest.hexdigest()
+        path, keep_existing = target(hexdigest)
+        started = time.perf_counter()
+        await asyncio.to_thread(_commit, f, tmp_path, path, keep_existing)
+        metrics.observe("disk_write", writing + time.perf_counter() - started)
+    except BaseException as e:
+        if not isinstance(e, asyncio.CancelledError):
+            metrics.fail("disk_write")
+        await asyncio.to_thread(_discard, f, tmp_path)
+        for sink in sinks:
+            _put_error(sink, e)
+        raise
+    for sink in sinks:
+        await sink.put(None)
+    return path, size, hexdigest
+
+
+def _put_error(sink, e):
+    """Fails a sink even if it is full: the reader loses its oldest chunk, never the error"""
+    while True:
+        try:
+            sink.put_nowait(e)
+            return
+        except asyncio.QueueFull:
+            sink.get_nowait()
+
+
+# --- STREAMING WRITES ---
+async def write_stream(chunks, target, sinks=()):
+    """
+    Writes an async iterator of byte chunks to `target` without ever holding
+    the whole file: chunks go to a temp file next to the target (off the event
+    loop) and are renamed into place once complete, so readers never see a
+    partial image. Each chunk is also put on every queue in `sinks` (None marks
+    the end, an exception a failure). Returns (path, size, sha256 hex digest).
+
+    `target` is a path, or a ContentTarget to name the file after its digest.
+    """
+    if isinstance(target, ContentTarget):
+        return await _stream(chunks, target.directory, sinks, lambda digest: (target.path(digest), True))
+    directory = os.path.dirname(target) or "."
+    return await _stream(chunks, directory, sinks, lambda digest: (target, False))
+
+
+class ContentTarget:
+    """A write_stream target in `directory` named name_for(sha256 hex digest); an existing copy is kept"""
+
+    def __init__(self, directory, name_for):
+        self.directory = directory
+        self.name_for = name_for
+
+    def path(self, digest):
+        return os.path.join(self.directory, self.name_for(digest))
+
+
+async def write_content_stream(chunks, directory, name_for):
+    """Like write_stream, but the file is named name_for(digest) and an existing copy is kept"""
+    return await write_stream(chunks, ContentTarget(directory, name_for))
+
+
+# Tasks consuming tees nobody reads any more (referenced here so they are not garbage-collected)
+_swallowing = set()
+
+
+def tee_queue():
+    return asyncio.Queue(maxsize=TEE_DEPTH)
+
+
+def discard(queue):
+    """Consumes the rest of a write_stream() sink in the background, so the transfer never blocks on it"""
+    task = asyncio.get_running_loop().create_task(_swallow(queue))
+    _swallowing.add(task)
+    task.add_done_callback(_swallowing.discard)
+
+
+async def drain(queue):
+    """Yields the chunks a write_stream() sink receives, re-raising a failed transfer"""
+    ended = False
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None or isinstance(chunk, BaseException):
+                ended = True
+                if chunk is None:
+                    return
+                raise chunk
+            yield chunk
+    finally:
+        if not ended:
+            # The client went away mid-transfer: keep consuming so the download never blocks on it
+            discard(queue)
+
+
+async def _swallow(queue):
+    while True:
+        chunk = await queue.get()
+        if chunk is None or isinstance(chunk, BaseException):
+            return
+
+
+def image_extension(head: bytes):
+    """File extension for image bytes, from their magic number"""
+    if head.startswith(b"\x89PNG"):
+        return ".png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if head.startswith(b"\xff\xd8"):
+        return ".jpg"
+    raise ValueError("Unsupported image format")
+
+
+# --- BASE64 ---
+class Base64StreamDecoder:
+    """Decodes base64 fed in arbitrary pieces, carrying partial quanta between calls"""
+
+    def __init__(self):
+        self._pending = b""
+
+    def feed(self, data: bytes) -> bytes:
+        data = self._pending + data.translate(None, B64_NOISE)
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        try:
+            return base64.b64decode(data[:usable], validate=True)
+        except binascii.Error:
+            raise ValueError("Invalid base64 payload")
+
+    def finish(self) -> bytes:
+        pending, self._pending = self._pending, b""
+        if not pending:
+            return b""
+        try:
+            return base64.b64decode(pending + b"=" * (-len(pending) % 4))
+        except binascii.Error:
+            raise ValueError("Truncated base64 payload")
+
+
+async def iter_base64(text: str):
+    """Decoded chunks of an in-memory base64 string or data URL, one slice at a time"""
+    start = text.find("base64,")
+    start = 0 if start < 0 else start + len("base64,")
+    decoder = Base64StreamDecoder()
+    for offset in range(start, len(text), B64_CHUNK):
+        yield decoder.feed(text[offset:offset + B64_CHUNK].encode("ascii"))
+    yield decoder.finish()
+
+
+async def iter_data_url(byte_chunks):
+    """
+    Decodes a request body carrying one base64 image as it arrives: a data URL,
+    or JSON such as {"base64_data": "data:image/png;base64,..."}. Everything up
+    to 'base64,' is skipped and decoding stops at the closing quote.
+    """
+    decoder = Base64StreamDecoder()
+    head = b""
+    started = False
+    async for chunk in byte_chunks:
+        if not started:
+            head += chunk
+            marker = head.find(DATA_URL_MARKER)
+            if marker < 0:
+                if len(head) > 4096:
+                    raise ValueError("Expected a base64 data URL")
+                continue
+            chunk = head[marker + len(DATA_URL_MARKER):]
+            head = b""
+            started = True
+        end = chunk.find(b'"')
+        if end >= 0:
+            yield decoder.feed(chunk[:end])
+            break
+        yield decoder.feed(chunk)
+    if not started:
+        raise ValueError("Expected a base64 data URL")
+    yield decoder.finish()
@@ -0,0 +1,166 @@
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+
+from services.transfers import iter_base64, write_content_stream
+
+# Local copies written by the cache are named ref_<digest>.<ext>; only those are ever evicted
+PREFIX = "ref_"
+DIGEST_CHARS = 32
+# Copies used more recently than this are never evicted: a job may have stored its reference
+# and not yet saved the steps naming it (the cache can run over max_bytes meanwhile)
+EVICT_GRACE = 600.0
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# --- UPLOAD CACHE ---
+class UploadCache:
+    """
+    Maps image content (SHA-256) to the filename ComfyUI knows it by, so a
+    reference image is written to uploads/ once and sent to each node only once.
+
+    Remote names are content-addressed too (ref_<digest>.<ext>), so a workflow
+    can name its input before a node is picked, and a restarted backend can find
+    earlier uploads again. An entry is trusted for the node's current bridge
+    epoch; after a websocket reconnect (possibly a pod restart) it is re-checked
+    with a HEAD on /view before being reused.
+    """
+
+    def __init__(self, upload_dir, max_bytes, index=None, in_use=None):
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.index = index
+        # Async callable returning the filenames unfinished jobs still need: never evicted
+        self.in_use = in_use
+        self._remote = {}
+        self._file_digests = {}
+        self._locks = {}
+        self._local = OrderedDict()
+        self._local_bytes = 0
+        self._scan()
+
+    def _scan(self):
+        entries = []
+        for entry in os.scandir(self.upload_dir):
+            if entry.name.startswith(PREFIX) and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._local[path] = size
+            self._local_bytes += size
+
+    # --- PUBLIC API ---
+    async def store_stream(self, chunks, ext=".jpg"):
+        """
+        Stores image bytes from an async iterator of chunks locally (once, hashed
+        while writing) and returns the local path
+        """
+        path, size, digest = await write_content_stream(
+            chunks, self.upload_dir, lambda digest: f"{PREFIX}{digest[:DIGEST_CHARS]}{ext}"
+        )
+        if path in self._local:
+            self._touch(path)
+            evicted = []
+        else:
+            evicted = await self._add_local(path, size)
+        if self.index:
+            await self.index.forget(*evicted)
+            await self.index.record(path)
+        return path
+
+    async def store_base64(self, text: str, ext=".jpg"):
+        """Same as store_stream for a base64 string or data URL, decoded a slice at a time"""
+        return await self.store_stream(iter_base64(text), ext)
+
+    async def input_name(self, path):
+        """The content-addressed name a local file has (or will have) on every ComfyUI node"""
+        if path in self._local:
+            # A gallery reference picked again is a use too
+            self._touch(path)
+        if os.path.basename(path).startswith(PREFIX):
+            return os.path.basename(path)
+        digest = await self._digest(path)
+        return f"{PREFIX}{digest[:DIGEST_CHARS]}{os.path.splitext(path)[1] or '.png'}"
+
+    async def ensure(self, bridge, path):
+        """Makes sure `bridge`'s node has the local file (gallery item, reference, source); returns its name"""
+        name = await self.input_name(path)
+        key = (bridge.base_url, name)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if self._remote.get(key) == bridge.epoch:
+                print(f"♻️ Upload Cache Hit: {name}")
+                return name
+            if await bridge.has_input(name):
+                print(f"♻️ Upload Cache Revalidated: {name}")
+            else:
+                name = (await bridge.upload_image(path, name=name))["name"]
+            self._remote[key] = bridge.epoch
+            return name
+
+    def discard(self, *paths):
+        """Forgets local copies deleted by someone else (storage GC)"""
+        for path in paths:
+            size = self._local.pop(path, None)
+            if size is not None:
+                self._local_bytes -= size
+
+    def stats(self):
+        return {"remote_entries": len(self._remote), "local_files": len(self._local), "local_bytes": self._local_bytes}
+
+    async def _digest(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_mtime, stat.st_size)
+        digest = self._file_digests.get(key)
+        if digest is None:
+            digest = await asyncio.to_thread(sha256_file, path)
+            self._file_digests[key] = digest
+        return digest
+
+    # --- LOCAL LRU ---
+    def _touch(self, path):
+        self._local.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    async def _add_local(self, path, size):
+        """Adds a new local copy and returns the paths evicted to stay under max_bytes"""
+        self._local[path] = size
+        self._local_bytes += size
+        if self._local_bytes <= self.max_bytes:
+            return []
+        # A queued or running step may still upload its inputs (e.g. resubmitted after a node went down)
+        keep = set(await self.in_use()) if self.in_use else set()
+        keep.add(os.path.basename(path))
+        idle_before = time.time() - EVICT_GRACE
+        evicted = []
+        for old_path in list(self._local):
+            if self._local_bytes <= self.max_bytes:
+                break
+            if os.path.basename(old_path) in keep or old_path not in self._local:
+                continue
+            try:
+                if os.stat(old_path).st_mtime > idle_before:
+                    # Least recently used first: everything after this one is newer still
+                    break
+            except FileNotFoundError:
+                pass
+            self._local_bytes -= self._local.pop(old_path)
+            try:
+                os.remove(old_path)
+                print(f"🧹 Evicted Upload: {os.path.basename(old_path)}")
+            except FileNotFoundError:
+                pass
+            evicted.append(old_path)
+        return evicted
@@ -0,0 +1,168 @@
+import os
+import asyncio
+
+try:
+    from watchfiles import awatch, Change  # ships with uvicorn[standard]
+except ImportError:  # pragma: no cover - falls back to periodic reconciles
+    awatch = None
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def init_schema(conn):
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS upload_files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT NOT NULL UNIQUE,
+                size INTEGER,
+                mtime REAL
+            )
+        """)
+        # Newest-first listing with a (mtime, id) keyset cursor
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_upload_files_mtime ON upload_files (mtime, id)")
+
+
+def is_indexed_name(filename):
+    return filename.lower().endswith(IMAGE_EXTENSIONS) and not filename.startswith(".")
+
+
+def _scan(upload_dir):
+    files = {}
+    for entry in os.scandir(upload_dir):
+        if is_indexed_name(entry.name) and entry.is_file():
+            stat = entry.stat()
+            files[entry.name] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+def _reconcile(conn, on_disk):
+    known = {row["filename"]: (row["size"], row["mtime"]) for row in conn.execute("SELECT filename, size, mtime FROM upload_files")}
+    upserts = [(name, size, mtime) for name, (size, mtime) in on_disk.items() if known.get(name) != (size, mtime)]
+    deletes = [(name,) for name in known if name not in on_disk]
+    with conn:
+        conn.executemany(_UPSERT, upserts)
+        conn.executemany("DELETE FROM upload_files WHERE filename = ?", deletes)
+    return len(upserts), len(deletes)
+
+
+_UPSERT = (
+    "INSERT INTO upload_files (filename, size, mtime) VALUES (?, ?, ?) "
+    "ON CONFLICT(filename) DO UPDATE SET size = excluded.size, mtime = excluded.mtime"
+)
+
+
+def _upsert(conn, rows):
+    with conn:
+        conn.executemany(_UPSERT, rows)
+
+
+def _delete(conn, names):
+    with conn:
+        conn.executemany("DELETE FROM upload_files WHERE filename = ?", [(name,) for name in names])
+
+
+def _list(conn, cursor, limit):
+    if cursor is None:
+        return conn.execute(
+            "SELECT id, filename, size, mtime FROM upload_files ORDER BY mtime DESC, id DESC LIMIT ?", (limit,)
+        ).fetchall()
+    mtime, row_id = cursor
+    return conn.execute(
+        "SELECT id, filename, size, mtime FROM upload_files "
+        "WHERE mtime < ? OR (mtime = ? AND id < ?) ORDER BY mtime DESC, id DESC LIMIT ?",
+        (mtime, mtime, row_id, limit),
+    ).fetchall()
+
+
+# --- UPLOADS INDEX ---
+class UploadsIndex:
+    """
+    DB-backed listing of uploads/ so the gallery never scans the directory.
+    Our own writes update it directly; a watchfiles (inotify) watcher, or a
+    periodic reconcile when that is unavailable, catches everything else.
+    """
+
+    def __init__(self, db, upload_dir, poll_interval=60.0):
+        self.db = db
+        self.upload_dir = upload_dir
+        self.poll_interval = poll_interval
+        self._watcher = None
+        self._stop = asyncio.Event()
+
+    async def start(self):
+        await self.db.run(init_schema)
+        await self.reconcile()
+        self._stop.clear()
+        self._watcher = asyncio.create_task(self._watch() if awatch else self._poll())
+
+    async def stop(self):
+        self._stop.set()
+        if self._watcher:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+
+    async def reconcile(self):
+        on_disk = await asyncio.to_thread(_scan, self.upload_dir)
+        added, removed = await self.db.run(_reconcile, on_disk)
+        if added or removed:
+            print(f"🗂️ Uploads Index: {added} updated, {removed} removed")
+
+    async def record(self, *paths):
+        rows = []
+        for path in paths:
+            name = os.path.basename(path)
+            if not is_indexed_name(name):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            rows.append((name, stat.st_size, stat.st_mtime))
+        if rows:
+            await self.db.run(_upsert, rows)
+
+    async def forget(self, *paths):
+        if paths:
+            await self.db.run(_delete, [os.path.basename(path) for path in paths])
+
+    async def list(self, cursor=None, limit=50):
+        """Returns (rows, next_cursor) newest first; cursors look like '<mtime>:<id>'"""
+        rows = await self.db.run(_list, parse_cursor(cursor), limit + 1)
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            return rows[:limit], f"{last['mtime']!r}:{last['id']}"
+        return rows, None
+
+    # --- WATCHERS ---
+    async def _watch(self):
+        try:
+            async for changes in awatch(self.upload_dir, stop_event=self._stop, recursive=False):
+                removed = [path for change, path in changes if change == Change.deleted]
+                changed = [path for change, path in changes if change != Change.deleted]
+                await self.forget(*removed)
+                await self.record(*changed)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Uploads Watcher Error: {e} (falling back to polling)")
+            await self._poll()
+
+    async def _poll(self):
+        while not self._stop.is_set():
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                print(f"❌ Uploads Reconcile Error: {e}")
+
+
+def parse_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        mtime, row_id = cursor.split(":", 1)
+        return float(mtime), int(row_id)
+    except ValueError:
+        raise ValueError("Invalid uploads cursor")
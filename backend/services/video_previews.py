@@ -0,0 +1,137 @@
+import os
+import uuid
+import shutil
+import asyncio
+
+from services import metrics
+from services.thumbnails import SIZES, is_fresh
+
+SOURCE_EXTENSIONS = ('.mp4', '.webm', '.mov')
+# Poster: the first frame (the source still, for image-to-video) at the medium thumbnail size.
+# Preview: a small, silent, low-bitrate loop for gallery hover, moov atom first so it plays at once.
+VARIANTS = {
+    "poster": (".jpg", ["-frames:v", "1", "-vf", f"scale='min({SIZES['medium']},iw)':-2", "-q:v", "4"]),
+    "preview": (".mp4", [
+        "-vf", "scale='min(480,iw)':-2", "-an", "-c:v", "libx264", "-preset", "veryfast", "-crf", "32",
+        "-maxrate", "400k", "-bufsize", "800k", "-pix_fmt", "yuv420p", "-movflags", "+faststart",
+    ]),
+}
+
+
+# --- VIDEO PREVIEWS ---
+class VideoPreviewService:
+    """
+    Poster frames and low-bitrate previews for generated videos, extracted with
+    ffmpeg in the background right after download (older videos are backfilled
+    lazily, or by backfill()). Without an ffmpeg binary previews are disabled
+    and callers fall back to the original file.
+    """
+
+    def __init__(self, cache_dir, source_dir, ffmpeg="ffmpeg", workers=2):
+        self.cache_dir = cache_dir
+        self.source_dir = source_dir
+        self.ffmpeg = shutil.which(ffmpeg)
+        self._slots = asyncio.Semaphore(workers)
+        self._inflight = {}
+        # enqueue()d extractions: referenced until done, so the event loop cannot drop them midway
+        self._background = set()
+        if self.ffmpeg is None:
+            print(f"⚠️ Video Previews Disabled ({ffmpeg} not found)")
+
+    @property
+    def enabled(self):
+        return self.ffmpeg is not None
+
+    def source_path(self, filename):
+        if filename != os.path.basename(filename) or filename.startswith("."):
+            return None
+        if not filename.lower().endswith(SOURCE_EXTENSIONS):
+            return None
+        return os.path.join(self.source_dir, filename)
+
+    def derivative_path(self, filename, variant):
+        extension = VARIANTS[variant][0]
+        return os.path.join(self.cache_dir, "videos", variant, f"{os.path.splitext(filename)[0]}{extension}")
+
+    def enqueue(self, filename):
+        """Fire-and-forget: extract every variant of a freshly written video"""
+        if self.enabled:
+            task = asyncio.get_running_loop().create_task(self._ensure_all(filename))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    async def get(self, filename, variant):
+        """Path of the requested variant, extracting it now if it is missing or stale"""
+        source = self.source_path(filename)
+        if not self.enabled or variant not in VARIANTS or source is None or not os.path.exists(source):
+            return None
+        path = self.derivative_path(filename, variant)
+        if not is_fresh(path, source):
+            await self._ensure_all(filename)
+        return path if os.path.exists(path) else None
+
+    async def backfill(self):
+        """Extracts missing variants for videos that predate the pipeline, one at a time"""
+        if not self.enabled:
+            return 0
+        names = await asyncio.to_thread(os.listdir, self.source_dir)
+        pending = [
+            name for name in names
+            if self.source_path(name) and not is_fresh(
+                self.derivative_path(name, "poster"), os.path.join(self.source_dir, name)
+            )
+        ]
+        for name in pending:
+            await self._ensure_all(name)
+        if pending:
+            print(f"🎞️ Video Preview Backfill: {len(pending)} files")
+        return len(pending)
+
+    async def _ensure_all(self, filename):
+        if filename in self._inflight:
+            await asyncio.wait([self._inflight[filename]])
+            return
+        task = asyncio.get_running_loop().create_task(self._extract(filename))
+        self._inflight[filename] = task
+        task.add_done_callback(lambda _: self._inflight.pop(filename, None))
+        # A request giving up on a preview does not stop its extraction
+        await asyncio.shield(task)
+
+    async def close(self):
+        """Stops running extractions (ffmpeg is killed; the video gets its variants on request)"""
+        tasks = [*self._background, *self._inflight.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _extract(self, filename):
+        # A background stage of its own, not a stage of the job that enqueued it
+        metrics.begin("video")
+        source = self.source_path(filename)
+        try:
+            async with self._slots:
+                with metrics.span("video_preview"):
+                    for variant in VARIANTS:
+                        await self._render(source, variant, self.derivative_path(filename, variant))
+        except Exception as e:
+            print(f"❌ Video Preview Error ({filename}): {e}")
+
+    async def _render(self, source, variant, path):
+        extension, options = VARIANTS[variant]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique per writer: another worker may be extracting the same video right now
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp{extension}"
+        process = await asyncio.create_subprocess_exec(
+            self.ffmpeg, "-nostdin", "-loglevel", "error", "-y", "-i", source, *options, tmp_path,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            _, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            process.kill()
+            raise
+        if process.returncode != 0:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise RuntimeError(f"ffmpeg {variant} exited {process.returncode}: {stderr.decode(errors='replace').strip()[-300:]}")
+        os.replace(tmp_path, path)
@@ -0,0 +1,172 @@
+import time
+import base64
+import asyncio
+import hashlib
+
+import httpx
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+except ImportError:  # callbacks cannot be verified, so they are refused and jobs rely on status polls
+    Ed25519PublicKey = None
+
+# How often a waiter checks the table for a callback another worker received
+DELIVERY_POLL_INTERVAL = 1.0
+# Callbacks nobody collected (the request finished through a status poll first) are dropped after this
+DELIVERY_TTL = 24 * 3600
+
+# fal's webhook signing keys (JWKS); cached for at most a day, as fal asks
+FAL_JWKS_URL = "https://rest.alpha.fal.ai/.well-known/jwks.json"
+JWKS_TTL = 24 * 3600
+# Keys are fetched again early on a signature mismatch (rotation), but not more often than this
+JWKS_MIN_REFRESH = 300
+# Signed timestamps further than this from our clock are refused (replays)
+SIGNATURE_TOLERANCE = 300
+
+
+def init_schema(conn):
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS webhook_deliveries (
+                request_id TEXT PRIMARY KEY,
+                status TEXT,
+                received_at REAL NOT NULL
+            )
+        """)
+
+
+def _record(conn, request_id, status, now):
+    with conn:
+        conn.execute("DELETE FROM webhook_deliveries WHERE received_at < ?", (now - DELIVERY_TTL,))
+        conn.execute(
+            "INSERT OR REPLACE INTO webhook_deliveries (request_id, status, received_at) VALUES (?, ?, ?)",
+            (request_id, status, now),
+        )
+
+
+def _delivered(conn, request_id):
+    return conn.execute("SELECT 1 FROM webhook_deliveries WHERE request_id = ?", (request_id,)).fetchone() is not None
+
+
+def _forget(conn, request_id):
+    with conn:
+        conn.execute("DELETE FROM webhook_deliveries WHERE request_id = ?", (request_id,))
+
+
+# --- WEBHOOK INBOX ---
+class WebhookInbox:
+    """
+    Completion callbacks from a provider's queue (fal's fal_webhook), keyed by
+    request id. A callback is only a wake-up: the waiter goes back to the
+    provider for the status and the result, so a forged or replayed callback
+    costs one status check and nothing else. Callbacks are recorded in the
+    database because the worker fal calls back need not be the one waiting.
+    """
+
+    def __init__(self, db, poll_interval=DELIVERY_POLL_INTERVAL):
+        self.db = db
+        self.poll_interval = poll_interval
+        self._waiters = {}
+
+    async def start(self):
+        await self.db.run(init_schema)
+
+    async def deliver(self, request_id, status=None):
+        await self.db.run(_record, request_id, status, time.time())
+        event = self._waiters.get(request_id)
+        if event:
+            event.set()
+
+    async def wait(self, request_id, timeout):
+        """True once a callback for request_id has arrived, False after timeout seconds without one"""
+        event = self._waiters.setdefault(request_id, asyncio.Event())
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                if event.is_set() or await self.db.run(_delivered, request_id):
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(event.wait(), min(self.poll_interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self._waiters.get(request_id) is event:
+                del self._waiters[request_id]
+
+    async def discard(self, request_id):
+        """Drops the callback for a request whose result has been collected"""
+        await self.db.run(_forget, request_id)
+
+
+# --- SIGNATURES ---
+class FalWebhookVerifier:
+    """
+    Checks the ED25519 signature fal puts on webhook calls: the X-Fal-Webhook-*
+    request id, user id and timestamp and the SHA-256 of the body, one per line,
+    signed with a key from fal's JWKS. Without the cryptography package every
+    callback is refused.
+    """
+
+    def __init__(self, jwks_url=FAL_JWKS_URL, tolerance=SIGNATURE_TOLERANCE):
+        self.jwks_url = jwks_url
+        self.tolerance = tolerance
+        self.http = httpx.AsyncClient(timeout=10.0)
+        self._keys = []
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+        if Ed25519PublicKey is None:
+            print("⚠️ fal Webhooks Refused (cryptography not installed): jobs poll fal for status")
+
+    async def verify(self, headers, body: bytes):
+        if Ed25519PublicKey is None:
+            return False
+        fields = [headers.get(f"x-fal-webhook-{name}") for name in ("request-id", "user-id", "timestamp", "signature")]
+        if not all(fields):
+            return False
+        request_id, user_id, timestamp, signature = fields
+        try:
+            if abs(time.time() - int(timestamp)) > self.tolerance:
+                return False
+            signature = bytes.fromhex(signature)
+        except ValueError:
+            return False
+        message = "\n".join([request_id, user_id, timestamp, hashlib.sha256(body).hexdigest()]).encode()
+
+        if self._check(await self._current_keys(), signature, message):
+            return True
+        # fal may have rotated its keys since they were fetched
+        if time.time() - self._fetched_at >= JWKS_MIN_REFRESH:
+            return self._check(await self._current_keys(refresh=True), signature, message)
+        return False
+
+    def _check(self, keys, signature, message):
+        for key in keys:
+            try:
+                key.verify(signature, message)
+                return True
+            except InvalidSignature:
+                continue
+        return False
+
+    async def _current_keys(self, refresh=False):
+        async with self._lock:
+            if refresh or time.time() - self._fetched_at >= JWKS_TTL:
+                try:
+                    r = await self.http.get(self.jwks_url)
+                    r.raise_for_status()
+                    self._keys = [
+                        Ed25519PublicKey.from_public_bytes(base64.urlsafe_b64decode(key["x"] + "=" * (-len(key["x"]) % 4)))
+                        for key in r.json().get("keys", [])
+                        if key.get("kty") == "OKP" and key.get("crv") == "Ed25519"
+                    ]
+                    self._fetched_at = time.time()
+                except (httpx.HTTPError, ValueError, KeyError) as e:
+                    print(f"❌ fal JWKS Error ({self.jwks_url}): {e}")
+            return self._keys
+
+    async def close(self):
+        await self.http.aclose()
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+
+# Node ids the bundled workflows use (3=Seed, 5=Dims, 6=Prompt). Templates that
+# number their nodes differently are matched by input names / class_type instead.
+PREFERRED_NODES = {"seed": "3", "dims": "5", "text": "6"}
+
+
+class WorkflowError(Exception):
+    pass
+
+
+class WorkflowTemplate:
+    """A parsed ComfyUI workflow with its injection points resolved once"""
+
+    def __init__(self, name, path, nodes, mtime):
+        self.name = name
+        self.path = path
+        self.nodes = nodes
+        self.mtime = mtime
+        self.seed_node = find_node(nodes, "seed", lambda node: "seed" in node["inputs"])
+        self.dims_node = find_node(nodes, "dims", lambda node: "width" in node["inputs"] and "height" in node["inputs"])
+        self.text_node = find_node(nodes, "text", lambda node: node["class_type"] == "CLIPTextEncode")
+        self.image_node = find_node(nodes, "image", lambda node: node["class_type"] == "LoadImage")
+
+    def validate(self, required):
+        missing = [point for point in required if getattr(self, f"{point}_node") is None]
+        if missing:
+            raise WorkflowError(f"{self.path} has no node for: {', '.join(missing)}")
+
+    def instantiate(self, seed=None, width=None, height=None, text=None, image=None):
+        """
+        Returns a structural copy: untouched nodes are shared with the template,
+        only the patched nodes get fresh dicts. Treat the result as read-only
+        apart from what is patched here.
+        """
+        workflow = dict(self.nodes)
+
+        def patch(node_id, **inputs):
+            node = workflow[node_id]
+            workflow[node_id] = {**node, "inputs": {**node["inputs"], **inputs}}
+
+        if seed is not None and self.seed_node:
+            patch(self.seed_node, seed=seed)
+        if width is not None and self.dims_node:
+            patch(self.dims_node, width=width, height=height)
+        if text is not None and self.text_node:
+            patch(self.text_node, text=text)
+        if image is not None and self.image_node:
+            patch(self.image_node, image=image)
+        return workflow
+
+
+def find_node(nodes, point, matches):
+    preferred = PREFERRED_NODES.get(point)
+    if preferred in nodes and (point != "seed" or "seed" in nodes[preferred]["inputs"]):
+        return preferred
+    for node_id, node in nodes.items():
+        if matches(node):
+            return node_id
+    return None
+
+
+def with_batch_size(workflow, size):
+    """Copy of a patched workflow whose latent batch holds `size` images (None if it has no batch_size input)"""
+    batched = dict(workflow)
+    found = False
+    for node_id, node in workflow.items():
+        if "batch_size" in node["inputs"]:
+            batched[node_id] = {**node, "inputs": {**node["inputs"], "batch_size": size}}
+            found = True
+    return batched if found else None
+
+
+def load_template(name, path):
+    mtime = os.path.getmtime(path)
+    with open(path, "r") as f:
+        nodes = json.load(f)
+    for node_id, node in nodes.items():
+        if "class_type" not in node or "inputs" not in node:
+            raise WorkflowError(f"{path}: node {node_id} is missing class_type/inputs")
+    return WorkflowTemplate(name, path, nodes, mtime)
+
+
+# --- WORKFLOW REGISTRY ---
+class WorkflowRegistry:
+    """Loads and validates workflow templates once, reloading them when the file's mtime changes"""
+
+    def __init__(self, check_interval=1.0):
+        self.check_interval = check_interval
+        self._specs = {}
+        self._templates = {}
+        self._last_check = {}
+
+    def register(self, name, path, required=()):
+        self._specs[name] = (path, tuple(required))
+
+    def load_all(self):
+        """Called at startup: a missing or incomplete template stops the app here, not mid-render"""
+        for name in self._specs:
+            self._load(name)
+            print(f"🧩 Workflow Loaded: {name} ({self._specs[name][0]})")
+
+    def get(self, name) -> WorkflowTemplate:
+        template = self._templates.get(name)
+        if template is None:
+            return self._load(name)
+
+        now = time.monotonic()
+        if now - self._last_check.get(name, 0) >= self.check_interval:
+            self._last_check[name] = now
+            try:
+                if os.path.getmtime(template.path) != template.mtime:
+                    return self._load(name)
+            except (OSError, ValueError, WorkflowError) as e:
+                # Keep serving the last good version while the file is being edited
+                print(f"❌ Workflow Reload Error ({name}): {e}")
+        return template
+
+    def _load(self, name):
+        path, required = self._specs[name]
+        try:
+            template = load_template(name, path)
+        except FileNotFoundError:
+            raise WorkflowError(f"Workflow file missing: {path}")
+        except ValueError as e:
+            raise WorkflowError(f"Workflow file is not valid JSON: {path} ({e})")
+        template.validate(required)
+        self._templates[name] = template
+        self._last_check[name] = time.monotonic()
+        return template
@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+import socket
+import threading
+from contextlib import contextmanager
+
+import pytest
+import uvicorn
+
+# Tests import the backend the way it runs: from backend/, as `services.*` and `main`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_comfy import FakeComfy, create_app as create_comfy_app  # noqa: E402
+from benchmarks.fake_fal import FakeFal, create_app  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def serve(app, port=None, timeout=15.0):
+    """Runs an ASGI app under uvicorn in a thread; yields its base URL"""
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError(f"server on port {port} did not start")
+        time.sleep(0.05)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join(timeout)
+
+
+@pytest.fixture(scope="module")
+def fake_fal():
+    """benchmarks/fake_fal.py on a free port: (base URL, FakeFal) with short renders"""
+    fake = FakeFal(latency=0.3, concurrency=1)
+    with serve(create_app(fake)) as url:
+        yield url, fake
+
+
+@pytest.fixture
+def fake_comfy():
+    """benchmarks/fake_comfy.py on a free port: (address, FakeComfy) rendering tiny images on one GPU"""
+    fake = FakeComfy(latency=0.4, image_size="8x8")
+    with serve(create_comfy_app(fake)) as url:
+        yield url.removeprefix("http://"), fake
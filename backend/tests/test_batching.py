@@ -0,0 +1,83 @@
+import asyncio
+
+from services.batching import PromptBatcher, batch_key
+from services.bridge_pool import BridgePool
+from services.providers import ComfyProvider
+from services.upload_cache import UploadCache
+
+
+def txt2img(prompt, seed=1):
+    return {
+        "3": {"class_type": "KSampler", "inputs": {"seed": seed}},
+        "5": {"class_type": "EmptyLatentImage", "inputs": {"width": 8, "height": 8, "batch_size": 1}},
+        "6": {"class_type": "CLIPTextEncode", "inputs": {"text": prompt}},
+        "9": {"class_type": "SaveImage", "inputs": {}},
+    }
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def with_pool(address, tmp_path, fn):
+    pool = BridgePool([("node", address)], UploadCache(str(tmp_path), max_bytes=1 << 20), health_interval=60)
+    await pool.start()
+    try:
+        return await fn(pool)
+    finally:
+        await pool.close()
+
+
+def test_batch_key_ignores_seeds_only():
+    assert batch_key(txt2img("a lighthouse", seed=1)) == batch_key(txt2img("a lighthouse", seed=2))
+    assert batch_key(txt2img("a lighthouse")) != batch_key(txt2img("a harbour"))
+
+
+def test_batched_prompts_fan_out_to_their_own_images(fake_comfy, tmp_path):
+    address, fake = fake_comfy
+
+    async def scenario(pool):
+        batcher = PromptBatcher(pool.submit, window=0.1, max_batch=4)
+        same = [batcher.submit(txt2img("a lighthouse", seed)) for seed in (1, 2, 3)]
+        other = batcher.submit(txt2img("a harbour"))
+        submitted = await asyncio.gather(*same, other)
+        outputs = [
+            await pool.wait({"node": submission["node"], "prompt_id": submission["prompt_id"], "batch_index": index})
+            for submission, _, index, _ in submitted
+        ]
+        return submitted, outputs
+
+    submitted, outputs = run(with_pool(address, tmp_path, scenario))
+    # One prompt of three latents for the shared text, one of its own for the other
+    assert {submission["prompt_id"] for submission, *_ in submitted[:3]} == {submitted[0][0]["prompt_id"]}
+    assert [(index, size) for _, _, index, size in submitted] == [(0, 3), (1, 3), (2, 3), (0, 1)]
+    assert submitted[0][1]["5"]["inputs"]["batch_size"] == 3
+    assert len(fake.history) == 2
+    assert len(set(outputs)) == 4
+
+
+def test_shared_prompt_is_cancelled_only_with_its_last_member(fake_comfy, tmp_path):
+    address, fake = fake_comfy
+    fake.latency = 2.0
+
+    async def build(request):
+        return txt2img(request["prompt"]), []
+
+    async def scenario(pool):
+        provider = ComfyProvider(pool, build, PromptBatcher(pool.submit, window=0.1, max_batch=2), retries=0)
+        first, second = await asyncio.gather(*(
+            provider.submit("image", {"prompt": "a lighthouse", "batchable": True}) for _ in range(2)
+        ))
+        assert first["prompt_id"] == second["prompt_id"] and first["batch_size"] == 2
+        waiting = asyncio.create_task(provider.result(second))
+        await provider.cancel(first)
+        await asyncio.sleep(0.3)
+        assert first["prompt_id"] in fake.pending
+        waiting.cancel()
+        await provider.cancel(second)
+        await asyncio.sleep(0.3)
+        return first["prompt_id"]
+
+    prompt_id = run(with_pool(address, tmp_path, scenario))
+    assert prompt_id not in fake.pending
+    assert fake.history[prompt_id]["status"]["status_str"] == "error"
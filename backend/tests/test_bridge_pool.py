@@ -0,0 +1,94 @@
+import asyncio
+from contextlib import ExitStack
+
+import pytest
+from fastapi import HTTPException
+
+from benchmarks.fake_comfy import FakeComfy, create_app
+from conftest import serve
+from services.bridge_pool import BridgePool
+from services.upload_cache import UploadCache
+
+WORKFLOW = {
+    "3": {"class_type": "KSampler", "inputs": {"seed": 1}},
+    "9": {"class_type": "SaveImage", "inputs": {}},
+}
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def nodes():
+    """Two fake ComfyUI nodes: {name: (address, FakeComfy, stop)}"""
+    with ExitStack() as stack:
+        started = {}
+        for name in ("a", "b"):
+            fake = FakeComfy(latency=0.3, image_size="8x8")
+            server = stack.enter_context(ExitStack())
+            url = server.enter_context(serve(create_app(fake)))
+            started[name] = (url.removeprefix("http://"), fake, server.close)
+        yield started
+
+
+async def with_pool(nodes, tmp_path, fn, health_interval=0.1):
+    pool = BridgePool(
+        [(name, address) for name, (address, _, _) in nodes.items()],
+        UploadCache(str(tmp_path), max_bytes=1 << 20), health_interval=health_interval,
+    )
+    await pool.start()
+    try:
+        return await fn(pool)
+    finally:
+        await pool.close()
+
+
+def test_prompts_go_to_the_node_that_will_finish_them_first(nodes, tmp_path):
+    async def scenario(pool):
+        # Node a is busy with work queued by someone else
+        busy = pool.nodes["a"].bridge
+        for _ in range(3):
+            await busy.http.post("/prompt", json={"prompt": WORKFLOW, "client_id": "someone-else"})
+        await asyncio.sleep(0.3)
+        first = await pool.submit(dict(WORKFLOW))
+        second = await pool.submit(dict(WORKFLOW))
+        return first["node"], second["node"]
+
+    # One prompt queued on b still beats three on a
+    assert run(with_pool(nodes, tmp_path, scenario)) == ("b", "b")
+
+
+def test_prompt_moves_to_another_node_when_its_node_goes_down(nodes, tmp_path):
+    nodes["a"][1].latency = nodes["b"][1].latency = 3.0
+
+    async def scenario(pool):
+        step = {"workflow": dict(WORKFLOW), "inputs": []}
+        step.update(await pool.submit(step["workflow"]))
+        dead = step["node"]
+        first_prompt = step["prompt_id"]
+        # Mid-render, its node stops answering
+        await asyncio.to_thread(nodes[dead][2])
+        filename = await asyncio.wait_for(pool.wait(step), 15.0)
+        return dead, first_prompt, step, filename, {node["name"]: node["healthy"] for node in pool.status()}
+
+    dead, first_prompt, step, filename, healthy = run(with_pool(nodes, tmp_path, scenario))
+    alive = "b" if dead == "a" else "a"
+    assert step["node"] == alive and step["prompt_id"] != first_prompt
+    assert step["prompt_id"] in nodes[alive][1].history
+    assert filename.startswith(f"ComfyUI_{step['prompt_id'][:8]}_")
+    assert healthy == {dead: False, alive: True}
+
+
+def test_no_healthy_node_refuses_the_prompt(nodes, tmp_path):
+    async def scenario(pool):
+        for _, _, stop in nodes.values():
+            await asyncio.to_thread(stop)
+        while any(node["healthy"] for node in pool.status()):
+            await asyncio.sleep(0.1)
+        with pytest.raises(HTTPException) as refused:
+            await pool.submit(dict(WORKFLOW))
+        return refused.value
+
+    refused = run(with_pool(nodes, tmp_path, scenario))
+    assert refused.status_code == 503
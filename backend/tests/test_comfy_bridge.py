@@ -0,0 +1,78 @@
+import gc
+import asyncio
+
+import pytest
+
+from benchmarks.fake_comfy import PROGRESS_STEPS
+from services.comfy_bridge import ComfyBridge, ComfyExecutionError, PromptCancelled
+
+WORKFLOW = {
+    "3": {"class_type": "KSampler", "inputs": {"seed": 1}},
+    "9": {"class_type": "SaveImage", "inputs": {}},
+}
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def with_bridge(address, fn):
+    bridge = ComfyBridge(address)
+    try:
+        return await fn(bridge)
+    finally:
+        await bridge.close()
+
+
+def test_one_socket_carries_every_prompt_to_its_own_waiter(fake_comfy):
+    address, fake = fake_comfy
+    fake.latency = 0.2
+
+    async def scenario(bridge):
+        prompt_ids = [(await bridge.queue_prompt(dict(WORKFLOW)))["prompt_id"] for _ in range(4)]
+        progress = bridge.subscribe(prompt_ids[2])
+        outputs = await asyncio.gather(*(bridge.get_output_filename(prompt_id) for prompt_id in prompt_ids))
+        events = []
+        while not progress.empty():
+            events.append(progress.get_nowait())
+        bridge.unsubscribe(prompt_ids[2], progress)
+        return prompt_ids, outputs, events, list(fake.sockets)
+
+    prompt_ids, outputs, events, sockets = run(with_bridge(address, scenario))
+    assert len(sockets) == 1
+    for prompt_id, filename in zip(prompt_ids, outputs):
+        assert filename.startswith(f"ComfyUI_{prompt_id[:8]}_")
+    # A subscriber sees its own prompt's events only
+    assert {event["data"]["prompt_id"] for event in events} == {prompt_ids[2]}
+    assert sum(1 for event in events if event["type"] == "progress") == PROGRESS_STEPS
+
+
+def test_cancelled_prompts_fail_their_waiters_and_log_nothing(fake_comfy):
+    address, fake = fake_comfy
+    fake.latency = 2.0
+    unhandled = []
+
+    async def scenario(bridge):
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unhandled.append(context["message"]))
+        running = (await bridge.queue_prompt(dict(WORKFLOW)))["prompt_id"]
+        waited = (await bridge.queue_prompt(dict(WORKFLOW)))["prompt_id"]
+        # Nobody waits on this one, like a step whose job task was cancelled first
+        unwaited = (await bridge.queue_prompt(dict(WORKFLOW)))["prompt_id"]
+        waiter = asyncio.create_task(bridge.get_output_filename(waited))
+        await asyncio.sleep(0.2)
+
+        # Still queued: dropped from the queue; rendering: interrupted
+        assert not await bridge.cancel(unwaited)
+        assert not await bridge.cancel(waited)
+        assert await bridge.cancel(running)
+        # The fake reports the drop on the socket as well; whichever lands first fails the waiter
+        with pytest.raises((PromptCancelled, ComfyExecutionError)):
+            await waiter
+        await asyncio.sleep(0.2)
+        return running
+
+    running = run(with_bridge(address, scenario))
+    gc.collect()
+    assert fake.history[running]["status"]["status_str"] == "error"
+    assert not fake.pending
+    assert unhandled == []
@@ -0,0 +1,171 @@
+import asyncio
+
+import httpx
+import pytest
+
+from services.providers import FalProvider, ProviderError
+from services.transfers import ContentTarget
+from services.storage import content_filename
+
+PNG = b"\x89PNG\r\n\x1a\n"
+
+
+@pytest.fixture(autouse=True)
+def fal_key(monkeypatch):
+    monkeypatch.setenv("FAL_KEY", "test")
+
+
+@pytest.fixture
+def source_image(tmp_path):
+    path = tmp_path / "source.png"
+    path.write_bytes(PNG + b"\x00" * 64)
+    return str(path)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def with_provider(url, fn, **options):
+    provider = FalProvider(queue_url=url, inline_inputs=True, **dict({"retries": 0}, **options))
+    try:
+        return await fn(provider)
+    finally:
+        await provider.close()
+
+
+def test_image_request_is_polled_to_completion_and_downloaded(fake_fal, tmp_path):
+    url, _ = fake_fal
+
+    async def scenario(provider):
+        ticket = await provider.submit("image", {"prompt": "a lighthouse", "aspect_ratio": "16:9", "seed": 3})
+        assert ticket["provider"] == "fal" and ticket["status_url"].endswith("/status")
+        output = await provider.result(ticket)
+        target = ContentTarget(str(tmp_path), lambda digest: content_filename("cinematic", digest, provider.extension(ticket, output)))
+        path, _, _ = await provider.download(ticket, output, target)
+        return path
+
+    path = run(with_provider(url, scenario))
+    assert path.endswith(".png")
+    with open(path, "rb") as f:
+        assert f.read(8) == PNG
+
+
+def test_video_request_sends_source_and_returns_mp4(fake_fal, source_image):
+    url, fake = fake_fal
+
+    async def scenario(provider):
+        ticket = await provider.submit("video", {"image": source_image, "prompt": "slow push in"})
+        return ticket, await provider.result(ticket)
+
+    ticket, output = run(with_provider(url, scenario))
+    assert output.endswith(f"/files/{ticket['request_id']}.mp4")
+    # inline_inputs: the source travelled as a data URL, not through fal storage
+    arguments = fake.requests[ticket["request_id"]]["arguments"]
+    assert any(str(value).startswith("data:image/png;base64,") for value in arguments.values())
+
+
+def test_resumed_ticket_without_urls_rebuilds_them(fake_fal):
+    url, _ = fake_fal
+
+    async def scenario(provider):
+        ticket = await provider.submit("image", {"prompt": "a lighthouse", "aspect_ratio": "16:9"})
+        # Tickets persisted before the queue URLs were kept only have the app and request id
+        for key in ("status_url", "response_url", "cancel_url"):
+            del ticket[key]
+        return await provider.result(ticket)
+
+    assert run(with_provider(url, scenario)).endswith(".png")
+
+
+def test_cancelled_request_fails_and_late_cancel_is_ignored(fake_fal):
+    url, fake = fake_fal
+    fake.latency = 1.5
+
+    async def scenario(provider):
+        running = await provider.submit("image", {"prompt": "first", "aspect_ratio": "16:9"})
+        queued = await provider.submit("image", {"prompt": "second", "aspect_ratio": "16:9"})
+        await provider.cancel(queued)
+        with pytest.raises(ProviderError, match="cancelled"):
+            await provider.result(queued)
+        await provider.result(running)
+        # Already completed: fal answers 400, which is not an error for us
+        await provider.cancel(running)
+
+    try:
+        run(with_provider(url, scenario))
+    finally:
+        fake.latency = 0.3
+
+
+def test_inbox_callback_wakes_waiter_before_next_poll(fake_fal, monkeypatch):
+    url, fake = fake_fal
+    fake.latency = 0.5
+    # Without the callback the first status check after submit would come 30s later
+    monkeypatch.setattr("services.providers.FIRST_STATUS_INTERVAL", 30.0)
+
+    class Inbox:
+        def __init__(self):
+            self.events = {}
+
+        async def wait(self, request_id, timeout):
+            event = self.events.setdefault(request_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+
+        async def discard(self, request_id):
+            self.events.pop(request_id, None)
+
+    inbox = Inbox()
+
+    async def scenario(provider):
+        ticket = await provider.submit("image", {"prompt": "a lighthouse", "aspect_ratio": "16:9"})
+        waiter = asyncio.create_task(provider.result(ticket))
+        while fake.requests[ticket["request_id"]]["status"] != "COMPLETED":
+            await asyncio.sleep(0.05)
+        inbox.events.setdefault(ticket["request_id"], asyncio.Event()).set()
+        return await asyncio.wait_for(waiter, 5.0)
+
+    try:
+        assert run(with_provider(url, scenario, inbox=inbox, status_interval=30.0)).endswith(".png")
+    finally:
+        fake.latency = 0.3
+
+
+def test_queue_post_is_not_retried_after_a_server_error():
+    posts = []
+
+    def handler(request):
+        posts.append(request.url.path)
+        return httpx.Response(503)
+
+    async def scenario(provider):
+        provider.http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with pytest.raises(httpx.HTTPStatusError):
+            await provider.submit("image", {"prompt": "a lighthouse", "aspect_ratio": "16:9"})
+
+    # The 503 may have come after fal queued (and billed) the render: one POST only
+    run(with_provider("http://fal.test", scenario, retries=2, backoff=0.0))
+    assert len(posts) == 1
+
+
+def test_waiting_for_a_render_does_not_hold_a_slot(fake_fal):
+    url, fake = fake_fal
+    fake.latency = 1.0
+
+    async def scenario(provider):
+        first = await provider.submit("image", {"prompt": "first", "aspect_ratio": "16:9"})
+        waiter = asyncio.create_task(provider.result(first))
+        await asyncio.sleep(0.2)
+        # concurrency=1 and the first render still going: the submit must not queue behind its wait
+        second = await asyncio.wait_for(provider.submit("image", {"prompt": "second", "aspect_ratio": "16:9"}), 0.5)
+        assert not waiter.done()
+        await asyncio.gather(waiter, provider.result(second))
+
+    try:
+        run(with_provider(url, scenario, concurrency=1))
+    finally:
+        fake.latency = 0.3
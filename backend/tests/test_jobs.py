@@ -0,0 +1,266 @@
+import asyncio
+
+import pytest
+
+from services.jobs import JobHandler, JobManager, PRIORITY_BULK, CANCELLED, FAILED, RUNNING, SUCCEEDED, init_schema
+from services.repository import Database
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Work:
+    """
+    A job kind whose payload spells out its steps: {"steps": [{"seconds": .., "fail": ..}, ..]}.
+    Records what the job manager asked of it.
+    """
+
+    def __init__(self, submit_seconds=0.0):
+        self.submit_seconds = submit_seconds
+        self.submitted = 0
+        self.finished = []
+        self.cancelled = []
+
+    async def submit(self, payload):
+        self.submitted += 1
+        await asyncio.sleep(self.submit_seconds)
+        if payload.get("refuse"):
+            raise RuntimeError(payload["refuse"])
+        return [dict(step, index=index) for index, step in enumerate(payload["steps"])]
+
+    async def finish(self, step, limit):
+        async with limit:
+            await asyncio.sleep(step.get("seconds", 0.0))
+        if step.get("fail"):
+            raise RuntimeError(step["fail"])
+        self.finished.append(step["index"])
+        return {"index": step["index"]}
+
+    async def cancel(self, step):
+        self.cancelled.append(step["index"])
+
+    def handler(self, **options):
+        return JobHandler(self.submit, self.finish, cancel=self.cancel, **options)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+
+async def manager(db_path, work, worker_id="worker-a", workers=2, lease=30.0, start=True, **options):
+    jobs = JobManager(Database(db_path), None, workers=workers, worker_id=worker_id, lease=lease)
+    jobs.register("work", work.handler(**options))
+    if start:
+        await jobs.start()
+    return jobs
+
+
+async def shutdown(*managers):
+    for jobs in managers:
+        await jobs.stop()
+        jobs.db.close()
+
+
+async def wait_until(predicate, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not await predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not reached")
+        await asyncio.sleep(0.05)
+
+
+async def status_is(jobs, job_id, status):
+    return (await jobs.get(job_id))["status"] == status
+
+
+async def steps_done(jobs, job_id, count):
+    job = await jobs.get(job_id)
+    return job["status"] == RUNNING and job["steps_done"] >= count
+
+
+def test_job_runs_its_steps_and_keeps_their_order(db_path):
+    work = Work()
+
+    async def scenario():
+        jobs = await manager(db_path, work, concurrency=3)
+        try:
+            job = await jobs.submit("work", {"steps": [{"seconds": 0.2}, {"seconds": 0.0}, {"seconds": 0.1}]})
+            events = [event async for event in jobs.events(job["id"])]
+            return events, await jobs.get(job["id"])
+        finally:
+            await shutdown(jobs)
+
+    events, job = run(scenario())
+    assert job["status"] == SUCCEEDED
+    assert job["steps_total"] == job["steps_done"] == 3
+    # Results follow step order, whichever finished first
+    assert job["result"]["items"] == [{"index": 0}, {"index": 1}, {"index": 2}]
+    assert work.finished == [1, 2, 0]
+    assert [event["index"] for event in events if event["type"] == "step"] == [1, 2, 0]
+    assert events[0]["type"] == "status" and events[-1]["job"]["status"] == SUCCEEDED
+
+
+def test_failed_steps_are_reported_and_fail_the_job_when_all_fail(db_path):
+    work = Work()
+
+    async def scenario():
+        jobs = await manager(db_path, work)
+        try:
+            partial = await jobs.submit("work", {"steps": [{"fail": "out of memory"}, {}]})
+            failed = await jobs.submit("work", {"steps": [{"fail": "out of memory"}, {"fail": "no output"}]})
+            refused = await jobs.submit("work", {"refuse": "no provider"})
+            return [await jobs.wait(job["id"]) for job in (partial, failed, refused)]
+        finally:
+            await shutdown(jobs)
+
+    partial, failed, refused = run(scenario())
+    assert partial["status"] == SUCCEEDED
+    assert partial["result"]["items"] == [{"error": "out of memory"}, {"index": 1}]
+    assert failed["status"] == FAILED and failed["error"] == "out of memory"
+    assert refused["status"] == FAILED and refused["error"] == "no provider"
+
+
+def test_stopped_worker_hands_its_job_over_without_resubmitting(db_path):
+    work = Work()
+
+    async def scenario():
+        first = await manager(db_path, work)
+        job = await first.submit("work", {"steps": [{"seconds": 0.1}, {"seconds": 1.0}]})
+        await wait_until(lambda: steps_done(first, job["id"], 1))
+        # Shutdown leaves the job running, with its steps (tickets) saved and its lease released
+        await shutdown(first)
+
+        second = await manager(db_path, work, worker_id="worker-b")
+        try:
+            return await second.wait(job["id"])
+        finally:
+            await shutdown(second)
+
+    resumed = run(scenario())
+    assert resumed["status"] == SUCCEEDED and resumed["worker"] == "worker-b"
+    assert work.submitted == 1
+    # The step that had finished is not run again
+    assert work.finished == [0, 1]
+
+
+def test_job_of_a_dead_worker_is_adopted_when_its_lease_runs_out(db_path):
+    work = Work()
+
+    async def scenario():
+        # Takes the job and never runs it or renews its lease, like a killed process
+        dead = await manager(db_path, work, worker_id="dead", workers=0, lease=0.6, start=False)
+        await dead.db.run(init_schema)
+        job = await dead.submit("work", {"steps": [{}]})
+
+        alive = await manager(db_path, work, worker_id="alive", lease=0.6)
+        try:
+            # Still leased at startup: left alone
+            assert (await alive.get(job["id"]))["worker"] == "dead"
+            await wait_until(lambda: status_is(alive, job["id"], SUCCEEDED))
+            return await alive.get(job["id"])
+        finally:
+            dead.db.close()
+            await shutdown(alive)
+
+    job = run(scenario())
+    assert job["worker"] == "alive" and job["result"]["items"] == [{"index": 0}]
+
+
+def test_cancel_stops_unfinished_steps_and_counts_only_finished_ones(db_path):
+    work = Work()
+
+    async def scenario():
+        jobs = await manager(db_path, work, concurrency=3)
+        try:
+            job = await jobs.submit("work", {"steps": [{"seconds": 0.0}, {"seconds": 5.0}, {"seconds": 5.0}]})
+            await wait_until(lambda: steps_done(jobs, job["id"], 1))
+            return await jobs.cancel(job["id"])
+        finally:
+            await shutdown(jobs)
+
+    job = run(scenario())
+    assert job["status"] == CANCELLED
+    assert work.cancelled == [1, 2]
+    assert job["steps_total"] == 3 and job["steps_done"] == 1
+
+
+def test_cancel_during_submit_cancels_what_it_queued(db_path):
+    work = Work(submit_seconds=0.5)
+
+    async def scenario():
+        jobs = await manager(db_path, work)
+        try:
+            job = await jobs.submit("work", {"steps": [{"seconds": 5.0}, {"seconds": 5.0}]})
+            await wait_until(lambda: status_is(jobs, job["id"], RUNNING))
+            return await jobs.cancel(job["id"])
+        finally:
+            await shutdown(jobs)
+
+    job = run(scenario())
+    assert job["status"] == CANCELLED and job["steps_total"] == 2 and job["steps_done"] == 0
+    assert work.cancelled == [0, 1]
+
+
+def test_queued_job_is_cancelled_before_it_runs(db_path):
+    work = Work()
+
+    async def scenario():
+        jobs = await manager(db_path, work, workers=1)
+        try:
+            busy = await jobs.submit("work", {"steps": [{"seconds": 0.5}]})
+            queued = await jobs.submit("work", {"steps": [{}]})
+            cancelled = await jobs.cancel(queued["id"])
+            await jobs.wait(busy["id"])
+            await asyncio.sleep(0.1)
+            return cancelled, await jobs.get(queued["id"])
+        finally:
+            await shutdown(jobs)
+
+    cancelled, queued = run(scenario())
+    assert cancelled["status"] == queued["status"] == CANCELLED
+    assert work.submitted == 1 and work.finished == [0]
+
+
+def test_cancel_reaches_a_job_run_by_another_worker(db_path):
+    work = Work()
+
+    async def scenario():
+        owner = await manager(db_path, work, worker_id="owner", lease=0.6)
+        other = await manager(db_path, work, worker_id="other", lease=0.6)
+        try:
+            job = await owner.submit("work", {"steps": [{"seconds": 10.0}]})
+            await wait_until(lambda: status_is(owner, job["id"], RUNNING))
+            # Asked through the database; the owner acts on it at its next lease renewal
+            return await other.cancel(job["id"])
+        finally:
+            await shutdown(owner, other)
+
+    job = run(scenario())
+    assert job["status"] == CANCELLED and job["worker"] == "owner"
+    assert work.cancelled == [0]
+
+
+def test_interactive_jobs_run_ahead_of_queued_bulk_work(db_path):
+    work = Work()
+    order = []
+
+    async def scenario():
+        jobs = await manager(db_path, work, workers=1, start=False)
+        jobs.register("bulk", work.handler(priority=PRIORITY_BULK))
+        await jobs.start()
+        try:
+            blocker = await jobs.submit("work", {"steps": [{"seconds": 0.3}]})
+            bulk = await jobs.submit("bulk", {"steps": [{}]})
+            interactive = await jobs.submit("work", {"steps": [{}]})
+            assert [job["id"] for job in await jobs.active()][1:] == [interactive["id"], bulk["id"]]
+            for job in (blocker, bulk, interactive):
+                order.append((job["id"], (await jobs.wait(job["id"]))["updated_at"]))
+            return interactive["id"], bulk["id"]
+        finally:
+            await shutdown(jobs)
+
+    interactive, bulk = run(scenario())
+    finished = dict(order)
+    assert finished[interactive] < finished[bulk]
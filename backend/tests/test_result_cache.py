@@ -0,0 +1,117 @@
+import gc
+import asyncio
+
+import pytest
+
+from services.repository import ContentRepository, Database, init_schema as init_content_schema
+from services.result_cache import ResultCache, result_key, init_schema
+
+WORKFLOW = {
+    "3": {"class_type": "KSampler", "inputs": {"seed": 1}},
+    "9": {"class_type": "SaveImage", "inputs": {}},
+}
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def with_cache(tmp_path, fn):
+    db = Database(str(tmp_path / "cache.db"))
+    await db.run(init_content_schema)
+    await db.run(init_schema)
+    try:
+        return await fn(ResultCache(db), ContentRepository(db))
+    finally:
+        db.close()
+
+
+def test_key_covers_workflow_provider_and_strength():
+    key = result_key(WORKFLOW, "comfyui")
+    # Key order in the workflow does not matter
+    assert key == result_key(dict(reversed(list(WORKFLOW.items()))), "comfyui")
+    assert key != result_key(WORKFLOW, "fal")
+    assert key != result_key(WORKFLOW, "comfyui", 0.5)
+    assert key != result_key({**WORKFLOW, "3": {"class_type": "KSampler", "inputs": {"seed": 2}}}, "comfyui")
+
+
+def test_finished_render_is_found_until_forgotten(tmp_path):
+    key = result_key(WORKFLOW, "comfyui")
+
+    async def scenario(cache, content):
+        assert await cache.lookup(key) is None
+        content_id = await content.insert_many([{"type": "image", "url": "http://127.0.0.1:8000/generated/a.png"}])
+        await cache.store(key, content_id[0])
+        found = await cache.lookup(key)
+        await cache.forget(key)
+        return content_id[0], found, await cache.lookup(key)
+
+    content_id, found, forgotten = run(with_cache(tmp_path, scenario))
+    assert found["id"] == content_id and found["url"].endswith("/generated/a.png")
+    assert forgotten is None
+
+
+def test_duplicates_wait_for_the_render_in_flight(tmp_path):
+    key = result_key(WORKFLOW, "comfyui")
+
+    async def scenario(cache, _):
+        assert await cache.follow(key) is None
+        leader = cache.claim(key)
+        # A second claim joins the same render instead of starting another
+        assert cache.claim(key) is leader and cache.in_flight(key)
+        followers = [asyncio.create_task(cache.follow(key)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        assert not any(follower.done() for follower in followers)
+        cache.resolve(key, {"id": 1, "url": "a.png"})
+        return await asyncio.gather(*followers), cache.in_flight(key)
+
+    results, in_flight = run(with_cache(tmp_path, scenario))
+    assert results == [{"id": 1, "url": "a.png"}] * 3
+    assert not in_flight
+
+
+def test_followers_render_themselves_when_the_leader_is_abandoned(tmp_path):
+    key = result_key(WORKFLOW, "comfyui")
+
+    async def scenario(cache, _):
+        cache.claim(key)
+        follower = asyncio.create_task(cache.follow(key))
+        await asyncio.sleep(0)
+        cache.abandon(key)
+        return await follower, cache.in_flight(key)
+
+    assert run(with_cache(tmp_path, scenario)) == (None, False)
+
+
+def test_failed_render_fails_its_followers_and_logs_nothing_without_them(tmp_path):
+    key = result_key(WORKFLOW, "comfyui")
+    unhandled = []
+
+    async def scenario(cache, _):
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unhandled.append(context["message"]))
+        cache.claim(key)
+        follower = asyncio.create_task(cache.follow(key))
+        await asyncio.sleep(0)
+        cache.reject(key, RuntimeError("out of memory"))
+        with pytest.raises(RuntimeError, match="out of memory"):
+            await follower
+
+        # A follower that gave up does not cancel the render for the others
+        cache.claim(key)
+        gone = asyncio.create_task(cache.follow(key))
+        staying = asyncio.create_task(cache.follow(key))
+        await asyncio.sleep(0)
+        gone.cancel()
+        await asyncio.sleep(0)
+        assert cache.in_flight(key)
+        cache.resolve(key, {"id": 2})
+        assert await staying == {"id": 2}
+
+        # Nobody followed this one
+        cache.claim(key)
+        cache.reject(key, RuntimeError("no output"))
+        return cache.in_flight(key)
+
+    assert run(with_cache(tmp_path, scenario)) is False
+    gc.collect()
+    assert unhandled == []
@@ -0,0 +1,161 @@
+import os
+import asyncio
+
+from services.repository import ContentRepository, Database
+from services.result_cache import ResultCache
+from services.storage_gc import (
+    DERIVATIVE, EXPIRED_PROXY, MIN_ORPHANS_HELD, ORPHAN, QUOTA, RetentionPolicy, StorageGC, plan,
+)
+
+NOW = 1_000_000.0
+DAY = 86400.0
+
+
+def row(id, name, directory="generated", favorite=False, proxy=False, parent=None, age=DAY):
+    return {
+        "id": id, "url": f"http://127.0.0.1:8000/{directory}/{name}", "is_favorite": int(favorite),
+        "is_proxy": int(proxy), "parent_id": parent, "created_at": NOW - age,
+    }
+
+
+def test_uploads_needed_by_unfinished_jobs_survive_the_quota():
+    files = {"generated": {}, "uploads": {
+        "ref_old.png": (100, NOW - 3 * DAY),
+        "ref_needed.png": (100, NOW - 2 * DAY),
+        "ref_new.png": (100, NOW - DAY),
+    }}
+    policy = RetentionPolicy(quotas={"uploads": 150}, grace=60)
+
+    _, removals, _ = plan([], files, {}, policy, NOW)
+    assert set(removals) == {("uploads", "ref_old.png"), ("uploads", "ref_needed.png")}
+
+    # A queued job still has to upload ref_needed.png to a node: the next least recently used goes instead
+    _, removals, notes = plan([], files, {}, policy, NOW, in_use={"ref_needed.png"})
+    assert removals == {("uploads", "ref_old.png"): (100, QUOTA), ("uploads", "ref_new.png"): (100, QUOTA)}
+    assert notes["over_quota"] == []
+
+    # Nothing else to give up: the directory stays over its quota
+    _, removals, notes = plan([], files, {}, policy, NOW, in_use={"ref_needed.png", "ref_new.png"})
+    assert set(removals) == {("uploads", "ref_old.png")}
+    assert notes["over_quota"] == ["uploads"]
+
+
+def test_expired_proxy_used_as_a_source_is_kept():
+    rows = [row(1, "parent.png"), row(2, "proxy.png", proxy=True, parent=1, age=40 * DAY)]
+    files = {"generated": {"parent.png": (10, NOW - DAY), "proxy.png": (10, NOW - 40 * DAY)}, "uploads": {}}
+    policy = RetentionPolicy(proxy_retention=30 * DAY, grace=60)
+
+    doomed, removals, _ = plan(rows, files, {}, policy, NOW)
+    assert doomed == {2: (EXPIRED_PROXY, ("generated", "proxy.png"))}
+    assert removals == {("generated", "proxy.png"): (10, EXPIRED_PROXY)}
+
+    # An unfinished video job renders from it
+    doomed, removals, _ = plan(rows, files, {}, policy, NOW, in_use={"proxy.png"})
+    assert doomed == {} and removals == {}
+
+
+def test_unreferenced_and_partial_files_go_once_idle():
+    rows = [row(1, "kept.png")]
+    files = {"generated": {
+        "kept.png": (10, NOW - DAY),
+        "orphan.png": (10, NOW - DAY),
+        "just_written.png": (10, NOW - 10),
+        ".x.png.part": (10, NOW - DAY),
+    }, "uploads": {"ref.png": (10, NOW - DAY), ".y.png.part": (10, NOW - DAY)}}
+    policy = RetentionPolicy(grace=60)
+
+    doomed, removals, _ = plan(rows, files, {}, policy, NOW)
+    assert doomed == {}
+    # uploads/ is a library of its own: only its stale temp files are orphans
+    assert removals == {
+        ("generated", "orphan.png"): (10, ORPHAN),
+        ("generated", ".x.png.part"): (10, ORPHAN),
+        ("uploads", ".y.png.part"): (10, ORPHAN),
+    }
+
+
+def test_mostly_unreferenced_directory_is_held_as_a_wrong_database():
+    count = MIN_ORPHANS_HELD + 2
+    files = {"generated": {f"{i}.png": (10, NOW - DAY) for i in range(count)}, "uploads": {}}
+
+    _, removals, notes = plan([row(0, "0.png")], files, {}, RetentionPolicy(grace=60), NOW)
+    assert removals == {} and notes["orphans_held"] == count - 1
+
+
+def test_quota_takes_least_recently_used_first_and_never_a_favorite():
+    rows = [row(1, "old_favorite.png", favorite=True), row(2, "old.png"), row(3, "new.png")]
+    files = {"generated": {
+        "old_favorite.png": (100, NOW - 3 * DAY),
+        "old.png": (100, NOW - 2 * DAY),
+        "new.png": (100, NOW - DAY),
+    }, "uploads": {}}
+    policy = RetentionPolicy(quotas={"generated": 200}, grace=60)
+
+    doomed, removals, notes = plan(rows, files, {}, policy, NOW)
+    assert doomed == {2: (QUOTA, ("generated", "old.png"))}
+    assert removals == {("generated", "old.png"): (100, QUOTA)}
+    assert notes["over_quota"] == []
+
+    # Only favorites left to give up: over quota it stays
+    policy = RetentionPolicy(quotas={"generated": 50}, grace=60)
+    _, removals, notes = plan(rows, files, {}, policy, NOW)
+    assert ("generated", "old_favorite.png") not in removals
+    assert notes["over_quota"] == ["generated"]
+
+
+def test_derivatives_follow_their_source():
+    rows = [row(1, "kept.png")]
+    files = {"generated": {"kept.png": (10, NOW - DAY), "orphan.png": (10, NOW - DAY)}, "uploads": {}}
+    derivatives = {
+        "generated/thumb/kept.webp": (1, NOW - DAY),
+        "generated/thumb/orphan.webp": (1, NOW),
+        "generated/thumb/gone.webp": (1, NOW - DAY),
+        "generated/thumb/rendering.webp": (1, NOW),
+    }
+
+    _, removals, _ = plan(rows, files, derivatives, RetentionPolicy(grace=60), NOW)
+    # Going with its source however fresh; a source never seen only once idle (it may still be rendering)
+    assert {key: reason for key, (_, reason) in removals.items() if key[0] == "derivatives"} == {
+        ("derivatives", "generated/thumb/orphan.webp"): DERIVATIVE,
+        ("derivatives", "generated/thumb/gone.webp"): DERIVATIVE,
+    }
+
+
+def test_dry_run_reports_the_pass_without_touching_anything(tmp_path):
+    generated, uploads, derivatives = (tmp_path / name for name in ("generated", "uploads", "derivatives"))
+    for directory in (generated, uploads, derivatives / "generated" / "thumb"):
+        directory.mkdir(parents=True)
+    old = NOW - DAY
+    for path in (generated / "kept.png", generated / "orphan.png", derivatives / "generated" / "thumb" / "orphan.webp"):
+        path.write_bytes(b"x" * 10)
+        os.utime(path, (old, old))
+
+    async def scenario():
+        db = Database(str(tmp_path / "gc.db"))
+        gc = StorageGC(
+            db, {"generated": str(generated), "uploads": str(uploads)}, str(derivatives),
+            RetentionPolicy(grace=60), interval=0,
+        )
+        try:
+            await gc.start()
+            kept = {"type": "image", "url": "http://127.0.0.1:8000/generated/kept.png"}
+            content_id, = await ContentRepository(db).insert_many([kept])
+            await ResultCache(db).store("key", content_id)
+            dry = await gc.collect(dry_run=True)
+            left = sorted(os.listdir(generated))
+            real = await gc.collect()
+            return dry, left, real, await gc.last_run(), await ResultCache(db).lookup("key")
+        finally:
+            db.close()
+
+    dry, left_by_dry_run, real, (last_run, last_report), cached = asyncio.run(scenario())
+    assert dry["dry_run"] and not real["dry_run"]
+    assert left_by_dry_run == ["kept.png", "orphan.png"]
+    for report in (dry, real):
+        assert report["removed"][ORPHAN] == {"rows": 0, "files": 1, "bytes": 10}
+        assert report["removed"][DERIVATIVE] == {"rows": 0, "files": 1, "bytes": 10}
+    assert sorted(os.listdir(generated)) == ["kept.png"]
+    assert os.listdir(derivatives / "generated" / "thumb") == []
+    # Only a real pass counts as the last run
+    assert last_run > 0 and last_report["dry_run"] is False
+    assert cached["url"].endswith("/kept.png")
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from services.transfers import drain, tee_queue, write_stream, TEE_DEPTH
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def chunks(count, fail=None):
+    for index in range(count):
+        yield b"x" * 16
+    if fail:
+        raise fail
+
+
+def test_sink_receives_every_chunk_then_the_end(tmp_path):
+    async def scenario():
+        sink = tee_queue()
+        received = []
+
+        async def read():
+            async for chunk in drain(sink):
+                received.append(chunk)
+
+        reader = asyncio.create_task(read())
+        _, size, _ = await write_stream(chunks(TEE_DEPTH * 2), str(tmp_path / "out.bin"), sinks=(sink,))
+        await reader
+        return size, received
+
+    size, received = run(scenario())
+    assert size == 16 * TEE_DEPTH * 2 and b"".join(received) == b"x" * size
+
+
+def test_full_sink_still_gets_the_download_error(tmp_path):
+    async def scenario():
+        sink = tee_queue()
+        # Nobody reads the sink: it fills up, then the source fails
+        writing = asyncio.create_task(write_stream(chunks(TEE_DEPTH, fail=ConnectionError("node went away")), str(tmp_path / "out.bin"), sinks=(sink,)))
+        with pytest.raises(ConnectionError):
+            await writing
+        assert sink.full()
+        with pytest.raises(ConnectionError, match="node went away"):
+            async for _ in drain(sink):
+                pass
+
+    run(scenario())
+    assert list(tmp_path.iterdir()) == []
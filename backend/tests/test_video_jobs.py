@@ -0,0 +1,155 @@
+"""
+Image-to-video through the whole backend: main's app under uvicorn, fal
+replaced by benchmarks/fake_fal.py. Status polls are pushed out to 30s, so
+jobs finishing within seconds were woken by fal's (signed) webhook.
+"""
+import os
+import json
+import time
+import shutil
+import importlib
+
+import httpx
+import pytest
+
+from conftest import free_port, serve
+
+# Minimal ComfyUI templates: startup refuses to run without them (ComfyUI itself is never reached here)
+WORKFLOWS = {
+    "workflow_txt2img.json": {
+        "3": {"class_type": "KSampler", "inputs": {"seed": 1}},
+        "5": {"class_type": "EmptyLatentImage", "inputs": {"width": 1, "height": 1, "batch_size": 1}},
+        "6": {"class_type": "CLIPTextEncode", "inputs": {"text": ""}},
+        "9": {"class_type": "SaveImage", "inputs": {}},
+    },
+    "workflow_multishot.json": {
+        "3": {"class_type": "KSampler", "inputs": {"seed": 1}},
+        "6": {"class_type": "CLIPTextEncode", "inputs": {"text": ""}},
+        "10": {"class_type": "LoadImage", "inputs": {"image": ""}},
+        "9": {"class_type": "SaveImage", "inputs": {}},
+    },
+}
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not on PATH")
+
+
+@pytest.fixture(scope="module")
+def backend(fake_fal, tmp_path_factory):
+    fal_url, fake = fake_fal
+    root = tmp_path_factory.mktemp("library")
+    for name, workflow in WORKFLOWS.items():
+        (root / name).write_text(json.dumps(workflow))
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(root)
+        for key, value in {
+            "STORAGE_ROOT": str(root),
+            "PUBLIC_BASE_URL": base_url,
+            "COMFYUI_ADDRESS": f"127.0.0.1:{free_port()}",
+            "FAL_KEY": "test",
+            "FAL_QUEUE_URL": fal_url,
+            "FAL_INLINE_INPUTS": "true",
+            "FAL_WEBHOOK_URL": f"{base_url}/webhooks/fal",
+            "FAL_JWKS_URL": f"{fal_url}/.well-known/jwks.json",
+            "FAL_STATUS_INTERVAL": "30",
+            "GC_INTERVAL": "0",
+        }.items():
+            mp.setenv(key, value)
+        mp.setattr("services.providers.FIRST_STATUS_INTERVAL", 30.0)
+        main = importlib.import_module("main")
+        with serve(main.app, port):
+            with httpx.Client(base_url=base_url, timeout=30.0) as client:
+                yield client, main, fake
+
+
+def wait_for_job(client, job_id, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("succeeded", "failed", "cancelled"):
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"job {job_id} still {job['status']} after {timeout}s (webhook never woke it?)")
+
+
+@pytest.fixture(scope="module")
+def source_image(backend):
+    client, _, _ = backend
+    r = client.post("/generate-image", json={
+        "prompt": "a lighthouse at dusk", "camera": "ARRI Alexa 35", "lens": "Canon K-35", "focal_length": "35mm",
+        "provider": "fal", "seed": 5,
+    })
+    assert r.status_code == 200, r.text
+    item = next(item for item in client.get("/history", params={"type": "image"}).json() if item["url"] == r.json()["image_url"])
+    return item["id"]
+
+
+@pytest.fixture(scope="module")
+def video_job(backend, source_image):
+    client, _, _ = backend
+    r = client.post("/jobs/generate-video", json={"source_image_id": source_image, "prompt": "slow push in", "zoom": 0.5})
+    assert r.status_code == 202, r.text
+    started = time.monotonic()
+    job = wait_for_job(client, r.json()["id"])
+    return job, time.monotonic() - started
+
+
+def test_video_job_is_woken_by_webhook(backend, video_job):
+    _, _, fake = backend
+    job, seconds = video_job
+    assert job["status"] == "succeeded", job["error"]
+    assert seconds < 15.0
+    (item,) = job["result"]["items"]
+    request = next(r for r in fake.requests.values() if "video" in r["application"])
+    assert request["webhook"].endswith("/webhooks/fal")
+
+
+def test_video_row_is_stored_under_its_source(backend, source_image, video_job):
+    client, main, _ = backend
+    job, _ = video_job
+    (item,) = job["result"]["items"]
+    filename = os.path.basename(item["url"])
+    assert filename.startswith("video_") and filename.endswith(".mp4")
+    assert os.path.exists(os.path.join(main.GENERATED_DIR, filename))
+
+    (row,) = [row for row in client.get("/history", params={"type": "video"}).json() if row["id"] == item["id"]]
+    assert row["parent_id"] == source_image
+    assert row["prompt"] == "slow push in"
+
+
+@needs_ffmpeg
+def test_video_poster_and_preview_are_generated(backend, video_job):
+    client, _, _ = backend
+    job, _ = video_job
+    filename = os.path.basename(job["result"]["items"][0]["url"])
+
+    poster = client.get(f"/videos/{filename}/poster")
+    assert poster.status_code == 200 and poster.headers["content-type"] == "image/jpeg"
+    preview = client.get(f"/videos/{filename}/preview")
+    assert preview.status_code == 200 and preview.headers["content-type"] == "video/mp4"
+    assert preview.content[4:8] == b"ftyp"
+
+    (row,) = [row for row in client.get("/history", params={"type": "video"}).json() if row["url"].endswith(filename)]
+    assert row["poster_url"].endswith(f"/videos/{filename}/poster")
+
+
+def test_unsigned_and_unknown_callbacks_do_not_reach_the_inbox(backend):
+    client, _, fake = backend
+    body = json.dumps({"request_id": "not-ours", "status": "OK"}).encode()
+    assert client.post("/webhooks/fal", content=body, headers={"content-type": "application/json"}).status_code == 401
+
+    r = client.post("/webhooks/fal", content=body, headers=fake.signed_headers("not-ours", body))
+    assert r.status_code == 200 and r.json() == {"status": "ignored"}
+
+
+def test_unknown_or_unsuitable_provider_is_refused_before_queueing(backend, source_image):
+    client, _, _ = backend
+    r = client.post("/generate-image", json={
+        "prompt": "x", "camera": "c", "lens": "l", "focal_length": "f", "provider": "nope",
+    })
+    assert r.status_code == 422
+    r = client.post("/jobs/generate-video", json={"source_image_id": source_image, "prompt": "x", "provider": "comfyui"})
+    assert r.status_code == 400 and r.json()["detail"] == "Provider comfyui cannot generate video"
+    assert not client.get("/jobs", params={"kind": "video"}).json()
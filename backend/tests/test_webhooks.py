@@ -0,0 +1,83 @@
+import json
+import asyncio
+
+import pytest
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+from benchmarks.fake_fal import FakeFal
+from services.repository import Database
+from services.webhooks import FalWebhookVerifier, WebhookInbox
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def verify(jwks_url, headers, body):
+    verifier = FalWebhookVerifier(jwks_url)
+    try:
+        return await verifier.verify(headers, body)
+    finally:
+        await verifier.close()
+
+
+def signed(fake, request_id="req-1", status="OK"):
+    body = json.dumps({"request_id": request_id, "status": status}).encode()
+    return fake.signed_headers(request_id, body), body
+
+
+def test_signature_from_published_key_is_accepted(fake_fal):
+    url, fake = fake_fal
+    headers, body = signed(fake)
+    assert run(verify(f"{url}/.well-known/jwks.json", headers, body))
+
+
+def test_tampered_body_is_refused(fake_fal):
+    url, fake = fake_fal
+    headers, _ = signed(fake)
+    _, other = signed(fake, request_id="req-2")
+    assert not run(verify(f"{url}/.well-known/jwks.json", headers, other))
+
+
+def test_signature_from_unknown_key_is_refused(fake_fal):
+    url, _ = fake_fal
+    forger = FakeFal()
+    forger.signing_key = Ed25519PrivateKey.generate()
+    headers, body = signed(forger)
+    assert not run(verify(f"{url}/.well-known/jwks.json", headers, body))
+
+
+@pytest.mark.parametrize("header, value", [
+    ("x-fal-webhook-timestamp", "1000000000"),
+    ("x-fal-webhook-timestamp", "soon"),
+    ("x-fal-webhook-signature", "not-hex"),
+    ("x-fal-webhook-user-id", ""),
+])
+def test_stale_or_malformed_headers_are_refused(fake_fal, header, value):
+    url, fake = fake_fal
+    headers, body = signed(fake)
+    headers[header] = value
+    assert not run(verify(f"{url}/.well-known/jwks.json", headers, body))
+
+
+def test_inbox_wakes_waiter_in_another_worker(tmp_path):
+    path = str(tmp_path / "inbox.db")
+
+    async def scenario():
+        # Two workers on one database: fal may call back the one that is not waiting
+        databases = Database(path), Database(path)
+        waiting, receiving = WebhookInbox(databases[0], poll_interval=0.1), WebhookInbox(databases[1])
+        try:
+            await waiting.start()
+            assert not await waiting.wait("req-1", 0.2)
+            waiter = asyncio.create_task(waiting.wait("req-1", 5.0))
+            await asyncio.sleep(0.2)
+            await receiving.deliver("req-1", "OK")
+            assert await asyncio.wait_for(waiter, 2.0)
+            await waiting.discard("req-1")
+            assert not await waiting.wait("req-1", 0.2)
+        finally:
+            for db in databases:
+                db.close()
+
+    run(scenario())
@@ -18,11 +18,13 @@ import { clsx, type ClassValue } from "clsx";
 import { twMerge } from "tailwind-merge";
 import { toast } from "sonner";
 import { CAMERAS, LENSES, FOCAL_LENGTHS, MOVEMENTS } from "@/lib/constants";
+import { usePagedList } from "@/lib/usePagedList";
 import { GearModal } from "@/components/GearModal";
 import { MovementsModal } from "@/components/MovementsModal";
 import { SourceModal } from "@/components/SourceModal";
 import { ResultSidebar } from "@/components/ResultSidebar";
 import { GalleryGrid } from "@/components/GalleryGrid";
+import { LoadMore } from "@/components/LoadMore";
 import { DeleteModal } from "@/components/DeleteModal";
 import { MultishotModal } from "@/components/MultishotModal";
 import { MultishotConfirmModal } from "@/components/MultishotConfirmModal"; // <--- NEW IMPORT
@@ -33,6 +35,12 @@ function cn(...inputs: ClassValue[]) {
 
 const ASPECT_RATIOS = ["21:9", "16:9", "4:3", "1:1", "9:16"];
 
+// Identifies this tab to the backend, so a new multishot replaces one still rendering
+const CLIENT_ID =
+  typeof crypto !== "undefined" && "randomUUID" in crypto
+    ? crypto.randomUUID()
+    : Math.random().toString(36).slice(2);
+
 export default function CinemaStudioPage() {
   // --- STATE ---
   const [activeTab, setActiveTab] = useState<"image" | "video">("image");
@@ -44,8 +52,19 @@ export default function CinemaStudioPage() {
   const [galleryFilter, setGalleryFilter] = useState<"image" | "video">(
     "image"
   );
-  const [history, setHistory] = useState<any[]>([]);
-  const [uploads, setUploads] = useState<any[]>([]);
+  const {
+    items: history,
+    setItems: setHistory,
+    hasMore: hasMoreHistory,
+    refresh: refreshHistory,
+    loadMore: loadMoreHistory,
+  } = usePagedList<any>("http://127.0.0.1:8000/history?include_proxies=true");
+  const {
+    items: uploads,
+    hasMore: hasMoreUploads,
+    refresh: refreshUploads,
+    loadMore: loadMoreUploads,
+  } = usePagedList<any>("http://127.0.0.1:8000/uploads");
   const [referenceImages, setReferenceImages] = useState<string[]>([]);
   const [imageStrength, setImageStrength] = useState(0.75);
   const [aspectRatio, setAspectRatio] = useState("21:9"); // <--- NEW STATE
@@ -82,10 +101,7 @@ export default function CinemaStudioPage() {
 
   const fetchData = async () => {
     try {
-      const historyRes = await fetch("http://127.0.0.1:8000/history");
-      const uploadsRes = await fetch("http://127.0.0.1:8000/uploads");
-      setHistory(await historyRes.json());
-      setUploads(await uploadsRes.json());
+      await Promise.all([refreshHistory(), refreshUploads()]);
     } catch (e) {
       console.error("Data fetch failed", e);
     }
@@ -228,7 +244,7 @@ export default function CinemaStudioPage() {
 
       const res = await fetch(`http://127.0.0.1:8000${endpoint}`, {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", "X-Client-Id": CLIENT_ID },
         body: JSON.stringify(payload),
       });
       const data = await res.json();
@@ -264,26 +280,19 @@ export default function CinemaStudioPage() {
           return;
         }
 
-        try {
-          const res = await fetch(`http://127.0.0.1:8000/proxies/${item.id}`);
-          const data = await res.json();
-
-          if (data && data.length > 0) {
-            setMultishotSourceId(item.id);
-            setIsMultishotModalOpen(true);
-            toast.success("Opening storyboard...");
-          } else {
-            toast("No storyboard found.", {
-              description: "Click 'Multishot' to create one.",
-              action: {
-                label: "Generate",
-                onClick: () => handleAction(e, "multishot", item),
-              },
-            });
-          }
-        } catch (err) {
-          console.error(err);
-          toast.error("Failed to load storyboard.");
+        // /history embeds proxy counts, so no per-item request is needed
+        if (item.proxy_count > 0) {
+          setMultishotSourceId(item.id);
+          setIsMultishotModalOpen(true);
+          toast.success("Opening storyboard...");
+        } else {
+          toast("No storyboard found.", {
+            description: "Click 'Multishot' to create one.",
+            action: {
+              label: "Generate",
+              onClick: () => handleAction(e, "multishot", item),
+            },
+          });
         }
         break;
 
@@ -382,13 +391,14 @@ export default function CinemaStudioPage() {
     try {
       const res = await fetch("http://127.0.0.1:8000/generate-multishot", {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", "X-Client-Id": CLIENT_ID },
         body: JSON.stringify({ source_image_id: itemForMultishot.id }),
       });
       const data = await res.json();
 
       if (data.status === "success" && data.proxy_ids.length > 0) {
         toast.success("Angles generated!", { id: msToastId });
+        fetchData();
         setMultishotSourceId(itemForMultishot.id);
         setIsMultishotModalOpen(true);
       } else {
@@ -480,6 +490,7 @@ export default function CinemaStudioPage() {
             onSelect={selectFromGallery}
             onAction={handleAction}
           />
+          <LoadMore hasMore={hasMoreHistory} onLoadMore={loadMoreHistory} />
           <div className="fixed bottom-0 left-0 right-0 h-48 bg-gradient-to-t from-black via-black/90 to-transparent pointer-events-none z-10"></div>
         </div>
       )}
@@ -755,7 +766,11 @@ export default function CinemaStudioPage() {
         onClose={() => setIsSourceModalOpen(false)}
         onNewUpload={handleNewUpload}
         history={history}
+        hasMoreHistory={hasMoreHistory}
+        onLoadMoreHistory={loadMoreHistory}
         uploads={uploads}
+        hasMoreUploads={hasMoreUploads}
+        onLoadMoreUploads={loadMoreUploads}
         onSelectReference={handleSelectReference}
       />
       <MovementsModal
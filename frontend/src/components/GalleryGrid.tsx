@@ -36,7 +36,9 @@ export function GalleryGrid({ items, onSelect, onAction }: GalleryGridProps) {
           {item.type === "video" ? (
             <div className="w-full h-full relative">
               <video
-                src={item.url}
+                src={item.preview_url ?? item.url}
+                poster={item.poster_url}
+                preload={item.poster_url ? "none" : "metadata"}
                 className="w-full h-full object-cover opacity-60 group-hover:opacity-100 transition-opacity duration-500"
                 muted
               />
@@ -46,7 +48,8 @@ export function GalleryGrid({ items, onSelect, onAction }: GalleryGridProps) {
             </div>
           ) : (
             <img
-              src={item.url}
+              src={item.thumb_url ?? item.url}
+              loading="lazy"
               className="w-full h-full object-cover opacity-60 group-hover:opacity-100 transition-opacity duration-500"
             />
           )}
@@ -0,0 +1,33 @@
+import { useEffect, useRef } from "react";
+import { Loader2 } from "lucide-react";
+
+interface LoadMoreProps {
+  hasMore: boolean;
+  onLoadMore: () => void;
+}
+
+// Placed after a paged list: asks for the next page while the end of the list is in view
+export function LoadMore({ hasMore, onLoadMore }: LoadMoreProps) {
+  const ref = useRef<HTMLDivElement>(null);
+
+  useEffect(() => {
+    const el = ref.current;
+    if (!hasMore || !el) return;
+    // Re-created after every page, so a list still too short to scroll keeps loading
+    const observer = new IntersectionObserver(
+      (entries) => {
+        if (entries.some((entry) => entry.isIntersecting)) onLoadMore();
+      },
+      { rootMargin: "400px" }
+    );
+    observer.observe(el);
+    return () => observer.disconnect();
+  }, [hasMore, onLoadMore]);
+
+  if (!hasMore) return null;
+  return (
+    <div ref={ref} className="flex justify-center py-6 text-zinc-600">
+      <Loader2 size={18} className="animate-spin" />
+    </div>
+  );
+}
@@ -2,6 +2,7 @@ import { useState, useRef } from "react";
 import { X, UploadCloud, Library, History, Plus } from "lucide-react";
 import { type ClassValue, clsx } from "clsx";
 import { twMerge } from "tailwind-merge";
+import { LoadMore } from "@/components/LoadMore";
 function cn(...inputs: ClassValue[]) {
   return twMerge(clsx(inputs));
 }
@@ -11,7 +12,11 @@ export function SourceModal({
   onClose,
   onNewUpload,
   history,
+  hasMoreHistory,
+  onLoadMoreHistory,
   uploads,
+  hasMoreUploads,
+  onLoadMoreUploads,
   onSelectReference,
 }: any) {
   const [activeTab, setActiveTab] = useState<"new" | "uploads" | "generated">(
@@ -107,6 +112,12 @@ export function SourceModal({
               ))}
             </div>
           )}
+          {activeTab === "uploads" && (
+            <LoadMore hasMore={hasMoreUploads} onLoadMore={onLoadMoreUploads} />
+          )}
+          {activeTab === "generated" && (
+            <LoadMore hasMore={hasMoreHistory} onLoadMore={onLoadMoreHistory} />
+          )}
         </div>
       </div>
     </div>
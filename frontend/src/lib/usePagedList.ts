@@ -0,0 +1,73 @@
+// src/lib/usePagedList.ts
+
+import { useCallback, useRef, useState } from "react";
+
+type PagedState<T> = { items: T[]; cursor: string | null };
+
+async function fetchPage<T>(url: string, cursor: string | null) {
+  const target = cursor
+    ? `${url}${url.includes("?") ? "&" : "?"}cursor=${encodeURIComponent(cursor)}`
+    : url;
+  const res = await fetch(target);
+  if (!res.ok) throw new Error(`GET ${target} failed: ${res.status}`);
+  return {
+    items: (await res.json()) as T[],
+    cursor: res.headers.get("X-Next-Cursor"),
+  };
+}
+
+// A list the backend serves in keyset pages, naming the next one in X-Next-Cursor.
+// refresh() reloads the first page (keeping older pages already loaded),
+// loadMore() appends the next one.
+export function usePagedList<T extends { id: unknown }>(url: string) {
+  const [state, setState] = useState<PagedState<T>>({ items: [], cursor: null });
+  const loading = useRef(false);
+
+  const refresh = useCallback(async () => {
+    const first = await fetchPage<T>(url, null);
+    setState((prev) => {
+      const last = first.items[first.items.length - 1];
+      const at =
+        first.cursor && last ? prev.items.findIndex((i) => i.id === last.id) : -1;
+      // Pages loaded past the first still follow on from where it now ends
+      if (at === -1) return first;
+      return { items: [...first.items, ...prev.items.slice(at + 1)], cursor: prev.cursor };
+    });
+  }, [url]);
+
+  const loadMore = useCallback(async () => {
+    const cursor = state.cursor;
+    if (cursor === null || loading.current) return;
+    loading.current = true;
+    try {
+      const page = await fetchPage<T>(url, cursor);
+      setState((prev) => {
+        // A refresh in the meantime already decided what follows
+        if (prev.cursor !== cursor) return prev;
+        const seen = new Set(prev.items.map((i) => i.id));
+        return {
+          items: [...prev.items, ...page.items.filter((i) => !seen.has(i.id))],
+          cursor: page.cursor,
+        };
+      });
+    } catch (e) {
+      console.error("Page fetch failed", e);
+    } finally {
+      loading.current = false;
+    }
+  }, [url, state.cursor]);
+
+  const setItems = useCallback(
+    (update: (prev: T[]) => T[]) =>
+      setState((prev) => ({ ...prev, items: update(prev.items) })),
+    []
+  );
+
+  return {
+    items: state.items,
+    setItems,
+    hasMore: state.cursor !== null,
+    refresh,
+    loadMore,
+  };
+}